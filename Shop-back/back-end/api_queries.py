@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+ShopBack API查询语句
+fapi.py 执行的查询都定义在这里，schema_migrations.py check 用同样的语句检查查询计划，
+接口改动查询时检查自动跟上。{where} 替换为 where_clause() 生成的条件，
+{history} 替换为当前存储模式下的历史表 (history_store.history_table)
+"""
+from typing import List
+
+# /api/stores：按创建时间排序，updated_at每次抓取都会变化，按它翻页时行会在页之间移动
+STORES_SQL = '''
+    SELECT * FROM stores
+    {where}
+    ORDER BY created_at DESC, id DESC
+    LIMIT ? OFFSET ?
+'''
+# 游标分页：从上一页最后一行之后开始
+STORES_AFTER_CONDITION = '(created_at, id) < (?, ?)'
+
+# /api/stores/{store_id}/history：从最新数据快照读取，Main分类的数据即该商家的主要cashback信息，
+# scraped_at取最近一次观测的时间（数据未变化的抓取只更新store_fingerprints.last_seen_at）
+STORE_LATEST_SQL = '''
+    SELECT sl.history_id as id, sl.store_id, s.name as store_name, s.url as store_url,
+           COALESCE(m.category_rate, '0%') as main_cashback,
+           COALESCE(m.category_rate_numeric, 0.0) as main_rate_numeric,
+           sl.category, sl.category_rate, sl.category_rate_numeric,
+           COALESCE(m.is_upsized, 0) as is_upsized, m.previous_offer,
+           MAX(sl.scraped_at, COALESCE(f.last_seen_at, sl.scraped_at)) as scraped_at
+    FROM store_latest sl
+    JOIN stores s ON sl.store_id = s.id
+    LEFT JOIN store_latest m ON m.store_id = sl.store_id AND m.category = 'Main'
+    LEFT JOIN store_fingerprints f ON f.store_id = sl.store_id
+    {where}
+    ORDER BY sl.category
+    LIMIT ?
+'''
+
+# /api/history
+HISTORY_SQL = '''
+    SELECT ch.*, s.name as store_name, s.url as store_url
+    FROM {history} ch
+    JOIN stores s ON ch.store_id = s.id
+    {where}
+    ORDER BY ch.scraped_at DESC, ch.id DESC
+    LIMIT ? OFFSET ?
+'''
+HISTORY_AFTER_CONDITION = '(ch.scraped_at, ch.id) < (?, ?)'
+
+# /api/history/export：列顺序与history_export.EXPORT_COLUMNS一致，每批读取LIMIT行
+HISTORY_EXPORT_SQL = '''
+    SELECT ch.id, ch.store_id, s.name, s.url, ch.main_cashback, ch.main_rate_numeric,
+           ch.category, ch.category_rate, ch.category_rate_numeric, ch.is_upsized,
+           ch.previous_offer, ch.scraped_at
+    FROM {history} ch
+    JOIN stores s ON ch.store_id = s.id
+    {where}
+    ORDER BY ch.scraped_at, ch.id
+    LIMIT ?
+'''
+# 导出的下一批：从上一批最后一行之后开始
+HISTORY_EXPORT_AFTER_CONDITION = '(ch.scraped_at, ch.id) > (?, ?)'
+
+# /api/statistics
+STATISTICS_SQL = '''
+    SELECT s.name as store_name, rs.category, rs.current_rate,
+           rs.highest_rate, rs.lowest_rate, rs.highest_date, rs.lowest_date
+    FROM rate_statistics rs
+    JOIN stores s ON rs.store_id = s.id
+    {where}
+    ORDER BY s.name, rs.category
+'''
+
+# /api/top-cashback：主要cashback
+TOP_CASHBACK_SQL = '''
+    SELECT s.name, s.url, sl.category_rate as main_cashback,
+           sl.category_rate_numeric as main_rate_numeric,
+           sl.is_upsized, sl.scraped_at
+    FROM store_latest sl
+    JOIN stores s ON sl.store_id = s.id
+    WHERE sl.category = 'Main'
+    ORDER BY sl.category_rate_numeric DESC
+    LIMIT ?
+'''
+# /api/top-cashback?category=：特定分类
+TOP_CASHBACK_CATEGORY_SQL = '''
+    SELECT s.name, s.url, sl.category, sl.category_rate, sl.category_rate_numeric,
+           COALESCE(m.is_upsized, 0) as is_upsized, sl.scraped_at
+    FROM store_latest sl
+    JOIN stores s ON sl.store_id = s.id
+    LEFT JOIN store_latest m ON m.store_id = sl.store_id AND m.category = 'Main'
+    WHERE sl.category = ?
+    ORDER BY sl.category_rate_numeric DESC
+    LIMIT ?
+'''
+
+# /api/upsized-stores
+UPSIZED_STORES_SQL = '''
+    SELECT s.name, s.url, sl.category_rate as main_cashback,
+           sl.category_rate_numeric as main_rate_numeric,
+           sl.previous_offer, sl.scraped_at
+    FROM store_latest sl
+    JOIN stores s ON sl.store_id = s.id
+    WHERE sl.category = 'Main' AND sl.is_upsized = 1
+    ORDER BY sl.category_rate_numeric DESC
+'''
+
+# /api/trends/{store_id}（rows模式；intervals模式见history_store.INTERVAL_TRENDS_SQL）
+# 数据未变化的抓取不再写入历史行，每行从scraped_at起有效到同一分类的下一行，
+# 按天统计当天有效的记录（未变化的日子沿用上一次的值），参数为 (start, store_id, category, store_id, category)
+TRENDS_SQL = '''
+    WITH RECURSIVE days(day) AS (
+        SELECT MAX(DATE(?), (SELECT DATE(MIN(scraped_at)) FROM cashback_history
+                             WHERE store_id = ? AND category = ?))
+        UNION ALL
+        SELECT DATE(day, '+1 day') FROM days WHERE day < DATE('now')
+    ),
+    spans AS (
+        SELECT category_rate_numeric, scraped_at AS valid_from,
+               LEAD(scraped_at) OVER (ORDER BY scraped_at, id) AS valid_to
+        FROM cashback_history
+        WHERE store_id = ? AND category = ?
+    )
+    SELECT days.day AS date,
+           AVG(spans.category_rate_numeric) AS avg_rate,
+           MAX(spans.category_rate_numeric) AS max_rate,
+           MIN(spans.category_rate_numeric) AS min_rate,
+           COUNT(*) AS count
+    FROM days
+    JOIN spans
+        ON spans.valid_from < DATE(days.day, '+1 day')
+        AND (spans.valid_to IS NULL OR spans.valid_to > days.day)
+    GROUP BY days.day
+    ORDER BY days.day
+'''
+
+# DELETE /api/stores/{store_id}
+STORE_BY_ID_SQL = 'SELECT name, url FROM stores WHERE id = ?'
+# 按依赖顺序删除商家的数据，参数为store_id
+DELETE_STORE_SQL = [
+    'DELETE FROM rate_statistics WHERE store_id = ?',
+    'DELETE FROM cashback_history WHERE store_id = ?',
+    'DELETE FROM cashback_intervals WHERE store_id = ?',
+    'DELETE FROM store_fingerprints WHERE store_id = ?',
+    'DELETE FROM store_latest WHERE store_id = ?',
+    'DELETE FROM stores WHERE id = ?',
+]
+# 删除页面缓存，再次抓取时完整下载并重新创建商家，而不是收到304
+DELETE_PAGE_CACHE_SQL = 'DELETE FROM http_cache WHERE url = ?'
+
+def where_clause(conditions: List[str]) -> str:
+    """由条件列表生成WHERE子句，没有条件时为空"""
+    return ("WHERE " + " AND ".join(conditions)) if conditions else ""
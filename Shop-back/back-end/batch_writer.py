@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+ShopBack 批量写入器
+收集多次抓取的StoreInfo，达到数量或时间阈值时在一个事务中用executemany批量写入，
+批量抓取时不再每个商家提交（fsync）一次
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import history_store
+import response_cache
+from sb_scrap import (HISTORY_INSERT_SQL, StoreInfo, history_rows, rate_statistics_rows,
+                      rate_stats_upsert_sql, store_info_fingerprint)
+
+if TYPE_CHECKING:
+    from sb_scrap import ShopBackSQLiteScraper
+
+logger = logging.getLogger(__name__)
+
+# SQLite单条语句的参数个数有上限，IN查询分块执行
+SQL_CHUNK_SIZE = 500
+
+# 按URL批量查找商家，{placeholders}替换为与参数个数相同的占位符
+STORES_BY_URL_SQL = 'SELECT id, name, url FROM stores WHERE url IN ({placeholders})'
+
+# 页面未变化(304)的商家只记录本次观测，参数为 (name, url)
+TOUCH_FINGERPRINT_SQL = '''
+    UPDATE store_fingerprints
+    SET last_seen_at = CURRENT_TIMESTAMP, seen_count = seen_count + 1
+    WHERE store_id = (SELECT id FROM stores WHERE name = ? AND url = ?)
+'''
+TOUCH_STORE_SQL = 'UPDATE stores SET updated_at = CURRENT_TIMESTAMP WHERE name = ? AND url = ?'
+
+class BatchWriter:
+    """写入缓冲区，与抓取器共用数据库连接和写锁"""
+    
+    def __init__(self, scraper: "ShopBackSQLiteScraper", max_batch: int = 200, max_delay: float = 5.0,
+                 on_commit: Optional[Callable[[StoreInfo, Optional[Exception]], None]] = None):
+        """
+        on_commit: 每条数据提交（或写入失败）后在执行写入的线程中调用 on_commit(store_info, error)，
+                   error为None表示已提交；调用方据此在数据落盘后才把任务标记为完成
+        """
+        self.scraper = scraper
+        self.on_commit = on_commit
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending: List[StoreInfo] = []
+        self.touched: List[StoreInfo] = []  # 页面返回304、只需记录观测的商家
+        self.lock = threading.Lock()
+        self.store_ids: Dict[Tuple[str, str], int] = {}
+        self.last_flush = time.monotonic()
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_periodically, name="batch-writer", daemon=True)
+        self.flusher.start()
+    
+    def add(self, store_info: StoreInfo):
+        """加入缓冲区，达到数量或时间阈值时立即写入"""
+        self._buffer(self.pending, store_info)
+    
+    def touch(self, store_info: StoreInfo):
+        """页面未变化(304)：本次观测随下一批数据一起提交"""
+        self._buffer(self.touched, store_info)
+    
+    def _buffer(self, buffer: List[StoreInfo], store_info: StoreInfo):
+        with self.lock:
+            buffer.append(store_info)
+            due = (len(self.pending) + len(self.touched) >= self.max_batch or
+                   time.monotonic() - self.last_flush >= self.max_delay)
+        if due:
+            self.flush()
+    
+    def close(self):
+        """写入剩余数据并停止定时线程"""
+        self.closed.set()
+        self.flusher.join()
+        self.flush()
+    
+    def _flush_periodically(self):
+        """空闲时也按时间阈值写入"""
+        while not self.closed.wait(self.max_delay):
+            if time.monotonic() - self.last_flush >= self.max_delay:
+                self.flush()
+    
+    def flush(self) -> int:
+        """在一个事务中写入缓冲区的全部数据，返回写入的商家数（含只记录观测的商家）"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+            touched, self.touched = self.touched, []
+            self.last_flush = time.monotonic()
+        if not batch and not touched:
+            return 0
+        
+        scraper = self.scraper
+        with scraper.db_lock:
+            try:
+                cursor = scraper.conn.cursor()
+                changed = self._write_batch(cursor, batch) if batch else 0
+                updated = self._touch_stores(cursor, touched) if touched else 0
+                scraper.conn.commit()
+                logger.info(f"批量写入完成: {len(batch)} 个商家, 其中 {changed} 个数据有变化, "
+                            f"{updated} 个页面未变化")
+            except Exception as e:
+                scraper.conn.rollback()
+                self.store_ids.clear()
+                logger.error(f"批量写入失败，改为逐个写入: {e}")
+                batch_failed = True
+            else:
+                batch_failed = False
+        
+        if not batch_failed:
+            # 每批只让API缓存失效一次，304的商家都已不存在时不失效
+            if batch or updated:
+                response_cache.bump_generation()
+            for store_info in batch + touched:
+                self._committed(store_info, None)
+            return len(batch) + len(touched)
+        
+        # 逐个写入时由save_to_database/mark_store_unchanged各自让缓存失效
+        for store_info in batch + touched:
+            try:
+                if store_info.not_modified:
+                    scraper.mark_store_unchanged(store_info)
+                else:
+                    scraper.save_to_database(store_info, raise_errors=True)
+            except Exception as e:
+                self._committed(store_info, e)
+            else:
+                self._committed(store_info, None)
+        return len(batch) + len(touched)
+    
+    def _touch_stores(self, cursor, touched: List[StoreInfo]) -> int:
+        """记录页面未变化的商家的本次观测（不提交），返回更新的商家数"""
+        keys = [(info.name, info.url) for info in touched]
+        cursor.executemany(TOUCH_FINGERPRINT_SQL, keys)
+        cursor.executemany(TOUCH_STORE_SQL, keys)
+        return cursor.rowcount
+    
+    def _committed(self, store_info: StoreInfo, error: Optional[Exception]):
+        """数据已提交：保存页面缓存（供下次304复用）并通知调用方；写入失败时不缓存"""
+        try:
+            # 304的结果本来就来自页面缓存
+            if error is None and not store_info.not_modified:
+                self.scraper.cache_result(store_info)
+            if self.on_commit is not None:
+                self.on_commit(store_info, error)
+        except Exception as e:
+            logger.error(f"提交后处理失败 {store_info.url}: {e}")
+    
+    def _resolve_store_ids(self, cursor, batch: List[StoreInfo]):
+        """批量插入商家并把 (name, url) -> store_id 缓存在内存中"""
+        missing = list({(info.name, info.url) for info in batch} - self.store_ids.keys())
+        if not missing:
+            return
+        
+        cursor.executemany('''
+            INSERT OR IGNORE INTO stores (name, url) VALUES (?, ?)
+        ''', missing)
+        
+        wanted = set(missing)
+        urls = list({url for _, url in missing})
+        for i in range(0, len(urls), SQL_CHUNK_SIZE):
+            chunk = urls[i:i + SQL_CHUNK_SIZE]
+            cursor.execute(STORES_BY_URL_SQL.format(placeholders=','.join('?' * len(chunk))), chunk)
+            for store_id, name, url in cursor.fetchall():
+                if (name, url) in wanted:
+                    self.store_ids[(name, url)] = store_id
+    
+    def _load_fingerprints(self, cursor, store_ids: List[int]) -> Dict[int, str]:
+        """批量读取商家当前的数据指纹"""
+        fingerprints = {}
+        for i in range(0, len(store_ids), SQL_CHUNK_SIZE):
+            chunk = store_ids[i:i + SQL_CHUNK_SIZE]
+            cursor.execute(f'''
+                SELECT store_id, fingerprint FROM store_fingerprints
+                WHERE store_id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            fingerprints.update(cursor.fetchall())
+        return fingerprints
+    
+    def _write_batch(self, cursor, batch: List[StoreInfo]) -> int:
+        """写入一批数据（不提交），返回数据有变化的商家数"""
+        self._resolve_store_ids(cursor, batch)
+        fingerprints = self._load_fingerprints(
+            cursor, list({self.store_ids[(info.name, info.url)] for info in batch}))
+        
+        current_time = datetime.now().isoformat()
+        # 每批读取一次存储模式（可能已被迁移命令切换）
+        intervals_mode = self.scraper.history_mode == history_store.INTERVALS_MODE
+        unchanged_ids, changed_ids = [], []
+        history, stats, new_fingerprints = [], [], []
+        
+        for info in batch:
+            store_id = self.store_ids[(info.name, info.url)]
+            fingerprint = store_info_fingerprint(info)
+            if fingerprints.get(store_id) == fingerprint:
+                unchanged_ids.append((store_id,))
+                continue
+            
+            fingerprints[store_id] = fingerprint
+            changed_ids.append((store_id,))
+            new_fingerprints.append((store_id, fingerprint))
+            
+            if intervals_mode:
+                history_store.record_intervals(cursor, store_id, info)
+            else:
+                history.extend(history_rows(store_id, info))
+            
+            stats.extend(rate_statistics_rows(store_id, info, current_time))
+        
+        if unchanged_ids:
+            cursor.executemany('''
+                UPDATE store_fingerprints
+                SET last_seen_at = CURRENT_TIMESTAMP, seen_count = seen_count + 1
+                WHERE store_id = ?
+            ''', unchanged_ids)
+        if history:
+            cursor.executemany(HISTORY_INSERT_SQL, history)
+        if stats:
+            cursor.executemany(rate_stats_upsert_sql(), stats)
+        if new_fingerprints:
+            cursor.executemany('''
+                INSERT INTO store_fingerprints (store_id, fingerprint) VALUES (?, ?)
+                ON CONFLICT(store_id) DO UPDATE SET
+                    fingerprint = excluded.fingerprint,
+                    first_seen_at = CURRENT_TIMESTAMP,
+                    last_seen_at = CURRENT_TIMESTAMP,
+                    seen_count = 1
+            ''', new_fingerprints)
+        cursor.executemany('''
+            UPDATE stores SET updated_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', unchanged_ids + changed_ids)
+        
+        return len(changed_ids)
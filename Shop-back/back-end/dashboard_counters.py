@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+ShopBack 仪表盘计数器
+dashboard_counters 单行表保存商家总数、历史记录数、upsized商家数和最新Main比例的累计和，
+scrape_buckets 按小时保存写入的历史记录数（最近24小时的抓取数 = 最近24个小时桶之和），
+rows模式下数据未变化的抓取不写历史行，按该商家的分类数计入小时桶（与写入历史行时的计数一致），
+都由 stores / cashback_history / cashback_intervals / store_latest / store_fingerprints 上的触发器
+在写入的同一事务中更新，
+/api/dashboard 只需读取一行，不再扫描历史表
+
+由现有数据重新计算（计数器与数据不一致时）:
+    python dashboard_counters.py rebuild shopback_data.db
+"""
+import sqlite3
+import sys
+from typing import Dict
+
+import history_store
+
+# 小时桶保留的天数
+BUCKET_RETENTION_DAYS = 7
+
+# 时间戳所在的小时桶
+BUCKET_SQL = "strftime('%Y-%m-%d %H:00:00', {timestamp})"
+
+# 仪表盘统计：计数器行 + 最近24个小时桶之和，{column}为当前存储模式的历史记录数列
+DASHBOARD_SQL = f'''
+    SELECT total_stores, {{column}} AS total_records, upsized_stores,
+           CASE WHEN main_rate_count > 0 THEN main_rate_sum / main_rate_count ELSE 0.0 END AS avg_rate,
+           (SELECT COALESCE(SUM({{column}}), 0) FROM scrape_buckets
+            WHERE bucket >= {BUCKET_SQL.format(timestamp="'now', '-23 hours'")}) AS recent_scrapes
+    FROM dashboard_counters WHERE id = 1
+'''
+
+def init_counter_tables(cursor):
+    """创建计数器表、小时桶表和维护触发器"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_counters (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_stores INTEGER NOT NULL DEFAULT 0,
+            history_records INTEGER NOT NULL DEFAULT 0,
+            interval_records INTEGER NOT NULL DEFAULT 0,
+            upsized_stores INTEGER NOT NULL DEFAULT 0,
+            main_rate_sum REAL NOT NULL DEFAULT 0,
+            main_rate_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO dashboard_counters (id) VALUES (1)')
+    
+    # 每小时写入的历史记录数，rows/intervals两种模式分别计数
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_buckets (
+            bucket TEXT PRIMARY KEY,
+            history_records INTEGER NOT NULL DEFAULT 0,
+            interval_records INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    # 商家数
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_counters_store_insert
+        AFTER INSERT ON stores
+        BEGIN
+            UPDATE dashboard_counters SET total_stores = total_stores + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_counters_store_delete
+        AFTER DELETE ON stores
+        BEGIN
+            UPDATE dashboard_counters SET total_stores = total_stores - 1 WHERE id = 1;
+        END
+    ''')
+    
+    # 历史记录数和小时桶：rows模式写cashback_history，intervals模式写cashback_intervals
+    for table, column, timestamp in (('cashback_history', 'history_records', 'scraped_at'),
+                                     ('cashback_intervals', 'interval_records', 'valid_from')):
+        new_bucket = BUCKET_SQL.format(timestamp=f'COALESCE(NEW.{timestamp}, CURRENT_TIMESTAMP)')
+        old_bucket = BUCKET_SQL.format(timestamp=f'OLD.{timestamp}')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_counters_{table}_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                UPDATE dashboard_counters SET {column} = {column} + 1 WHERE id = 1;
+                INSERT INTO scrape_buckets (bucket, {column}) VALUES ({new_bucket}, 1)
+                ON CONFLICT(bucket) DO UPDATE SET {column} = {column} + 1;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_counters_{table}_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                UPDATE dashboard_counters SET {column} = {column} - 1 WHERE id = 1;
+                UPDATE scrape_buckets SET {column} = {column} - 1 WHERE bucket = {old_bucket};
+            END
+        ''')
+    
+    # 每小时第一次写入时清理过期的小时桶
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_scrape_buckets_prune
+        AFTER INSERT ON scrape_buckets
+        BEGIN
+            DELETE FROM scrape_buckets
+            WHERE bucket < {BUCKET_SQL.format(timestamp=f"'now', '-{BUCKET_RETENTION_DAYS} days'")};
+        END
+    ''')
+    
+    init_observation_trigger(cursor)
+    
+    # upsized商家数和最新Main比例的累计和（AVG忽略NULL，计数也只计非NULL比例）
+    add_new = '''
+        upsized_stores = upsized_stores + (COALESCE(NEW.is_upsized, 0) != 0),
+        main_rate_sum = main_rate_sum + COALESCE(NEW.category_rate_numeric, 0),
+        main_rate_count = main_rate_count + (NEW.category_rate_numeric IS NOT NULL)
+    '''
+    remove_old = '''
+        upsized_stores = upsized_stores - (COALESCE(OLD.is_upsized, 0) != 0),
+        main_rate_sum = main_rate_sum - COALESCE(OLD.category_rate_numeric, 0),
+        main_rate_count = main_rate_count - (OLD.category_rate_numeric IS NOT NULL)
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_counters_latest_insert
+        AFTER INSERT ON store_latest
+        WHEN NEW.category = 'Main'
+        BEGIN
+            UPDATE dashboard_counters SET {add_new} WHERE id = 1;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_counters_latest_update
+        AFTER UPDATE ON store_latest
+        WHEN NEW.category = 'Main' OR OLD.category = 'Main'
+        BEGIN
+            UPDATE dashboard_counters SET {remove_old} WHERE id = 1 AND OLD.category = 'Main';
+            UPDATE dashboard_counters SET {add_new} WHERE id = 1 AND NEW.category = 'Main';
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_counters_latest_delete
+        AFTER DELETE ON store_latest
+        WHEN OLD.category = 'Main'
+        BEGIN
+            UPDATE dashboard_counters SET {remove_old} WHERE id = 1;
+        END
+    ''')
+
+def init_observation_trigger(cursor):
+    """
+    数据未变化的抓取只增加store_fingerprints.seen_count，不写cashback_history，
+    按该商家最新快照的分类数计入rows模式的小时桶，最近24小时的抓取数仍统计每次观测
+    （数据变化时seen_count重置为1，由历史行的触发器计数）
+    """
+    bucket = BUCKET_SQL.format(timestamp='CURRENT_TIMESTAMP')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_counters_observation
+        AFTER UPDATE OF seen_count ON store_fingerprints
+        WHEN NEW.seen_count > OLD.seen_count
+        BEGIN
+            INSERT INTO scrape_buckets (bucket, history_records)
+            SELECT {bucket}, COUNT(*) FROM store_latest WHERE store_id = NEW.store_id
+            ON CONFLICT(bucket) DO UPDATE SET history_records = history_records + excluded.history_records;
+        END
+    ''')
+
+def rebuild_counters(cursor):
+    """
+    由现有数据重新计算计数器和小时桶
+    （INSERT OR REPLACE 替换行时不会触发DELETE触发器，批量重建快照后需要调用；
+    数据未变化的抓取没有留下历史行，重建后的小时桶只包含写入的历史行）
+    """
+    if not cursor.execute('''
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dashboard_counters'
+    ''').fetchone():
+        return
+    
+    cursor.execute('''
+        UPDATE dashboard_counters SET
+            total_stores = (SELECT COUNT(*) FROM stores),
+            history_records = (SELECT COUNT(*) FROM cashback_history),
+            interval_records = (SELECT COUNT(*) FROM cashback_intervals),
+            upsized_stores = (SELECT COUNT(*) FROM store_latest
+                              WHERE category = 'Main' AND COALESCE(is_upsized, 0) != 0),
+            main_rate_sum = (SELECT COALESCE(SUM(category_rate_numeric), 0) FROM store_latest
+                             WHERE category = 'Main'),
+            main_rate_count = (SELECT COUNT(category_rate_numeric) FROM store_latest
+                               WHERE category = 'Main')
+        WHERE id = 1
+    ''')
+    
+    cursor.execute('DELETE FROM scrape_buckets')
+    since = f"datetime('now', '-{BUCKET_RETENTION_DAYS} days')"
+    for table, column, timestamp in (('cashback_history', 'history_records', 'scraped_at'),
+                                     ('cashback_intervals', 'interval_records', 'valid_from')):
+        cursor.execute(f'''
+            INSERT INTO scrape_buckets (bucket, {column})
+            SELECT {BUCKET_SQL.format(timestamp=timestamp)} AS bucket, COUNT(*)
+            FROM {table} WHERE {timestamp} >= {since}
+            GROUP BY bucket
+            ON CONFLICT(bucket) DO UPDATE SET {column} = excluded.{column}
+        ''')
+
+def read_dashboard(conn, mode: str) -> Dict:
+    """一次查询读取仪表盘统计：计数器行 + 最近24个小时桶之和"""
+    column = 'interval_records' if mode == history_store.INTERVALS_MODE else 'history_records'
+    row = conn.execute(DASHBOARD_SQL.format(column=column)).fetchone()
+    return {
+        "total_stores": row[0],
+        "total_records": row[1],
+        "recent_scrapes": row[4],
+        "upsized_stores": row[2],
+        "avg_cashback_rate": round(row[3] or 0.0, 2),
+    }
+
+def main():
+    """命令行入口"""
+    args = sys.argv[1:]
+    if not args or args[0] != 'rebuild':
+        print(__doc__)
+        return
+    
+    conn = sqlite3.connect(args[1] if len(args) > 1 else 'shopback_data.db')
+    try:
+        rebuild_counters(conn.cursor())
+        conn.commit()
+        print(read_dashboard(conn, history_store.get_history_mode(conn)))
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
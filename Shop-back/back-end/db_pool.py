@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+SQLite 连接池
+WAL模式下一个写连接 + 多个只读连接：读请求使用独立的只读连接，不会等待抓取任务提交，
+同一进程内的所有写操作共用一个写连接并由写锁串行化
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# 每个连接的pragma设置
+CONNECTION_PRAGMAS = {
+    'synchronous': 'NORMAL',  # WAL模式下NORMAL不会损坏数据，只在checkpoint时fsync
+    'cache_size': -32000,     # 约32MB页缓存
+    'mmap_size': 268435456,   # 256MB内存映射读
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+class PoolTimeout(Exception):
+    """在限定时间内没有空闲的只读连接"""
+
+class PooledConnection:
+    """连接池中的连接，close()时归还连接池而不是真正关闭"""
+    
+    def __init__(self, conn: sqlite3.Connection, release):
+        self._conn = conn
+        self._release = release
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def close(self):
+        """归还连接"""
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(self._conn)
+
+class SQLitePool:
+    """SQLite连接池：单写连接 + 有上限的只读连接"""
+    
+    def __init__(self, db_path: str, max_readers: int = 8):
+        self.db_path = os.path.abspath(db_path)
+        self.max_readers = max_readers
+        self.write_lock = threading.RLock()
+        self.writer_conn = self._connect(readonly=False)
+        self.writer_conn.execute('PRAGMA journal_mode=WAL')
+        self.idle_readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self.reader_slots = threading.BoundedSemaphore(max_readers)
+    
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        """创建连接并应用pragma设置"""
+        if readonly:
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in CONNECTION_PRAGMAS.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+    
+    def acquire_reader(self, timeout: Optional[float] = None) -> PooledConnection:
+        """借出一个只读连接，连接数达到上限时等待；timeout秒内没有空闲连接时抛出PoolTimeout"""
+        if not self.reader_slots.acquire(timeout=timeout):
+            raise PoolTimeout(f"{timeout}秒内没有空闲的只读连接")
+        try:
+            conn = self.idle_readers.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect(readonly=True)
+            except Exception:
+                self.reader_slots.release()
+                raise
+        return PooledConnection(conn, self._release_reader)
+    
+    def _release_reader(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle_readers.put(conn)
+        self.reader_slots.release()
+    
+    def acquire_writer(self) -> PooledConnection:
+        """获取写连接（持有写锁直到close）"""
+        self.write_lock.acquire()
+        return PooledConnection(self.writer_conn, self._release_writer)
+    
+    def _release_writer(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        finally:
+            self.write_lock.release()
+    
+    @contextmanager
+    def reader(self):
+        """with pool.reader() as conn: 只读查询"""
+        conn = self.acquire_reader()
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    @contextmanager
+    def writer(self):
+        """with pool.writer() as conn: 写操作，需要自行commit"""
+        conn = self.acquire_writer()
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def close(self):
+        """关闭所有连接"""
+        while True:
+            try:
+                self.idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.write_lock:
+            self.writer_conn.close()
+
+_pools: Dict[str, SQLitePool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: str) -> SQLitePool:
+    """获取数据库文件对应的连接池（同一进程内共享）"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SQLitePool(key)
+        return _pools[key]
+
+def close_pool(db_path: str):
+    """关闭并移除数据库文件对应的连接池"""
+    with _pools_lock:
+        pool = _pools.pop(os.path.abspath(db_path), None)
+    if pool is not None:
+        pool.close()
@@ -3,9 +3,11 @@
 ShopBack FastAPI后端
 为React前端提供RESTful API接口
 """
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Depends
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match
 from pydantic import BaseModel, HttpUrl
 from typing import List, Optional, Dict, Any
 import sqlite3
@@ -19,6 +21,17 @@ import json
 import schedule
 # 导入我们的抓取器
 from sb_scrap import ShopBackSQLiteScraper, StoreInfo, CashbackRate
+from scrape_executor import ScrapeExecutor, ScrapeQueueFull
+from scrape_scheduler import ScrapeScheduler, plan_summary
+from db_pool import PoolTimeout, get_pool
+import api_queries
+import dashboard_counters
+import history_export
+import history_store
+import store_search
+from page_cursor import NEXT_CURSOR_HEADER, decode_cursor, next_cursor
+from response_cache import (cached_response, get_response_cache, bump_generation,
+                            generation_etag, body_etag, etag_matches)
 
 # Pydantic模型定义
 class StoreResponse(BaseModel):
@@ -74,6 +87,53 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# 只读取抓取数据的接口：数据只在写入提交时变化，ETag由数据代数生成，匹配时不执行查询
+GENERATION_ETAG_ROUTES = {
+    "/api/dashboard", "/api/stores", "/api/stores/search", "/api/stores/{store_id}/history",
+    "/api/history", "/api/statistics", "/api/top-cashback", "/api/upsized-stores",
+    "/api/trends/{store_id}",
+}
+# 每次使用前都向服务器验证ETag
+API_CACHE_CONTROL = "private, no-cache"
+
+def route_path(request: Request) -> Optional[str]:
+    """请求匹配的路由路径模板"""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", None)
+    return None
+
+# ETag中间件（在CORS中间件之前注册，304响应同样带CORS头）
+@app.middleware("http")
+async def etag_middleware(request: Request, call_next):
+    """GET接口返回ETag和Cache-Control，If-None-Match匹配时返回304"""
+    if request.method != "GET" or not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    
+    if_none_match = request.headers.get("if-none-match")
+    cache_headers = {"Cache-Control": API_CACHE_CONTROL}
+    if route_path(request) in GENERATION_ETAG_ROUTES:
+        # 先读取代数再执行查询：查询期间有写入时ETag偏旧，下次请求不会误判为未变化
+        etag = generation_etag()
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, **cache_headers})
+        response = await call_next(request)
+        if response.status_code == 200:
+            response.headers.update({"ETag": etag, **cache_headers})
+        return response
+    
+    # 其他接口（任务状态等）由响应内容生成ETag，节省传输；流式导出等非JSON响应不缓冲
+    response = await call_next(request)
+    if response.status_code != 200 or not response.headers.get("content-type", "").startswith("application/json"):
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = body_etag(body)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, **cache_headers})
+    headers = {**response.headers, "ETag": etag, **cache_headers}
+    return Response(content=body, status_code=200, headers=headers)
+
 # CORS中间件配置
 app.add_middleware(
     CORSMiddleware,
@@ -81,47 +141,124 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],  # 前端读取下一页游标
 )
 
 # 全局变量
 scraper_instance = None
+scraper_lock = threading.RLock()  # 创建执行器时会在锁内创建抓取器
+scrape_executor = None
 db_path = "shopback_data.db"
+# 接口等待只读连接的最长秒数，超时返回503
+db_acquire_timeout = 5.0
+
+# 批量抓取配置：并发请求数（上限scrape_max_concurrency）和每个host每秒请求数
+scrape_concurrency = 16
+scrape_max_concurrency = 64
+scrape_requests_per_second = 5.0
+# 所有抓取任务合计的每个host每秒请求数上限，单个任务的速率不会超过它
+scrape_host_requests_per_second = 10.0
+
+# 抓取执行器配置：工作线程数和任务队列上限
+scrape_workers = 2
+scrape_queue_size = 100
+# 批量抓取的解析进程数，None为CPU核数，0表示在抓取线程中解析
+scrape_parse_processes = None
+
+# 定时抓取：按商家的比例变化频率调度，每tick_minutes分钟提交一次到期的商家
+scrape_scheduler = ScrapeScheduler(tick_minutes=10)
+scheduled_run_id = None
 
 # 日志设置
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 def auto_rescrape():
+    global scheduled_run_id
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        executor = get_scrape_executor()
+        # 上一次提交的商家还没抓完时不重复提交
+        if scheduled_run_id is not None and executor.is_pending(scheduled_run_id):
+            return
         
-        # 获取所有商家URL
-        cursor.execute("SELECT url FROM stores")
-        urls = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        conn = get_db_connection()
+        try:
+            # 已到期的商家，按逾期程度排序并受每次调度的数量上限限制
+            due = scrape_scheduler.due_stores(conn)
+        finally:
+            conn.close()
+        if not due:
+            return
         
-        # 执行批量抓取
-        asyncio.run(scrape_multiple_background(urls, 2))
+        # 提交到抓取执行器，由工作线程执行
+        urls = [plan.url for plan in due]
+        run = executor.submit_batch(urls, scrape_concurrency, scrape_requests_per_second, kind='scheduled')
+        scheduled_run_id = run.id
         
-        logger.info(f"定时抓取完成，共处理 {len(urls)} 个商家")
+        logger.info(f"定时抓取任务已提交 #{run.id}，共 {run.total} 个到期商家")
     except Exception as e:
         logger.error(f"定时抓取失败: {e}")
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+def get_db_connection(write: bool = False, timeout: Optional[float] = None):
+    """
+    从连接池获取数据库连接（默认只读），conn.close()归还连接池
+    timeout秒内没有空闲的只读连接时抛出PoolTimeout，None表示一直等待
+    """
+    pool = get_pool(db_path)
+    return pool.acquire_writer() if write else pool.acquire_reader(timeout)
+
+async def db_connection():
+    """
+    在线程池中获取只读连接，等待连接池时不阻塞事件循环，db_acquire_timeout秒内没有空闲连接时返回503
+    写连接持有的写锁必须在获取它的线程中释放，写操作不要使用这里
+    """
+    return await run_in_threadpool(get_db_connection, False, db_acquire_timeout)
+
+def get_history_table(conn) -> str:
+    """按当前历史存储模式返回可按cashback_history列查询的表名"""
+    return history_store.history_table(history_store.get_history_mode(conn))
+
+def decode_page_cursor(kind: str, value: str):
+    """解析分页游标，无效时返回400"""
+    try:
+        return decode_cursor(kind, value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    """有下一页时在响应头中返回游标"""
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
 
 def get_scraper():
     """获取抓取器实例"""
     global scraper_instance
-    if scraper_instance is None:
-        scraper_instance = ShopBackSQLiteScraper(db_path)
+    with scraper_lock:
+        if scraper_instance is None:
+            # 连接池在这里一次定好：每个工作线程同时运行一个批量任务，并发数最多scrape_max_concurrency
+            scraper_instance = ShopBackSQLiteScraper(db_path, pool_maxsize=scrape_workers * scrape_max_concurrency,
+                                                     requests_per_second=scrape_host_requests_per_second)
     return scraper_instance
 
+def get_scrape_executor():
+    """获取抓取执行器实例"""
+    global scrape_executor
+    with scraper_lock:
+        if scrape_executor is None:
+            scrape_executor = ScrapeExecutor(get_scraper, db_path, max_workers=scrape_workers,
+                                             max_queue=scrape_queue_size,
+                                             parse_processes=scrape_parse_processes)
+            scrape_executor.start()
+    return scrape_executor
+
+def submit_batch_scrape(urls: List[str], concurrency: int, requests_per_second: float, kind: str = 'batch'):
+    """提交批量抓取任务，未完成的任务已达上限时返回503"""
+    try:
+        return get_scrape_executor().submit_batch(urls, concurrency, requests_per_second, kind)
+    except ScrapeQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 # API路由
 @app.post("/api/rescrape-all", summary="重新抓取所有商家")
-async def rescrape_all_stores(background_tasks: BackgroundTasks):
+async def rescrape_all_stores():
     """重新抓取所有商家的数据"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -131,12 +268,15 @@ async def rescrape_all_stores(background_tasks: BackgroundTasks):
         cursor.execute("SELECT url FROM stores")
         urls = [row[0] for row in cursor.fetchall()]
         
-        # 在后台执行批量抓取
-        background_tasks.add_task(scrape_multiple_background, urls, 2)
+        # 提交到抓取执行器
+        run = submit_batch_scrape(urls, scrape_concurrency, scrape_requests_per_second, kind='rescrape_all')
         
         return {
             "success": True,
-            "message": f"重新抓取任务已启动，共{len(urls)}个商家"
+            "message": f"重新抓取任务已启动，共{run.total}个商家" +
+                       (f"（{run.duplicates}个已在队列中）" if run.duplicates else ""),
+            "job_id": run.id,
+            "duplicates": run.duplicates
         }
     finally:
         conn.close()
@@ -150,88 +290,69 @@ async def root():
     }
 
 @app.get("/api/dashboard", response_model=DashboardStats, summary="获取仪表盘统计数据")
+@cached_response
 async def get_dashboard_stats():
-    """获取仪表盘统计数据"""
+    """获取仪表盘统计数据（读取写入时维护的计数器）"""
     conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        # 总商家数
-        cursor.execute("SELECT COUNT(*) FROM stores")
-        total_stores = cursor.fetchone()[0]
-        
-        # 总记录数
-        cursor.execute("SELECT COUNT(*) FROM cashback_history")
-        total_records = cursor.fetchone()[0]
-        
-        # 最近24小时的抓取数
-        yesterday = (datetime.now() - timedelta(days=1)).isoformat()
-        cursor.execute("SELECT COUNT(*) FROM cashback_history WHERE scraped_at > ?", (yesterday,))
-        recent_scrapes = cursor.fetchone()[0]
-        
-        # 当前upsized的商家数
-        cursor.execute("""
-            SELECT COUNT(DISTINCT store_id) FROM cashback_history 
-            WHERE is_upsized = 1 AND id IN (
-                SELECT MAX(id) FROM cashback_history GROUP BY store_id
-            )
-        """)
-        upsized_stores = cursor.fetchone()[0]
-        
-        # 平均cashback比例
-        cursor.execute("""
-            SELECT AVG(main_rate_numeric) FROM (
-                SELECT DISTINCT store_id, main_rate_numeric 
-                FROM cashback_history 
-                WHERE id IN (
-                    SELECT MAX(id) FROM cashback_history GROUP BY store_id
-                )
-            )
-        """)
-        avg_rate = cursor.fetchone()[0] or 0.0
-        
-        return DashboardStats(
-            total_stores=total_stores,
-            total_records=total_records,
-            recent_scrapes=recent_scrapes,
-            upsized_stores=upsized_stores,
-            avg_cashback_rate=round(avg_rate, 2)
-        )
+        stats = dashboard_counters.read_dashboard(conn, history_store.get_history_mode(conn))
+        return DashboardStats(**stats)
     
     finally:
         conn.close()
 
 @app.get("/api/stores", response_model=List[StoreResponse], summary="获取所有商家")
+@cached_response
 async def get_stores(
+    response: Response,
     limit: int = Query(50, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
-    search: Optional[str] = Query(None, description="按名称搜索商家")
+    offset: int = Query(0, ge=0, description="兼容旧的分页方式，提供cursor时忽略"),
+    search: Optional[str] = Query(None, description="按名称搜索商家"),
+    after: Optional[str] = Query(None, alias="cursor", description="上一页响应头X-Next-Cursor中的游标")
 ):
-    """获取商家列表"""
+    """获取商家列表，下一页的游标在响应头X-Next-Cursor中"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
+        conditions = []
+        params = []
         if search:
-            cursor.execute("""
-                SELECT * FROM stores 
-                WHERE name LIKE ? 
-                ORDER BY updated_at DESC 
-                LIMIT ? OFFSET ?
-            """, (f"%{search}%", limit, offset))
-        else:
-            cursor.execute("""
-                SELECT * FROM stores 
-                ORDER BY updated_at DESC 
-                LIMIT ? OFFSET ?
-            """, (limit, offset))
+            name_condition, name_params = store_search.name_filter(conn, search, 'id', 'name')
+            conditions.append(name_condition)
+            params.extend(name_params)
+        if after:
+            # 游标分页：从上一页最后一行之后开始，不再使用OFFSET
+            conditions.append(api_queries.STORES_AFTER_CONDITION)
+            params.extend(decode_page_cursor("stores", after))
+            offset = 0
+        
+        cursor.execute(api_queries.STORES_SQL.format(where=api_queries.where_clause(conditions)),
+                       (*params, limit, offset))
         
         stores = cursor.fetchall()
+        set_next_cursor(response, next_cursor("stores", stores, limit, "created_at"))
         return [StoreResponse(**dict(store)) for store in stores]
     
     finally:
         conn.close()
 
+@app.get("/api/stores/search", summary="搜索商家")
+async def search_stores(
+    q: str = Query(..., min_length=1, max_length=100, description="商家名称或URL关键词"),
+    limit: int = Query(10, ge=1, le=50),
+    fuzzy: bool = Query(True, description="没有足够结果时进行拼写容错匹配")
+):
+    """按名称/URL搜索商家：名称前缀优先，其次子串匹配，最后拼写容错"""
+    conn = get_db_connection()
+    
+    try:
+        return store_search.search_stores(conn, q, limit, fuzzy)
+    
+    finally:
+        conn.close()
+
 @app.get("/api/stores/{store_id}/history", response_model=List[CashbackHistoryResponse], summary="获取商家历史数据")
 async def get_store_history(
     store_id: int,
@@ -243,34 +364,16 @@ async def get_store_history(
     cursor = conn.cursor()
     
     try:
+        # 从最新数据快照读取，Main分类的数据即该商家的主要cashback信息
+        conditions = ["sl.store_id = ?"]
+        params = [store_id]
         if category:
-            cursor.execute("""
-                SELECT ch.*, s.name as store_name, s.url as store_url
-                FROM cashback_history ch
-                JOIN stores s ON ch.store_id = s.id
-                WHERE ch.store_id = ? AND ch.category = ?
-                AND ch.scraped_at = (
-                    SELECT MAX(scraped_at) 
-                    FROM cashback_history 
-                    WHERE store_id = ch.store_id
-                )
-                ORDER BY ch.category
-                LIMIT ?
-            """, (store_id, category, limit))
-        else:
-            cursor.execute("""
-                SELECT ch.*, s.name as store_name, s.url as store_url
-                FROM cashback_history ch
-                JOIN stores s ON ch.store_id = s.id
-                WHERE ch.store_id = ?
-                AND ch.scraped_at = (
-                    SELECT MAX(scraped_at) 
-                    FROM cashback_history 
-                    WHERE store_id = ch.store_id
-                )
-                ORDER BY ch.category
-                LIMIT ?
-            """, (store_id, limit))
+            conditions.append("sl.category = ?")
+            params.append(category)
+        params.append(limit)
+        
+        cursor.execute(api_queries.STORE_LATEST_SQL.format(where=api_queries.where_clause(conditions)),
+                       params)
         
         history = cursor.fetchall()
         return [CashbackHistoryResponse(**dict(record)) for record in history]
@@ -280,14 +383,18 @@ async def get_store_history(
 
 @app.get("/api/history", response_model=List[CashbackHistoryResponse], summary="获取所有历史数据")
 async def get_all_history(
+    response: Response,
     limit: int = Query(100, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0, description="兼容旧的分页方式，提供cursor时忽略"),
+    after: Optional[str] = Query(None, alias="cursor", description="上一页响应头X-Next-Cursor中的游标"),
     store_name: Optional[str] = Query(None, description="按商家名称筛选"),
     is_upsized: Optional[bool] = Query(None, description="按是否upsized筛选"),
     min_rate: Optional[float] = Query(None, description="最小cashback比例"),
     max_rate: Optional[float] = Query(None, description="最大cashback比例")
 ):
-    """获取所有历史数据（支持多种筛选条件）"""
+    """获取所有历史数据（支持多种筛选条件），下一页的游标在响应头X-Next-Cursor中"""
+    # 先解析游标，无效时不占用连接
+    cursor_values = decode_page_cursor("history", after) if after else None
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -296,8 +403,9 @@ async def get_all_history(
     params = []
     
     if store_name:
-        conditions.append("s.name LIKE ?")
-        params.append(f"%{store_name}%")
+        name_condition, name_params = store_search.name_filter(conn, store_name)
+        conditions.append(name_condition)
+        params.extend(name_params)
     
     if is_upsized is not None:
         conditions.append("ch.is_upsized = ?")
@@ -311,30 +419,90 @@ async def get_all_history(
         conditions.append("ch.category_rate_numeric <= ?")
         params.append(max_rate)
     
-    where_clause = ""
-    if conditions:
-        where_clause = "WHERE " + " AND ".join(conditions)
-    
-    query = f"""
-        SELECT ch.*, s.name as store_name, s.url as store_url
-        FROM cashback_history ch
-        JOIN stores s ON ch.store_id = s.id
-        {where_clause}
-        ORDER BY ch.scraped_at DESC
-        LIMIT ? OFFSET ?
-    """
+    if cursor_values:
+        # 游标分页：从上一页最后一行之后开始，不再使用OFFSET
+        conditions.append(api_queries.HISTORY_AFTER_CONDITION)
+        params.extend(cursor_values)
+        offset = 0
+    
+    query = api_queries.HISTORY_SQL.format(history=get_history_table(conn),
+                                           where=api_queries.where_clause(conditions))
     
     params.extend([limit, offset])
     
     try:
         cursor.execute(query, params)
         history = cursor.fetchall()
+        set_next_cursor(response, next_cursor("history", history, limit, "scraped_at"))
         return [CashbackHistoryResponse(**dict(record)) for record in history]
     
     finally:
         conn.close()
 
+@app.get("/api/history/export", summary="流式导出历史数据")
+async def export_history(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="导出格式: ndjson / csv"),
+    gzip: bool = Query(False, description="gzip压缩"),
+    store_id: Optional[int] = Query(None, description="按商家ID筛选"),
+    store_name: Optional[str] = Query(None, description="按商家名称筛选"),
+    category: Optional[str] = Query(None, description="按分类筛选"),
+    since: Optional[str] = Query(None, description="开始时间（含），ISO格式UTC日期或时间"),
+    until: Optional[str] = Query(None, description="结束时间（不含），ISO格式UTC日期或时间"),
+    is_upsized: Optional[bool] = Query(None, description="按是否upsized筛选")
+):
+    """按条件导出全部历史数据（按抓取时间升序），逐批从数据库读取并发送，不限制行数"""
+    conditions = []
+    params = []
+    try:
+        if since:
+            conditions.append("ch.scraped_at >= ?")
+            params.append(history_export.export_timestamp(since))
+        if until:
+            conditions.append("ch.scraped_at < ?")
+            params.append(history_export.export_timestamp(until))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="时间格式无效，应为ISO格式，如 2025-01-31 或 2025-01-31T12:00:00")
+    
+    if store_id is not None:
+        conditions.append("ch.store_id = ?")
+        params.append(store_id)
+    if category:
+        conditions.append("ch.category = ?")
+        params.append(category)
+    if is_upsized is not None:
+        conditions.append("ch.is_upsized = ?")
+        params.append(is_upsized)
+    
+    conn = await db_connection()
+    try:
+        if store_name:
+            name_condition, name_params = store_search.name_filter(conn, store_name)
+            conditions.append(name_condition)
+            params.extend(name_params)
+        history_table = get_history_table(conn)
+    finally:
+        conn.close()
+    
+    query = api_queries.HISTORY_EXPORT_SQL.format(history=history_table,
+                                                  where=api_queries.where_clause(conditions))
+    after_query = api_queries.HISTORY_EXPORT_SQL.format(
+        history=history_table,
+        where=api_queries.where_clause(conditions + [api_queries.HISTORY_EXPORT_AFTER_CONDITION]))
+    
+    media_type, extension = history_export.EXPORT_FORMATS[export_format]
+    filename = f"cashback_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        # 同步生成器在线程池中执行，每批借用连接最多等待db_acquire_timeout秒，超时时结束发送
+        history_export.stream_export(lambda: get_db_connection(timeout=db_acquire_timeout), query, after_query,
+                                     params, export_format, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.get("/api/statistics", response_model=List[RateStatisticsResponse], summary="获取比例统计")
+@cached_response
 async def get_statistics(
     store_name: Optional[str] = Query(None, description="按商家名称筛选")
 ):
@@ -343,23 +511,12 @@ async def get_statistics(
     cursor = conn.cursor()
     
     try:
+        conditions, params = [], []
         if store_name:
-            cursor.execute("""
-                SELECT s.name as store_name, rs.category, rs.current_rate, 
-                       rs.highest_rate, rs.lowest_rate, rs.highest_date, rs.lowest_date
-                FROM rate_statistics rs
-                JOIN stores s ON rs.store_id = s.id
-                WHERE s.name LIKE ?
-                ORDER BY s.name, rs.category
-            """, (f"%{store_name}%",))
-        else:
-            cursor.execute("""
-                SELECT s.name as store_name, rs.category, rs.current_rate, 
-                       rs.highest_rate, rs.lowest_rate, rs.highest_date, rs.lowest_date
-                FROM rate_statistics rs
-                JOIN stores s ON rs.store_id = s.id
-                ORDER BY s.name, rs.category
-            """)
+            name_condition, params = store_search.name_filter(conn, store_name)
+            conditions.append(name_condition)
+        cursor.execute(api_queries.STATISTICS_SQL.format(where=api_queries.where_clause(conditions)),
+                       params)
         
         stats = cursor.fetchall()
         return [RateStatisticsResponse(**dict(stat)) for stat in stats]
@@ -368,6 +525,7 @@ async def get_statistics(
         conn.close()
 
 @app.get("/api/top-cashback", summary="获取最高cashback商家")
+@cached_response
 async def get_top_cashback(
     limit: int = Query(10, ge=1, le=50),
     category: Optional[str] = Query(None, description="按分类筛选")
@@ -379,34 +537,10 @@ async def get_top_cashback(
     try:
         if category and category != "Main":
             # 查询特定分类
-            cursor.execute("""
-                SELECT s.name, s.url, ch.category, ch.category_rate, ch.category_rate_numeric,
-                       ch.is_upsized, ch.scraped_at
-                FROM cashback_history ch
-                JOIN stores s ON ch.store_id = s.id
-                WHERE ch.category = ? AND ch.id IN (
-                    SELECT MAX(id) FROM cashback_history 
-                    WHERE category = ?
-                    GROUP BY store_id
-                )
-                ORDER BY ch.category_rate_numeric DESC
-                LIMIT ?
-            """, (category, category, limit))
+            cursor.execute(api_queries.TOP_CASHBACK_CATEGORY_SQL, (category, limit))
         else:
             # 查询主要cashback
-            cursor.execute("""
-                SELECT s.name, s.url, ch.main_cashback, ch.main_rate_numeric,
-                       ch.is_upsized, ch.scraped_at
-                FROM cashback_history ch
-                JOIN stores s ON ch.store_id = s.id
-                WHERE ch.category = 'Main' AND ch.id IN (
-                    SELECT MAX(id) FROM cashback_history 
-                    WHERE category = 'Main'
-                    GROUP BY store_id
-                )
-                ORDER BY ch.main_rate_numeric DESC
-                LIMIT ?
-            """, (limit,))
+            cursor.execute(api_queries.TOP_CASHBACK_SQL, (limit,))
         
         results = cursor.fetchall()
         return [dict(result) for result in results]
@@ -415,24 +549,14 @@ async def get_top_cashback(
         conn.close()
 
 @app.get("/api/upsized-stores", summary="获取当前upsized的商家")
+@cached_response
 async def get_upsized_stores():
     """获取当前有upsized优惠的商家"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        cursor.execute("""
-            SELECT s.name, s.url, ch.main_cashback, ch.main_rate_numeric,
-                   ch.previous_offer, ch.scraped_at
-            FROM cashback_history ch
-            JOIN stores s ON ch.store_id = s.id
-            WHERE ch.is_upsized = 1 AND ch.category = 'Main' AND ch.id IN (
-                SELECT MAX(id) FROM cashback_history 
-                WHERE category = 'Main'
-                GROUP BY store_id
-            )
-            ORDER BY ch.main_rate_numeric DESC
-        """)
+        cursor.execute(api_queries.UPSIZED_STORES_SQL)
         
         results = cursor.fetchall()
         return [dict(result) for result in results]
@@ -441,7 +565,7 @@ async def get_upsized_stores():
         conn.close()
 
 @app.post("/api/scrape", response_model=ScrapeResponse, summary="抓取单个商家")
-async def scrape_store(request: ScrapeRequest, background_tasks: BackgroundTasks):
+async def scrape_store(request: ScrapeRequest):
     """抓取单个商家的cashback数据"""
     url = str(request.url)
     
@@ -449,28 +573,23 @@ async def scrape_store(request: ScrapeRequest, background_tasks: BackgroundTasks
     if "shopback.com" not in url:
         raise HTTPException(status_code=400, detail="URL必须是ShopBack商家页面")
     
-    # 在后台执行抓取任务
-    background_tasks.add_task(scrape_store_background, url)
+    # 提交到抓取执行器
+    try:
+        run = get_scrape_executor().submit_single(url)
+    except ScrapeQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
     return ScrapeResponse(
         success=True,
-        message="抓取任务已启动，请稍后查看结果"
+        message="该商家已在抓取队列中，请稍后查看结果" if run.duplicates else "抓取任务已启动，请稍后查看结果"
     )
 
-async def scrape_store_background(url: str):
-    """后台抓取任务"""
-    try:
-        scraper = get_scraper()
-        result = scraper.scrape_store_page(url)
-        logger.info(f"后台抓取完成: {result.name} - {result.main_cashback}")
-    except Exception as e:
-        logger.error(f"后台抓取失败: {url} - {str(e)}")
-
 @app.post("/api/scrape-multiple", summary="批量抓取多个商家")
 async def scrape_multiple_stores(
     urls: List[HttpUrl], 
-    background_tasks: BackgroundTasks,
-    delay_seconds: int = Query(2, ge=1, le=10, description="每次抓取间隔秒数")
+    concurrency: int = Query(scrape_concurrency, ge=1, le=scrape_max_concurrency, description="并发请求数"),
+    requests_per_second: float = Query(scrape_requests_per_second, gt=0, le=50, description="每个host每秒最多请求数（所有任务合计不超过scrape_host_requests_per_second）"),
+    delay_seconds: Optional[float] = Query(None, ge=0.1, le=10, description="(兼容旧参数) 每个host请求间隔秒数")
 ):
     """批量抓取多个商家的cashback数据"""
     # 验证所有URL
@@ -478,30 +597,81 @@ async def scrape_multiple_stores(
         if "shopback.com" not in str(url):
             raise HTTPException(status_code=400, detail=f"URL必须是ShopBack商家页面: {url}")
     
-    # 在后台执行批量抓取任务
-    background_tasks.add_task(scrape_multiple_background, [str(url) for url in urls], delay_seconds)
+    if delay_seconds is not None:
+        requests_per_second = 1.0 / delay_seconds
+    
+    # 提交到抓取执行器
+    run = submit_batch_scrape([str(url) for url in urls], concurrency, requests_per_second)
     
     return {
         "success": True,
-        "message": f"批量抓取任务已启动，共{len(urls)}个商家",
-        "estimated_time": f"{len(urls) * delay_seconds // 60}分钟"
+        "message": f"批量抓取任务已启动，共{run.total}个商家" +
+                   (f"（{run.duplicates}个已在队列中）" if run.duplicates else ""),
+        "job_id": run.id,
+        "duplicates": run.duplicates,
+        "estimated_time": f"{int(len(urls) / requests_per_second) // 60}分钟"
     }
 
-async def scrape_multiple_background(urls: List[str], delay_seconds: int):
-    """后台批量抓取任务"""
-    scraper = get_scraper()
+@app.get("/api/scrape-status", summary="抓取执行器状态")
+async def get_scrape_status():
+    """获取抓取队列深度和进行中的任务"""
+    return get_scrape_executor().status()
+
+@app.get("/api/cache-stats", summary="响应缓存统计")
+async def get_cache_stats():
+    """只读接口响应缓存的命中率、条目数和失效次数"""
+    return get_response_cache().stats()
+
+@app.get("/api/scrape-runs", summary="抓取任务列表")
+async def list_scrape_runs(
+    state: Optional[str] = Query(None, description="状态: queued / running / completed / cancelled"),
+    limit: int = Query(20, ge=1, le=200, description="返回数量")
+):
+    """最近提交的抓取任务及进度"""
+    runs = get_scrape_executor().queue.list_runs(state, limit)
+    return [run.summary() for run in runs]
+
+@app.get("/api/scrape-runs/{run_id}", summary="抓取任务进度")
+async def get_scrape_run(run_id: int):
+    """抓取任务各状态的URL数、进度和失败的URL"""
+    executor = get_scrape_executor()
+    run = executor.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="抓取任务不存在")
+    data = run.summary()
+    data["errors"] = executor.queue.job_errors(run_id)
+    return data
+
+@app.post("/api/scrape-runs/{run_id}/cancel", summary="取消抓取任务")
+async def cancel_scrape_run(run_id: int):
+    """取消排队中或进行中的抓取任务，未抓取的URL不再抓取"""
+    executor = get_scrape_executor()
+    if executor.get_run(run_id) is None:
+        raise HTTPException(status_code=404, detail="抓取任务不存在")
+    if not executor.cancel(run_id):
+        raise HTTPException(status_code=409, detail="抓取任务已结束")
+    return {"success": True, "message": f"抓取任务 #{run_id} 已取消", "run": executor.get_run(run_id).summary()}
+
+@app.get("/api/scrape-schedule", summary="定时抓取计划")
+async def get_scrape_schedule(
+    due_only: bool = Query(False, description="只返回已到期的商家"),
+    limit: int = Query(100, ge=1, le=1000, description="返回数量")
+):
+    """每个商家的比例变化次数、抓取间隔和下次抓取时间，按优先级排序"""
+    conn = get_db_connection()
     
-    for i, url in enumerate(urls):
-        try:
-            result = scraper.scrape_store_page(url)
-            logger.info(f"批量抓取进度 {i+1}/{len(urls)}: {result.name} - {result.main_cashback}")
-            
-            # 添加延迟，避免过于频繁的请求
-            if i < len(urls) - 1:
-                time.sleep(delay_seconds)
-                
-        except Exception as e:
-            logger.error(f"批量抓取失败: {url} - {str(e)}")
+    try:
+        plans = scrape_scheduler.plan(conn)
+        budget = scrape_scheduler.tick_budget(len(plans))
+        if due_only:
+            plans = [plan for plan in plans if plan.due]
+        return {
+            "tick_minutes": scrape_scheduler.tick_minutes,
+            "tick_budget": budget,
+            "stores": [plan_summary(plan) for plan in plans[:limit]],
+        }
+    finally:
+        conn.close()
 
 @app.get("/api/trends/{store_id}", summary="获取商家趋势数据")
 async def get_store_trends(
@@ -516,17 +686,12 @@ async def get_store_trends(
     try:
         start_date = (datetime.now() - timedelta(days=days)).isoformat()
         
-        cursor.execute("""
-            SELECT DATE(scraped_at) as date, 
-                   AVG(category_rate_numeric) as avg_rate,
-                   MAX(category_rate_numeric) as max_rate,
-                   MIN(category_rate_numeric) as min_rate,
-                   COUNT(*) as count
-            FROM cashback_history
-            WHERE store_id = ? AND category = ? AND scraped_at >= ?
-            GROUP BY DATE(scraped_at)
-            ORDER BY date
-        """, (store_id, category, start_date))
+        if history_store.get_history_mode(conn) == history_store.INTERVALS_MODE:
+            # 区间模式：按天统计当天有效的区间
+            return history_store.interval_trends(cursor, store_id, category, start_date)
+        
+        # rows模式：未变化的日子沿用上一条记录
+        cursor.execute(api_queries.TRENDS_SQL, (start_date, store_id, category, store_id, category))
         
         trends = cursor.fetchall()
         return [dict(trend) for trend in trends]
@@ -534,36 +699,46 @@ async def get_store_trends(
     finally:
         conn.close()
 
-@app.delete("/api/stores/{store_id}", summary="删除商家及其所有数据")
-async def delete_store(store_id: int):
-    """删除商家及其所有相关数据"""
-    conn = get_db_connection()
+def delete_store_data(store_id: int) -> Optional[str]:
+    """删除商家及其所有相关数据，返回商家名称，商家不存在时返回None"""
+    conn = get_db_connection(write=True)
     cursor = conn.cursor()
     
     try:
         # 检查商家是否存在
-        cursor.execute("SELECT name FROM stores WHERE id = ?", (store_id,))
+        cursor.execute(api_queries.STORE_BY_ID_SQL, (store_id,))
         store = cursor.fetchone()
         if not store:
-            raise HTTPException(status_code=404, detail="商家不存在")
+            return None
         
-        store_name = store[0]
+        store_name, store_url = store[0], store[1]
         
         # 删除相关数据
-        cursor.execute("DELETE FROM rate_statistics WHERE store_id = ?", (store_id,))
-        cursor.execute("DELETE FROM cashback_history WHERE store_id = ?", (store_id,))
-        cursor.execute("DELETE FROM stores WHERE id = ?", (store_id,))
+        for sql in api_queries.DELETE_STORE_SQL:
+            cursor.execute(sql, (store_id,))
+        # 删除页面缓存，再次抓取时完整下载并重新创建商家，而不是收到304
+        cursor.execute(api_queries.DELETE_PAGE_CACHE_SQL, (store_url,))
         
         conn.commit()
-        
-        return {
-            "success": True,
-            "message": f"商家 '{store_name}' 及其所有数据已删除"
-        }
+        return store_name
     
     finally:
         conn.close()
 
+@app.delete("/api/stores/{store_id}", summary="删除商家及其所有数据")
+async def delete_store(store_id: int):
+    """删除商家及其所有相关数据"""
+    # 获取写锁、提交和释放写锁都在同一个工作线程中完成，等待抓取写入时不阻塞事件循环
+    store_name = await run_in_threadpool(delete_store_data, store_id)
+    if store_name is None:
+        raise HTTPException(status_code=404, detail="商家不存在")
+    bump_generation()
+    
+    return {
+        "success": True,
+        "message": f"商家 '{store_name}' 及其所有数据已删除"
+    }
+
 # 错误处理
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
@@ -572,13 +747,20 @@ async def not_found_handler(request, exc):
         content={"detail": "资源未找到"}
     )
 
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "数据库连接繁忙，请稍后重试"}
+    )
+
 @app.exception_handler(500)
 async def internal_error_handler(request, exc):
     return JSONResponse(
         status_code=500,
         content={"detail": "服务器内部错误"}
     )
-schedule.every(6).hours.do(auto_rescrape)
+schedule.every(scrape_scheduler.tick_minutes).minutes.do(auto_rescrape)
 
 def run_scheduler():
     while True:
@@ -588,6 +770,17 @@ def run_scheduler():
 # 启动定时器线程
 threading.Thread(target=run_scheduler, daemon=True).start()
 
+@app.on_event("startup")
+def resume_scrape_queue():
+    """启动时创建抓取执行器，继续处理上次退出时未完成的抓取任务"""
+    get_scrape_executor()
+
+@app.on_event("shutdown")
+def stop_scrape_executor():
+    """关闭抓取执行器共用的解析进程池"""
+    if scrape_executor is not None:
+        scrape_executor.shutdown()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001, reload=False)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+ShopBack 并发抓取引擎
+抓取分为三个阶段，阶段之间用有界队列连接:
+  fetch - asyncio调度 + requests连接池（线程池），支持并发上限；
+          按host限速和重试由会话上的ThrottledAdapter处理（rate_limiter.py），所有任务共用
+          每个host的速率上限，requests_per_second是在此之外的任务自己的上限（RateCap）
+  parse - 在进程池中解析原始字节，返回StoreInfo字典，不受GIL限制，可以用满所有CPU核
+  write - 单个写入线程，通过BatchWriter批量写入SQLite；结果在数据提交后才返回给调用方
+下游处理不过来时队列写满，上游阶段随之等待，内存中积压的页面数有上限
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import AsyncIterator, Dict, Iterable, Optional, TYPE_CHECKING
+
+from models import store_info_from_dict
+from page_parser import parse_page_dict
+from rate_limiter import RateCap, limited_by
+
+if TYPE_CHECKING:
+    from sb_scrap import ShopBackSQLiteScraper, StoreInfo
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class StageStats:
+    """单个阶段的处理数和耗时"""
+    name: str
+    items: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    first_started: Optional[float] = None
+    last_finished: Optional[float] = None
+    
+    def record(self, started: float, success: bool = True):
+        """记录一次处理，started为time.monotonic()开始时间"""
+        finished = time.monotonic()
+        if self.first_started is None:
+            self.first_started = started
+        self.last_finished = finished
+        self.busy_seconds += finished - started
+        self.items += 1
+        if not success:
+            self.failed += 1
+    
+    def summary(self) -> Dict:
+        """吞吐量 = 处理数 / 从第一次开始到最后一次结束的时间"""
+        elapsed = 0.0
+        if self.first_started is not None:
+            elapsed = self.last_finished - self.first_started
+        return {
+            "items": self.items,
+            "failed": self.failed,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "items_per_second": round(self.items / elapsed, 2) if elapsed > 0 else None,
+        }
+
+def default_parse_processes(parse_processes: Optional[int]) -> int:
+    """解析进程数：None为CPU核数，0表示在线程池中解析"""
+    return (os.cpu_count() or 1) if parse_processes is None else max(0, parse_processes)
+
+def create_parse_executor(parse_processes: int) -> Executor:
+    """创建解析池；进程池的子进程在第一次提交任务时才启动"""
+    if parse_processes == 0:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="parse")
+    # spawn: 抓取线程和BatchWriter线程运行时fork子进程可能继承被占用的锁
+    return ProcessPoolExecutor(max_workers=parse_processes, mp_context=get_context('spawn'))
+
+class ScrapePipeline:
+    """fetch -> parse -> write 三阶段抓取流水线"""
+    
+    def __init__(self, scraper: "ShopBackSQLiteScraper", concurrency: int = 16,
+                 requests_per_second: float = 5.0, parse_processes: Optional[int] = None,
+                 queue_size: int = 64, batch_writes: bool = True,
+                 parse_executor: Optional[Executor] = None, rate_cap: Optional[RateCap] = None):
+        """
+        parse_processes: 解析进程数，None为CPU核数，0表示在线程池中解析（不启动子进程）
+        queue_size: 阶段之间队列的容量
+        parse_executor: 调用方持有的解析池（如执行器的多个批次共用），
+                        此时parse_processes应为该池的进程数，流水线结束时不关闭；
+                        为None时每次run()创建并关闭自己的解析池
+        rate_cap: 任务的速率上限，同一任务的多个流水线（批次）应共用一个；为None时按requests_per_second创建
+        """
+        self.scraper = scraper
+        self.concurrency = max(1, concurrency)
+        # 任务的速率上限，叠加在抓取器共用的按host限速器之上
+        self.rate_cap = rate_cap or RateCap(requests_per_second)
+        self.parse_processes = default_parse_processes(parse_processes)
+        self.parse_executor = parse_executor
+        # 共用的解析池损坏（子进程异常退出）时置位，由调用方重建
+        self.parse_pool_broken = False
+        self.queue_size = max(1, queue_size)
+        self.batch_writes = batch_writes
+        self.stages = {name: StageStats(name) for name in ('fetch', 'parse', 'write')}
+        self.parse_queue: Optional[asyncio.Queue] = None
+        self.write_queue: Optional[asyncio.Queue] = None
+        # 还没有离开fetch/parse阶段、也没有交给写入器的URL数，为0时立即提交写入缓冲区
+        self.unsettled = 0
+        self.writer = None
+        self.write_executor: Optional[ThreadPoolExecutor] = None
+        
+        # 会话和适配器在创建抓取器时挂载一次，其他任务可能正在使用，这里不重新挂载；
+        # 连接池小于并发数时多余的连接用完即丢弃，不能复用keep-alive
+        if getattr(scraper, 'pool_maxsize', 0) < self.concurrency:
+            logger.warning(f"并发数 {self.concurrency} 超过抓取器的连接池大小 {scraper.pool_maxsize}")
+    
+    def stats(self) -> Dict:
+        """各阶段吞吐量和队列深度"""
+        data = {name: stage.summary() for name, stage in self.stages.items()}
+        data["parse_processes"] = self.parse_processes
+        data["parse_queue"] = self.parse_queue.qsize() if self.parse_queue else 0
+        data["write_queue"] = self.write_queue.qsize() if self.write_queue else 0
+        data["rate_limiter"] = self.scraper.rate_limiter.stats()
+        data["rate_cap"] = self.rate_cap.requests_per_second
+        return data
+    
+    def _fetch_page(self, url: str) -> Optional[bytes]:
+        """在fetch线程中下载页面，请求同时遵守任务的速率上限和共用的按host限速"""
+        with limited_by(self.rate_cap):
+            return self.scraper.fetch_page(url)
+    
+    async def _settled(self):
+        """一个URL已有结果或已交给写入器；全部URL都到这一步时不再等待时间阈值，立即提交剩余数据"""
+        self.unsettled -= 1
+        if self.unsettled == 0 and self.writer is not None:
+            await asyncio.get_running_loop().run_in_executor(self.write_executor, self.writer.flush)
+    
+    async def _fetch(self, url: str, semaphore: asyncio.Semaphore,
+                     executor: ThreadPoolExecutor, results: asyncio.Queue):
+        """fetch阶段：下载页面，原始字节放入解析队列；304直接沿用缓存结果"""
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                self.scraper.logger.info(f"正在抓取: {url}")
+                content = await loop.run_in_executor(executor, self._fetch_page, url)
+                if content is None:
+                    store_info = await loop.run_in_executor(executor, self.scraper.load_not_modified,
+                                                            url, self.writer)
+            except Exception as e:
+                self.stages['fetch'].record(started, success=False)
+                self.scraper.logger.error(f"抓取失败 {url}: {str(e)}")
+                await results.put(self.scraper.failed_store_info(url, e))
+                await self._settled()
+                return
+            self.stages['fetch'].record(started)
+            
+            # 在信号量内等待队列空位，解析跟不上时不再发起新的请求
+            if content is None:
+                # 使用BatchWriter时观测随下一批提交，结果由提交回调返回
+                if self.writer is None:
+                    await results.put(store_info)
+                await self._settled()
+            else:
+                await self.parse_queue.put((url, content))
+    
+    async def _parse(self, executor: Executor, results: asyncio.Queue):
+        """parse阶段：原始字节交给解析进程，StoreInfo字典还原后放入写入队列"""
+        loop = asyncio.get_running_loop()
+        backend = self.scraper.parser_backend
+        while True:
+            url, content = await self.parse_queue.get()
+            started = time.monotonic()
+            try:
+                data = await loop.run_in_executor(executor, parse_page_dict, backend, content, url,
+                                                  self.scraper.page_layouts.get(url))
+                store_info = store_info_from_dict(data)
+            except Exception as e:
+                if isinstance(e, BrokenExecutor):
+                    self.parse_pool_broken = True
+                self.stages['parse'].record(started, success=False)
+                self.scraper.logger.error(f"抓取失败 {url}: 解析出错: {str(e)}")
+                await results.put(self.scraper.failed_store_info(url, e))
+                await self._settled()
+            else:
+                self.stages['parse'].record(started, success=store_info.scraping_success)
+                await self.write_queue.put(store_info)
+            finally:
+                self.parse_queue.task_done()
+    
+    async def _write(self, executor: ThreadPoolExecutor, writer, results: asyncio.Queue):
+        """write阶段：在单个写入线程中保存结果；使用BatchWriter时结果由提交回调返回"""
+        loop = asyncio.get_running_loop()
+        while True:
+            store_info = await self.write_queue.get()
+            started = time.monotonic()
+            try:
+                await loop.run_in_executor(executor, self.scraper.store_result, store_info, writer)
+            except Exception as e:
+                self.stages['write'].record(started, success=False)
+                self.scraper.logger.error(f"抓取失败 {store_info.url}: 保存出错: {str(e)}")
+                await results.put(self.scraper.failed_store_info(store_info.url, e))
+            else:
+                self.stages['write'].record(started)
+                self.scraper.logger.info(f"成功抓取 {store_info.name}: {store_info.main_cashback}, "
+                                         f"{len(store_info.detailed_rates)} 个详细分类")
+                if writer is None:
+                    await results.put(store_info)
+            finally:
+                self.write_queue.task_done()
+            await self._settled()
+    
+    def log_stats(self):
+        """结束时输出各阶段吞吐量"""
+        parts = []
+        for name, stage in self.stages.items():
+            summary = stage.summary()
+            rate = summary['items_per_second']
+            parts.append(f"{name} {summary['items']} 个 "
+                         f"({rate if rate is not None else '-'}/秒, 忙碌 {summary['busy_seconds']}秒)")
+        logger.info("流水线各阶段: " + ", ".join(parts))
+    
+    async def run(self, urls: Iterable[str]) -> AsyncIterator["StoreInfo"]:
+        """抓取多个URL，按完成顺序逐个返回结果（每个URL恰好一个）"""
+        urls = list(urls)
+        if not urls:
+            return
+        
+        from batch_writer import BatchWriter
+        
+        self.parse_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.write_queue = asyncio.Queue(maxsize=self.queue_size)
+        results: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        fetch_executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="fetch")
+        write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write")
+        loop = asyncio.get_running_loop()
+        
+        def committed(store_info: "StoreInfo", error: Optional[Exception]):
+            # 在写入线程中调用：数据提交后才返回结果，调用方（执行器）随之把任务标记为完成
+            if error is not None:
+                self.scraper.logger.error(f"抓取失败 {store_info.url}: 保存出错: {str(error)}")
+                store_info = self.scraper.failed_store_info(store_info.url, error)
+            loop.call_soon_threadsafe(results.put_nowait, store_info)
+        
+        own_parse_executor = self.parse_executor is None
+        parse_executor = create_parse_executor(self.parse_processes) if own_parse_executor else self.parse_executor
+        writer = BatchWriter(self.scraper, on_commit=committed) if self.batch_writes else None
+        self.unsettled = len(urls)
+        self.writer, self.write_executor = writer, write_executor
+        
+        # 每个解析进程两个待处理任务，传输数据时进程不空闲
+        parse_tasks = max(1, self.parse_processes) * 2
+        tasks = [asyncio.ensure_future(self._fetch(url, semaphore, fetch_executor, results)) for url in urls]
+        tasks += [asyncio.ensure_future(self._parse(parse_executor, results)) for _ in range(parse_tasks)]
+        tasks.append(asyncio.ensure_future(self._write(write_executor, writer, results)))
+        logger.info(f"并发抓取开始: {len(urls)} 个URL, 并发数 {self.concurrency}, "
+                    f"解析进程 {self.parse_processes}")
+        
+        try:
+            for _ in urls:
+                yield await results.get()
+        finally:
+            # 调用方提前退出时取消尚未完成的任务
+            for task in tasks:
+                task.cancel()
+            fetch_executor.shutdown(wait=False, cancel_futures=True)
+            if own_parse_executor:
+                parse_executor.shutdown(wait=False, cancel_futures=True)
+            # 等待正在进行的写入完成后再写入缓冲区中剩余的数据
+            write_executor.shutdown(wait=True)
+            if writer is not None:
+                writer.close()
+            self.log_stats()
@@ -8,13 +8,16 @@ import requests
 from bs4 import BeautifulSoup
 import json
 import re
-import time
 import sqlite3
 import logging
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass, asdict
 
+import page_data
+import rate_parser
+from rate_limiter import HostRateLimiter, ThrottledAdapter
+
 @dataclass
 class CashbackRate:
     """Cashback比例数据结构"""
@@ -71,6 +74,10 @@ class FixedShopBackScraper:
         }
         
         self.session.headers.update(headers)
+        # 按host限速，429/5xx时退避重试（代替每个请求后固定等待）
+        adapter = ThrottledAdapter(HostRateLimiter())
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
     
     def init_database(self):
         """初始化数据库"""
@@ -142,67 +149,14 @@ class FixedShopBackScraper:
             raise
     
     def extract_numeric_rate(self, rate_text: str) -> float:
-        """从文本中提取数字比例"""
-        if not rate_text:
-            return 0.0
-        
-        # 清理文本
-        rate_text = rate_text.strip()
-        
-        # 匹配各种比例格式
-        patterns = [
-            r'Up to (\d+\.?\d*)%',
-            r'(\d+\.?\d*)%\s*Cashback',
-            r'(\d+\.?\d*)%',
-            r'\$(\d+\.?\d*)',
-            r'(\d+\.?\d*)\s*%',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, rate_text, re.IGNORECASE)
-            if match:
-                try:
-                    return float(match.group(1))
-                except ValueError:
-                    continue
-        
-        return 0.0
+        """从文本中提取数字比例（百分比或金额）"""
+        return rate_parser.numeric_rate(rate_text)
     
     def extract_json_data(self, soup: BeautifulSoup) -> Dict:
-        """提取页面中的JSON数据"""
-        json_data = {}
-        
-        # 查找所有script标签
-        scripts = soup.find_all('script')
-        
-        for script in scripts:
-            if not script.string:
-                continue
-                
-            script_content = script.string.strip()
-            
-            # 查找包含cashback信息的JSON
-            if 'cashback' in script_content.lower() or 'rate' in script_content.lower():
-                # 尝试提取JSON对象
-                json_patterns = [
-                    r'window\.__INITIAL_STATE__\s*=\s*({.+?});',
-                    r'window\.__NEXT_DATA__\s*=\s*({.+?});',
-                    r'__APOLLO_STATE__\s*=\s*({.+?});',
-                    r'({.*?"cashback".*?})',
-                    r'({.*?"rate".*?})',
-                ]
-                
-                for pattern in json_patterns:
-                    matches = re.findall(pattern, script_content, re.DOTALL)
-                    for match in matches:
-                        try:
-                            data = json.loads(match)
-                            if isinstance(data, dict):
-                                json_data.update(data)
-                        except json.JSONDecodeError:
-                            continue
-        
-        return json_data
+        """提取页面内嵌的商家数据（Next.js的merchantDetail，见page_data.py），没有时返回空字典"""
+        scripts = ''.join(str(script) for script in soup.find_all('script'))
+        found = page_data.extract_merchant_detail(scripts)
+        return found[1] if found else {}
     
     def extract_store_name(self, soup: BeautifulSoup, url: str) -> str:
         """提取商家名称"""
@@ -550,8 +504,6 @@ class FixedShopBackScraper:
                 print("详细rates:")
                 for rate in result.detailed_rates[:3]:  # 只显示前3个
                     print(f"  - {rate.category}: {rate.rate}")
-            
-            time.sleep(3)  # 避免请求过快
     
     def close_connection(self):
         """关闭数据库连接"""
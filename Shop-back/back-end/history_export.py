@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+ShopBack 历史数据流式导出
+按 (scraped_at, id) 分批读取（每批从上一批最后一行之后开始），每批编码为NDJSON或CSV后立即发送，
+可选gzip压缩（流式压缩，不缓冲整个文件），导出任意行数时内存占用保持不变。
+每批单独借用只读连接，读完即归还，客户端下载得慢时不会一直占用连接池
+"""
+import csv
+import io
+import json
+import logging
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional, Tuple
+
+from db_pool import PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+# 导出的列（与CashbackHistoryResponse一致）
+EXPORT_COLUMNS = [
+    'id', 'store_id', 'store_name', 'store_url', 'main_cashback', 'main_rate_numeric',
+    'category', 'category_rate', 'category_rate_numeric', 'is_upsized', 'previous_offer',
+    'scraped_at',
+]
+
+# 导出格式 -> (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+# 每批读取的行数
+EXPORT_BATCH_SIZE = 1000
+
+def export_timestamp(value: str) -> str:
+    """
+    把ISO格式的日期/时间转换为数据库中scraped_at的格式（UTC），格式无效时抛出ValueError
+    带时区的时间先转换为UTC，不带时区的按UTC处理
+    """
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+def encode_batch(rows, fmt: str) -> str:
+    """把一批行编码为NDJSON或CSV文本"""
+    if fmt == 'ndjson':
+        lines = []
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record['is_upsized'] = bool(record['is_upsized'])
+            lines.append(json.dumps(record, ensure_ascii=False))
+        lines.append('')
+        return '\n'.join(lines)
+    
+    upsized = EXPORT_COLUMNS.index('is_upsized')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        row = list(row)
+        # 与NDJSON一致写为true/false
+        row[upsized] = 'true' if row[upsized] else 'false'
+        writer.writerow(row)
+    return buffer.getvalue()
+
+def read_batch(connect: Callable, sql: str, after_sql: str, params, after: Optional[Tuple],
+               batch_size: int):
+    """借用一个连接读取一批行，读完立即归还"""
+    conn = connect()
+    try:
+        if after is None:
+            return conn.execute(sql, (*params, batch_size)).fetchall()
+        return conn.execute(after_sql, (*params, *after, batch_size)).fetchall()
+    finally:
+        conn.close()
+
+def stream_export(connect: Callable, sql: str, after_sql: str, params, fmt: str,
+                  compress: bool = False, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    逐批执行查询并产出编码后的数据，sql的列顺序必须与EXPORT_COLUMNS一致，按 (scraped_at, id) 升序，
+    最后一个参数为LIMIT；after_sql在sql的条件之后加上 (scraped_at, id) > (?, ?)
+    每批由connect()借用连接，发送数据时不持有连接；借用连接超时（PoolTimeout）时记录日志并结束发送，
+    响应已经开始无法再返回503，gzip导出此时不写结尾，客户端解压时能发现文件不完整
+    """
+    # wbits=31: 带gzip文件头的流式压缩
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    
+    def output(text: str) -> bytes:
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+    
+    if fmt == 'csv':
+        header = io.StringIO()
+        csv.writer(header).writerow(EXPORT_COLUMNS)
+        yield output(header.getvalue())
+    after = None
+    while True:
+        try:
+            rows = read_batch(connect, sql, after_sql, params, after, batch_size)
+        except PoolTimeout as e:
+            logger.error(f"导出中断，没有空闲的数据库连接: {e}")
+            return
+        if rows:
+            chunk = output(encode_batch(rows, fmt))
+            if chunk:
+                yield chunk
+        if len(rows) < batch_size:
+            break
+        # 下一批从本批最后一行的 (scraped_at, id) 之后开始
+        after = (rows[-1][-1], rows[-1][0])
+    if compressor:
+        yield compressor.flush()
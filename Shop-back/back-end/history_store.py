@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+ShopBack 历史数据存储模式
+rows: 每次抓取为每个分类写一行 cashback_history（原有模式）
+intervals: 只在比例变化时写一行 (store, category, rate, valid_from, valid_to)
+
+切换到intervals模式:
+    python history_store.py migrate shopback_data.db [--drop-history]
+"""
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ROWS_MODE = 'rows'
+INTERVALS_MODE = 'intervals'
+
+# intervals模式下与cashback_history列一致的只读视图，查询只需替换表名
+INTERVAL_HISTORY_VIEW = 'cashback_interval_history'
+
+# 商家当前打开的区间
+OPEN_INTERVALS_SQL = '''
+    SELECT id, category, category_rate, category_rate_numeric, is_upsized, previous_offer
+    FROM cashback_intervals
+    WHERE store_id = ? AND valid_to IS NULL
+'''
+
+# 每日趋势：参数为 (开始日期, store_id, category, store_id, category)
+INTERVAL_TRENDS_SQL = '''
+    WITH RECURSIVE days(day) AS (
+        SELECT MAX(DATE(?), (SELECT DATE(MIN(valid_from)) FROM cashback_intervals
+                             WHERE store_id = ? AND category = ?))
+        UNION ALL
+        SELECT DATE(day, '+1 day') FROM days WHERE day < DATE('now')
+    )
+    SELECT days.day AS date,
+           AVG(ci.category_rate_numeric) AS avg_rate,
+           MAX(ci.category_rate_numeric) AS max_rate,
+           MIN(ci.category_rate_numeric) AS min_rate,
+           COUNT(*) AS count
+    FROM days
+    JOIN cashback_intervals ci
+        ON ci.store_id = ? AND ci.category = ?
+        AND ci.valid_from < DATE(days.day, '+1 day')
+        AND (ci.valid_to IS NULL OR ci.valid_to > days.day)
+    GROUP BY days.day
+    ORDER BY days.day
+'''
+
+def init_history_tables(cursor):
+    """创建设置表、区间表和兼容视图"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    
+    # Main分类的区间同时记录is_upsized和previous_offer，其余分类只记录比例
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cashback_intervals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            category_rate TEXT,
+            category_rate_numeric REAL,
+            is_upsized BOOLEAN DEFAULT FALSE,
+            previous_offer TEXT,
+            valid_from TIMESTAMP NOT NULL,
+            valid_to TIMESTAMP,
+            FOREIGN KEY (store_id) REFERENCES stores (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_intervals_store_category ON cashback_intervals (store_id, category, valid_from)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_intervals_valid_from ON cashback_intervals (valid_from)')
+    
+    # 每个区间关联同一时刻有效的Main区间，得到与cashback_history相同的列
+    cursor.execute(f'''
+        CREATE VIEW IF NOT EXISTS {INTERVAL_HISTORY_VIEW} AS
+        SELECT ci.id, ci.store_id,
+               COALESCE(m.category_rate, '0%') AS main_cashback,
+               COALESCE(m.category_rate_numeric, 0.0) AS main_rate_numeric,
+               ci.category, ci.category_rate, ci.category_rate_numeric,
+               COALESCE(m.is_upsized, 0) AS is_upsized,
+               m.previous_offer,
+               1 AS scraping_success,
+               NULL AS error_message,
+               ci.valid_from AS scraped_at,
+               ci.valid_to
+        FROM cashback_intervals ci
+        LEFT JOIN cashback_intervals m
+            ON m.store_id = ci.store_id AND m.category = 'Main'
+            AND m.valid_from <= ci.valid_from
+            AND (m.valid_to IS NULL OR m.valid_to > ci.valid_from)
+    ''')
+
+def get_history_mode(conn) -> str:
+    """读取当前的历史存储模式"""
+    try:
+        row = conn.execute("SELECT value FROM app_settings WHERE key = 'history_mode'").fetchone()
+    except sqlite3.OperationalError:
+        return ROWS_MODE
+    return row[0] if row else ROWS_MODE
+
+def set_history_mode(conn, mode: str):
+    """设置历史存储模式"""
+    if mode not in (ROWS_MODE, INTERVALS_MODE):
+        raise ValueError(f"未知的历史存储模式: {mode}")
+    conn.execute('''
+        INSERT INTO app_settings (key, value) VALUES ('history_mode', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (mode,))
+
+def history_table(mode: str) -> str:
+    """返回该模式下可按cashback_history列查询的表名"""
+    return INTERVAL_HISTORY_VIEW if mode == INTERVALS_MODE else 'cashback_history'
+
+def utc_timestamp() -> str:
+    """与SQLite CURRENT_TIMESTAMP格式一致的UTC时间"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def desired_intervals(store_info) -> Dict[str, Tuple]:
+    """StoreInfo中每个分类应处于的状态: (rate, rate_numeric, is_upsized, previous_offer)"""
+    states = {'Main': (store_info.main_cashback, store_info.main_rate_numeric,
+                       bool(store_info.is_upsized), store_info.previous_offer)}
+    for rate in store_info.detailed_rates:
+        states[rate.category] = (rate.rate, rate.rate_numeric, False, None)
+    return states
+
+def record_intervals(cursor, store_id: int, store_info, observed_at: Optional[str] = None) -> int:
+    """
+    按本次抓取结果更新区间：比例不变的区间保持打开，变化的区间关闭并开启新区间，
+    消失的分类关闭区间。返回新开启的区间数
+    """
+    observed_at = observed_at or utc_timestamp()
+    
+    cursor.execute(OPEN_INTERVALS_SQL, (store_id,))
+    open_intervals = {row[1]: (row[0], (row[2], row[3], bool(row[4]), row[5]))
+                      for row in cursor.fetchall()}
+    
+    states = desired_intervals(store_info)
+    to_close = [interval_id for category, (interval_id, state) in open_intervals.items()
+                if states.get(category) != state]
+    to_open = [(store_id, category, *state, observed_at)
+               for category, state in states.items()
+               if category not in open_intervals or open_intervals[category][1] != state]
+    
+    if to_close:
+        cursor.executemany('''
+            UPDATE cashback_intervals SET valid_to = ? WHERE id = ?
+        ''', [(observed_at, interval_id) for interval_id in to_close])
+    if to_open:
+        cursor.executemany('''
+            INSERT INTO cashback_intervals
+            (store_id, category, category_rate, category_rate_numeric, is_upsized, previous_offer, valid_from)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', to_open)
+    return len(to_open)
+
+def interval_trends(cursor, store_id: int, category: str, start_date: str) -> List[Dict]:
+    """intervals模式下的每日趋势：统计当天有效的所有区间"""
+    cursor.execute(INTERVAL_TRENDS_SQL, (start_date, store_id, category, store_id, category))
+    return [dict(row) for row in cursor.fetchall()]
+
+def iter_history_scrapes(cursor) -> Iterable[Tuple[int, str, List[sqlite3.Row]]]:
+    """遍历cashback_history中的每次抓取：同一商家从Main行开始的连续记录为一次抓取"""
+    cursor.execute('''
+        SELECT store_id, scraped_at, main_cashback, main_rate_numeric, category,
+               category_rate, category_rate_numeric, is_upsized, previous_offer
+        FROM cashback_history
+        WHERE scraping_success = 1
+        ORDER BY store_id, id
+    ''')
+    group = []
+    for row in cursor:
+        if group and (row['store_id'] != group[0]['store_id'] or row['category'] == 'Main'):
+            yield group[0]['store_id'], group[0]['scraped_at'], group
+            group = []
+        group.append(row)
+    if group:
+        yield group[0]['store_id'], group[0]['scraped_at'], group
+
+def migrate_history_to_intervals(conn, drop_history: bool = False) -> Tuple[int, int]:
+    """
+    由cashback_history重建cashback_intervals并切换到intervals模式
+    返回 (原记录数, 区间数)
+    """
+    from sb_scrap import CashbackRate, StoreInfo
+    import latest_snapshot
+    
+    cursor = conn.cursor()
+    init_history_tables(cursor)
+    latest_snapshot.init_latest_tables(cursor)
+    source_rows = cursor.execute('SELECT COUNT(*) FROM cashback_history').fetchone()[0]
+    
+    try:
+        cursor.execute('DELETE FROM cashback_intervals')
+        write_cursor = conn.cursor()
+        
+        for store_id, scraped_at, rows in iter_history_scrapes(conn.cursor()):
+            main = next((row for row in rows if row['category'] == 'Main'), rows[0])
+            store_info = StoreInfo(
+                name='', url='', last_updated=scraped_at, scraping_success=True,
+                main_cashback=main['main_cashback'],
+                main_rate_numeric=main['main_rate_numeric'],
+                is_upsized=bool(main['is_upsized']),
+                previous_offer=main['previous_offer'],
+                detailed_rates=[CashbackRate(row['category'], row['category_rate'],
+                                             row['category_rate_numeric'])
+                                for row in rows if row['category'] != 'Main']
+            )
+            record_intervals(write_cursor, store_id, store_info, scraped_at)
+        
+        latest_snapshot.rebuild_store_latest(cursor, INTERVALS_MODE)
+        set_history_mode(conn, INTERVALS_MODE)
+        if drop_history:
+            cursor.execute('DELETE FROM cashback_history')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    if drop_history:
+        conn.execute('VACUUM')
+    
+    intervals = cursor.execute('SELECT COUNT(*) FROM cashback_intervals').fetchone()[0]
+    return source_rows, intervals
+
+def main():
+    """命令行入口"""
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not args or args[0] != 'migrate':
+        print(__doc__)
+        return
+    
+    db_path = args[1] if len(args) > 1 else 'shopback_data.db'
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        source_rows, intervals = migrate_history_to_intervals(conn, '--drop-history' in sys.argv)
+        print(f"迁移完成: {source_rows} 条历史记录 -> {intervals} 个区间")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+ShopBack 页面HTTP缓存
+在SQLite中按URL保存ETag/Last-Modified和上次解析结果，
+请求时自动带上If-None-Match/If-Modified-Since，页面未变化时服务器返回304
+"""
+import json
+from datetime import datetime
+from typing import Dict, Optional
+
+from requests.adapters import HTTPAdapter
+
+from db_pool import SQLitePool
+
+class HTTPCache:
+    """
+    条件请求缓存，与抓取器共用连接池：每次请求前的查询使用只读连接，
+    抓取线程不必等待批量写入释放写锁；只有更新缓存时使用写连接
+    """
+    
+    def __init__(self, pool: SQLitePool):
+        self.pool = pool
+        with self.pool.writer() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    store_info TEXT,
+                    fetched_at TIMESTAMP,
+                    last_checked_at TIMESTAMP,
+                    unchanged_count INTEGER DEFAULT 0
+                )
+            ''')
+            conn.commit()
+    
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """返回条件请求头；没有可复用的解析结果时不发条件请求"""
+        with self.pool.reader() as conn:
+            row = conn.execute('''
+                SELECT etag, last_modified FROM http_cache
+                WHERE url = ? AND store_info IS NOT NULL
+            ''', (url,)).fetchone()
+        
+        headers = {}
+        if row:
+            if row[0]:
+                headers['If-None-Match'] = row[0]
+            if row[1]:
+                headers['If-Modified-Since'] = row[1]
+        return headers
+    
+    def update_validators(self, url: str, etag: Optional[str], last_modified: Optional[str]):
+        """收到200响应时更新校验信息，旧的解析结果随之失效"""
+        now = datetime.now().isoformat()
+        with self.pool.writer() as conn:
+            conn.execute('''
+                INSERT INTO http_cache (url, etag, last_modified, store_info, fetched_at, last_checked_at)
+                VALUES (?, ?, ?, NULL, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag = excluded.etag, last_modified = excluded.last_modified,
+                    store_info = NULL, fetched_at = excluded.fetched_at,
+                    last_checked_at = excluded.last_checked_at, unchanged_count = 0
+            ''', (url, etag, last_modified, now, now))
+            conn.commit()
+    
+    def save_result(self, url: str, store_info: Dict):
+        """保存页面的解析结果，供304时复用"""
+        with self.pool.writer() as conn:
+            conn.execute('''
+                UPDATE http_cache SET store_info = ? WHERE url = ?
+            ''', (json.dumps(store_info, ensure_ascii=False), url))
+            conn.commit()
+    
+    def load_result(self, url: str) -> Optional[Dict]:
+        """读取上次的解析结果"""
+        with self.pool.reader() as conn:
+            row = conn.execute('''
+                SELECT store_info FROM http_cache WHERE url = ?
+            ''', (url,)).fetchone()
+        if row and row[0]:
+            return json.loads(row[0])
+        return None
+    
+    def load_layouts(self) -> Dict[str, str]:
+        """各URL上次解析结果中记录的页面结构 (url -> layout)"""
+        with self.pool.reader() as conn:
+            rows = conn.execute('''
+                SELECT url, store_info FROM http_cache WHERE store_info IS NOT NULL
+            ''').fetchall()
+        layouts = {}
+        for url, store_info in rows:
+            layout = json.loads(store_info).get('layout')
+            if layout:
+                layouts[url] = layout
+        return layouts
+    
+    def invalidate(self, url: str):
+        """删除该URL的缓存，下次请求不带条件请求头"""
+        with self.pool.writer() as conn:
+            conn.execute('DELETE FROM http_cache WHERE url = ?', (url,))
+            conn.commit()
+    
+    def record_unchanged(self, url: str):
+        """记录一次"页面未变化"的观测"""
+        with self.pool.writer() as conn:
+            conn.execute('''
+                UPDATE http_cache
+                SET last_checked_at = ?, unchanged_count = unchanged_count + 1
+                WHERE url = ?
+            ''', (datetime.now().isoformat(), url))
+            conn.commit()
+
+class ConditionalGetAdapter(HTTPAdapter):
+    """为GET请求自动附加条件请求头，并在200响应时记录ETag/Last-Modified"""
+    
+    def __init__(self, cache: HTTPCache, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+    
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return super().send(request, **kwargs)
+        
+        for name, value in self.cache.conditional_headers(request.url).items():
+            request.headers.setdefault(name, value)
+        
+        response = super().send(request, **kwargs)
+        
+        if response.status_code == 200:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                self.cache.update_validators(request.url, etag, last_modified)
+        
+        return response
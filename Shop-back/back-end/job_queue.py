@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+ShopBack 持久化抓取任务队列
+scrape_runs: 一次提交（单个商家 / 批量 / 重新抓取全部 / 定时抓取），状态 queued -> running -> completed 或 cancelled
+scrape_jobs: 提交中的每个URL一个任务，状态 pending -> leased -> done / failed 或 cancelled
+  - 工作线程按批租用任务，处理过程中定期续租；进程退出后租约过期，任务重新可以被租用，
+    重启后从未完成的任务继续，已完成的URL不会重新抓取
+  - 同一URL同时只有一个未完成的任务（部分唯一索引），重复提交的URL直接跳过
+  - 租用次数达到上限的任务（每次处理都导致进程退出）标记为失败，不再重试
+"""
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 提交状态
+RUN_QUEUED = 'queued'
+RUN_RUNNING = 'running'
+RUN_COMPLETED = 'completed'
+RUN_CANCELLED = 'cancelled'
+ACTIVE_RUN_STATES = (RUN_QUEUED, RUN_RUNNING)
+
+# URL任务状态
+JOB_PENDING = 'pending'
+JOB_LEASED = 'leased'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_STATES = (JOB_PENDING, JOB_LEASED, JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# SQLite单条语句的参数个数有上限，IN查询分块执行
+SQL_CHUNK_SIZE = 500
+
+# 可以租用的任务：未租用，或租约已过期
+AVAILABLE_JOB_SQL = '''
+    (state = 'pending' OR (state = 'leased' AND lease_expires_at < CURRENT_TIMESTAMP))
+'''
+
+# 一次提交中可以租用的任务，按提交顺序
+LEASE_JOBS_SQL = f'''
+    SELECT id, url FROM scrape_jobs
+    WHERE run_id = ? AND {AVAILABLE_JOB_SQL}
+    ORDER BY id LIMIT ?
+'''
+
+# 各提交每种状态的任务数，{placeholders}替换为与run_id个数相同的占位符
+JOB_COUNTS_SQL = '''
+    SELECT run_id, state, COUNT(*) FROM scrape_jobs
+    WHERE run_id IN ({placeholders})
+    GROUP BY run_id, state
+'''
+
+# 排队中和进行中的提交
+UNFINISHED_RUNS_SQL = f"SELECT * FROM scrape_runs WHERE state IN ('{RUN_QUEUED}', '{RUN_RUNNING}') ORDER BY id"
+
+def init_queue_tables(cursor):
+    """创建提交表、任务表和索引"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            concurrency INTEGER NOT NULL DEFAULT 1,
+            requests_per_second REAL NOT NULL DEFAULT 1.0,
+            total INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires_at TIMESTAMP,
+            error_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (run_id) REFERENCES scrape_runs (id)
+        )
+    ''')
+    # 同一URL只能有一个未完成的任务，INSERT OR IGNORE即去重
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_scrape_jobs_active_url
+        ON scrape_jobs (url) WHERE state IN ('pending', 'leased')
+    ''')
+    # 租用和进度查询: WHERE run_id = ? AND state = ?
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scrape_jobs_run_state
+        ON scrape_jobs (run_id, state, lease_expires_at)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scrape_runs_state ON scrape_runs (state)')
+
+@dataclass
+class ScrapeRun:
+    """一次提交及其各状态的任务数"""
+    id: int
+    kind: str
+    state: str
+    concurrency: int
+    requests_per_second: float
+    total: int
+    duplicates: int
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    jobs: Dict[str, int] = field(default_factory=dict)
+    
+    @property
+    def active(self) -> bool:
+        return self.state in ACTIVE_RUN_STATES
+    
+    def summary(self) -> Dict:
+        """API返回的进度"""
+        data = asdict(self)
+        finished = sum(self.jobs.get(state, 0) for state in (JOB_DONE, JOB_FAILED, JOB_CANCELLED))
+        data['progress'] = round(finished / self.total, 4) if self.total else 1.0
+        return data
+
+def _chunks(values: Sequence, size: int = SQL_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+class ScrapeJobQueue:
+    """SQLite中的抓取任务队列，写操作使用连接池的写连接（与抓取器共用写锁）"""
+    
+    def __init__(self, pool, max_attempts: int = 3):
+        """max_attempts: 同一任务最多被租用的次数"""
+        self.pool = pool
+        self.max_attempts = max_attempts
+    
+    def create_run(self, kind: str, urls: Sequence[str], concurrency: int = 1,
+                   requests_per_second: float = 1.0) -> ScrapeRun:
+        """创建提交并加入URL任务，已有未完成任务的URL计入duplicates"""
+        with self.pool.writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO scrape_runs (kind, concurrency, requests_per_second) VALUES (?, ?, ?)
+                ''', (kind, concurrency, requests_per_second))
+                run_id = cursor.lastrowid
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO scrape_jobs (run_id, url) VALUES (?, ?)
+                ''', [(run_id, url) for url in dict.fromkeys(urls)])
+                total = cursor.execute('SELECT COUNT(*) FROM scrape_jobs WHERE run_id = ?',
+                                       (run_id,)).fetchone()[0]
+                # 全部URL都已在其他提交中时直接完成
+                cursor.execute(f'''
+                    UPDATE scrape_runs
+                    SET total = ?, duplicates = ?,
+                        state = CASE WHEN ? = 0 THEN '{RUN_COMPLETED}' ELSE state END,
+                        finished_at = CASE WHEN ? = 0 THEN CURRENT_TIMESTAMP END
+                    WHERE id = ?
+                ''', (total, len(urls) - total, total, total, run_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return self.get_run(run_id)
+    
+    def lease(self, owner: str, limit: int, lease_seconds: float) -> Optional[Tuple[ScrapeRun, List[Tuple[int, str]]]]:
+        """
+        从最早的未完成提交中租用最多limit个任务，返回 (提交, [(任务id, url)])，没有任务时返回None
+        """
+        with self.pool.writer() as conn:
+            try:
+                cursor = conn.cursor()
+                run_row = cursor.execute(f'''
+                    SELECT id FROM scrape_runs r
+                    WHERE r.state IN ('{RUN_QUEUED}', '{RUN_RUNNING}')
+                    AND EXISTS (SELECT 1 FROM scrape_jobs WHERE run_id = r.id AND {AVAILABLE_JOB_SQL})
+                    ORDER BY r.id LIMIT 1
+                ''').fetchone()
+                if run_row is None:
+                    return None
+                run_id = run_row[0]
+                
+                # 已租用max_attempts次仍未完成的任务（租约过期或被交还）不再重试
+                cursor.execute(f'''
+                    UPDATE scrape_jobs
+                    SET state = '{JOB_FAILED}',
+                        error_message = CASE WHEN state = '{JOB_LEASED}' THEN '多次处理未完成（租约过期）'
+                                             ELSE COALESCE(error_message, '多次处理失败') END,
+                        lease_owner = NULL, lease_expires_at = NULL, finished_at = CURRENT_TIMESTAMP
+                    WHERE run_id = ? AND {AVAILABLE_JOB_SQL} AND attempts >= ?
+                ''', (run_id, self.max_attempts))
+                
+                jobs = [(row[0], row[1])
+                        for row in cursor.execute(LEASE_JOBS_SQL, (run_id, limit)).fetchall()]
+                for chunk in _chunks([job_id for job_id, _ in jobs]):
+                    cursor.execute(f'''
+                        UPDATE scrape_jobs
+                        SET state = '{JOB_LEASED}', lease_owner = ?, attempts = attempts + 1,
+                            lease_expires_at = datetime('now', ?)
+                        WHERE id IN ({', '.join('?' * len(chunk))})
+                    ''', (owner, f'+{int(lease_seconds)} seconds', *chunk))
+                cursor.execute(f'''
+                    UPDATE scrape_runs SET state = '{RUN_RUNNING}',
+                        started_at = COALESCE(started_at, CURRENT_TIMESTAMP)
+                    WHERE id = ? AND state = '{RUN_QUEUED}'
+                ''', (run_id,))
+                self._finish_run_if_done(cursor, run_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        if not jobs:
+            return self.lease(owner, limit, lease_seconds)
+        return self.get_run(run_id), jobs
+    
+    def renew(self, owner: str, job_ids: Sequence[int], lease_seconds: float):
+        """续租仍在处理的任务"""
+        with self.pool.writer() as conn:
+            for chunk in _chunks(list(job_ids)):
+                conn.execute(f'''
+                    UPDATE scrape_jobs SET lease_expires_at = datetime('now', ?)
+                    WHERE id IN ({', '.join('?' * len(chunk))})
+                    AND state = '{JOB_LEASED}' AND lease_owner = ?
+                ''', (f'+{int(lease_seconds)} seconds', *chunk, owner))
+            conn.commit()
+    
+    def release(self, run_id: int, job_ids: Sequence[int], error: Optional[str] = None):
+        """
+        放弃租约（处理出错时）：任务回到pending，由下一次租用重试；
+        已租用max_attempts次的任务标记为failed，出错的任务不会无限重试
+        """
+        with self.pool.writer() as conn:
+            try:
+                cursor = conn.cursor()
+                for chunk in _chunks(list(job_ids)):
+                    cursor.execute(f'''
+                        UPDATE scrape_jobs
+                        SET state = CASE WHEN attempts >= ? THEN '{JOB_FAILED}' ELSE '{JOB_PENDING}' END,
+                            finished_at = CASE WHEN attempts >= ? THEN CURRENT_TIMESTAMP END,
+                            error_message = ?, lease_owner = NULL, lease_expires_at = NULL
+                        WHERE id IN ({', '.join('?' * len(chunk))}) AND state = '{JOB_LEASED}'
+                    ''', (self.max_attempts, self.max_attempts, error, *chunk))
+                self._finish_run_if_done(cursor, run_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def complete(self, run_id: int, results: Sequence[Tuple[int, bool, Optional[str]]]):
+        """记录任务结果 [(任务id, 是否成功, 错误信息)]，全部任务完成时提交标记为completed"""
+        with self.pool.writer() as conn:
+            try:
+                cursor = conn.cursor()
+                # 已取消的任务保持cancelled
+                cursor.executemany(f'''
+                    UPDATE scrape_jobs
+                    SET state = ?, error_message = ?, lease_owner = NULL, lease_expires_at = NULL,
+                        finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND state IN ('{JOB_PENDING}', '{JOB_LEASED}')
+                ''', [(JOB_DONE if success else JOB_FAILED, error, job_id)
+                      for job_id, success, error in results])
+                self._finish_run_if_done(cursor, run_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def _finish_run_if_done(self, cursor, run_id: int):
+        cursor.execute(f'''
+            UPDATE scrape_runs SET state = '{RUN_COMPLETED}', finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND state = '{RUN_RUNNING}'
+            AND NOT EXISTS (SELECT 1 FROM scrape_jobs WHERE run_id = ? AND state IN ('{JOB_PENDING}', '{JOB_LEASED}'))
+        ''', (run_id, run_id))
+    
+    def cancel(self, run_id: int) -> bool:
+        """取消提交：未完成的任务全部标记为cancelled，正在处理的批次在下次记录结果时停止"""
+        with self.pool.writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    UPDATE scrape_runs SET state = '{RUN_CANCELLED}', finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND state IN ('{RUN_QUEUED}', '{RUN_RUNNING}')
+                ''', (run_id,))
+                cancelled = cursor.rowcount > 0
+                cursor.execute(f'''
+                    UPDATE scrape_jobs
+                    SET state = '{JOB_CANCELLED}', lease_owner = NULL, lease_expires_at = NULL,
+                        finished_at = CURRENT_TIMESTAMP
+                    WHERE run_id = ? AND state IN ('{JOB_PENDING}', '{JOB_LEASED}')
+                ''', (run_id,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return cancelled
+    
+    def _job_counts(self, conn, run_ids: Sequence[int]) -> Dict[int, Dict[str, int]]:
+        counts: Dict[int, Dict[str, int]] = {run_id: {} for run_id in run_ids}
+        for chunk in _chunks(list(run_ids)):
+            for row in conn.execute(JOB_COUNTS_SQL.format(placeholders=', '.join('?' * len(chunk))), chunk):
+                counts[row[0]][row[1]] = row[2]
+        return counts
+    
+    def _runs(self, conn, rows) -> List[ScrapeRun]:
+        counts = self._job_counts(conn, [row['id'] for row in rows])
+        return [ScrapeRun(**dict(row), jobs=counts[row['id']]) for row in rows]
+    
+    def get_run(self, run_id: int) -> Optional[ScrapeRun]:
+        """提交及各状态的任务数"""
+        with self.pool.reader() as conn:
+            row = conn.execute('SELECT * FROM scrape_runs WHERE id = ?', (run_id,)).fetchone()
+            return self._runs(conn, [row])[0] if row else None
+    
+    def list_runs(self, state: Optional[str] = None, limit: int = 20) -> List[ScrapeRun]:
+        """最近的提交，按id倒序"""
+        with self.pool.reader() as conn:
+            if state:
+                rows = conn.execute('''
+                    SELECT * FROM scrape_runs WHERE state = ? ORDER BY id DESC LIMIT ?
+                ''', (state, limit)).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM scrape_runs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+            return self._runs(conn, rows)
+    
+    def unfinished_runs(self) -> List[ScrapeRun]:
+        """排队中和进行中的提交（按提交顺序）"""
+        with self.pool.reader() as conn:
+            rows = conn.execute(UNFINISHED_RUNS_SQL).fetchall()
+            return self._runs(conn, rows)
+    
+    def run_state(self, run_id: int) -> Optional[str]:
+        with self.pool.reader() as conn:
+            row = conn.execute('SELECT state FROM scrape_runs WHERE id = ?', (run_id,)).fetchone()
+            return row[0] if row else None
+    
+    def job_errors(self, run_id: int, limit: int = 50) -> List[Dict]:
+        """提交中失败的URL及错误信息"""
+        with self.pool.reader() as conn:
+            rows = conn.execute(f'''
+                SELECT url, error_message, attempts, finished_at FROM scrape_jobs
+                WHERE run_id = ? AND state = '{JOB_FAILED}' ORDER BY id LIMIT ?
+            ''', (run_id, limit)).fetchall()
+            return [dict(row) for row in rows]
+    
+    def counts(self) -> Dict[str, int]:
+        """未完成的提交数和等待处理/处理中的任务数"""
+        with self.pool.reader() as conn:
+            active_runs = conn.execute(f'''
+                SELECT COUNT(*) FROM scrape_runs WHERE state IN ('{RUN_QUEUED}', '{RUN_RUNNING}')
+            ''').fetchone()[0]
+            jobs = dict(conn.execute(f'''
+                SELECT state, COUNT(*) FROM scrape_jobs
+                WHERE state IN ('{JOB_PENDING}', '{JOB_LEASED}') GROUP BY state
+            ''').fetchall())
+        return {
+            "active_runs": active_runs,
+            "pending_jobs": jobs.get(JOB_PENDING, 0),
+            "leased_jobs": jobs.get(JOB_LEASED, 0),
+        }
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+ShopBack 最新数据快照
+store_latest 按 (store_id, category) 保存每个商家最近一次抓取的数据，
+由 cashback_history / cashback_intervals 上的触发器在同一事务中维护，
+查询"当前状态"时不再需要扫描整个历史表
+"""
+import dashboard_counters
+import history_store
+
+def init_latest_tables(cursor):
+    """创建快照表、索引和维护触发器"""
+    # Main行的category_rate即main_cashback，is_upsized/previous_offer以Main行为准
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS store_latest (
+            store_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            history_id INTEGER,
+            category_rate TEXT,
+            category_rate_numeric REAL,
+            is_upsized BOOLEAN DEFAULT FALSE,
+            previous_offer TEXT,
+            scraped_at TIMESTAMP,
+            PRIMARY KEY (store_id, category),
+            FOREIGN KEY (store_id) REFERENCES stores (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_latest_category_rate ON store_latest (category, category_rate_numeric)')
+    
+    # rows模式：Main行是一次抓取写入的第一行，先清掉该商家上一次抓取的分类
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_history_latest
+        AFTER INSERT ON cashback_history
+        BEGIN
+            DELETE FROM store_latest WHERE store_id = NEW.store_id AND NEW.category = 'Main';
+            INSERT INTO store_latest
+            (store_id, category, history_id, category_rate, category_rate_numeric,
+             is_upsized, previous_offer, scraped_at)
+            VALUES (NEW.store_id, NEW.category, NEW.id, NEW.category_rate, NEW.category_rate_numeric,
+                    NEW.is_upsized, NEW.previous_offer, NEW.scraped_at)
+            ON CONFLICT(store_id, category) DO UPDATE SET
+                history_id = excluded.history_id,
+                category_rate = excluded.category_rate,
+                category_rate_numeric = excluded.category_rate_numeric,
+                is_upsized = excluded.is_upsized,
+                previous_offer = excluded.previous_offer,
+                scraped_at = excluded.scraped_at;
+        END
+    ''')
+    
+    # intervals模式：开启区间即成为最新数据，关闭区间则移出快照
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_intervals_latest_open
+        AFTER INSERT ON cashback_intervals
+        WHEN NEW.valid_to IS NULL
+        BEGIN
+            INSERT INTO store_latest
+            (store_id, category, history_id, category_rate, category_rate_numeric,
+             is_upsized, previous_offer, scraped_at)
+            VALUES (NEW.store_id, NEW.category, NEW.id, NEW.category_rate, NEW.category_rate_numeric,
+                    NEW.is_upsized, NEW.previous_offer, NEW.valid_from)
+            ON CONFLICT(store_id, category) DO UPDATE SET
+                history_id = excluded.history_id,
+                category_rate = excluded.category_rate,
+                category_rate_numeric = excluded.category_rate_numeric,
+                is_upsized = excluded.is_upsized,
+                previous_offer = excluded.previous_offer,
+                scraped_at = excluded.scraped_at;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_intervals_latest_close
+        AFTER UPDATE OF valid_to ON cashback_intervals
+        WHEN NEW.valid_to IS NOT NULL
+        BEGIN
+            DELETE FROM store_latest
+            WHERE store_id = NEW.store_id AND category = NEW.category AND history_id = NEW.id;
+        END
+    ''')
+
+def rebuild_store_latest(cursor, mode: str):
+    """由历史数据重建快照"""
+    cursor.execute('DELETE FROM store_latest')
+    if mode == history_store.INTERVALS_MODE:
+        cursor.execute('''
+            INSERT INTO store_latest
+            (store_id, category, history_id, category_rate, category_rate_numeric,
+             is_upsized, previous_offer, scraped_at)
+            SELECT store_id, category, id, category_rate, category_rate_numeric,
+                   is_upsized, previous_offer, valid_from
+            FROM cashback_intervals
+            WHERE valid_to IS NULL
+            ORDER BY id
+        ''')
+    else:
+        # 每个商家最后一个Main行及其之后的行构成最近一次抓取
+        cursor.execute('''
+            INSERT OR REPLACE INTO store_latest
+            (store_id, category, history_id, category_rate, category_rate_numeric,
+             is_upsized, previous_offer, scraped_at)
+            SELECT ch.store_id, ch.category, ch.id, ch.category_rate, ch.category_rate_numeric,
+                   ch.is_upsized, ch.previous_offer, ch.scraped_at
+            FROM cashback_history ch
+            JOIN (SELECT store_id, MAX(id) AS main_id FROM cashback_history
+                  WHERE category = 'Main' GROUP BY store_id) last_main
+                ON last_main.store_id = ch.store_id AND ch.id >= last_main.main_id
+            ORDER BY ch.id
+        ''')
+    # INSERT OR REPLACE替换行时不触发DELETE触发器，仪表盘计数器按重建后的数据重新计算
+    dashboard_counters.rebuild_counters(cursor)
+
+def ensure_store_latest(cursor, mode: str):
+    """快照为空而历史表有数据时（旧数据库升级）重建快照"""
+    if cursor.execute('SELECT 1 FROM store_latest LIMIT 1').fetchone():
+        return
+    source = 'cashback_intervals' if mode == history_store.INTERVALS_MODE else 'cashback_history'
+    if cursor.execute(f'SELECT 1 FROM {source} LIMIT 1').fetchone():
+        rebuild_store_latest(cursor, mode)
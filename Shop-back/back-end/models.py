@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+ShopBack 数据结构
+抓取器、页面解析器和批量写入共用的商家信息数据类
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+@dataclass
+class CashbackRate:
+    """Cashback比例数据结构"""
+    category: str
+    rate: str
+    rate_numeric: float
+
+@dataclass
+class StoreInfo:
+    """商家信息数据结构"""
+    name: str
+    main_cashback: str
+    main_rate_numeric: float
+    detailed_rates: List[CashbackRate]
+    is_upsized: bool
+    previous_offer: Optional[str]
+    url: str
+    last_updated: str
+    scraping_success: bool
+    error_message: Optional[str] = None
+    not_modified: bool = False  # 页面返回304，数据沿用上次解析结果
+    layout: Optional[str] = None  # 解析时匹配的页面结构 (page_data / simple / complex)
+
+def store_info_from_dict(data: Dict) -> StoreInfo:
+    """从字典（asdict的结果）还原StoreInfo"""
+    data = dict(data)
+    data['detailed_rates'] = [CashbackRate(**rate) for rate in data.get('detailed_rates', [])]
+    return StoreInfo(**data)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+ShopBack 游标分页
+列表按 (时间, id) 倒序排列，下一页的游标记录上一页最后一行的 (时间, id)，
+查询使用 WHERE (时间, id) < (?, ?) 从索引直接定位，任意深度的分页代价相同，
+并且翻页期间新插入的行不会使后面的页面错位
+游标为不透明的URL安全base64字符串，客户端原样传回
+"""
+import base64
+import json
+from typing import Optional, Sequence, Tuple
+
+# 下一页游标所在的响应头
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(kind: str, timestamp: str, row_id: int) -> str:
+    """生成游标，kind区分接口，避免游标被用于其他列表"""
+    payload = json.dumps([kind, timestamp, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(kind: str, cursor: str) -> Tuple[str, int]:
+    """解析游标，返回 (时间, id)，游标无效时抛出ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_kind, timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("无效的分页游标")
+    if cursor_kind != kind or not isinstance(timestamp, str) or not isinstance(row_id, int):
+        raise ValueError("无效的分页游标")
+    return timestamp, row_id
+
+def next_cursor(kind: str, rows: Sequence, limit: int, time_column: str) -> Optional[str]:
+    """本页已满时由最后一行生成下一页的游标，否则没有下一页"""
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor(kind, str(last[time_column]), last['id'])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+ShopBack 页面内嵌数据提取
+商家页面由Next.js渲染，页面中带有完整的商家数据（商家名称、当前优惠、各分类比例）:
+  flight        - App Router: self.__next_f.push([1, "..."]) 分块写入的RSC数据
+  __NEXT_DATA__ - Pages Router: <script id="__NEXT_DATA__" type="application/json">
+  window.__INITIAL_STATE__ 等全局变量赋值
+只定位 "merchantDetail" 对象并用 JSONDecoder.raw_decode 解码这一个对象，
+不需要构建DOM，也不依赖CSS类名
+"""
+import json
+import re
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+MERCHANT_KEY = '"merchantDetail"'
+
+# 由内嵌数据解析时记录的页面结构名（StoreInfo.layout）
+LAYOUT = 'page_data'
+
+NEXT_DATA_PATTERN = re.compile(r'<script[^>]*\bid="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+
+STATE_PATTERN = re.compile(r'window\.__(?:INITIAL_STATE|NEXT_DATA|APOLLO_STATE)__\s*=\s*')
+
+# 每个数据块是一个 <script>self.__next_f.push([1,"..."])</script>，字符串中的'<'已转义
+FLIGHT_PUSH = 'self.__next_f.push('
+FLIGHT_END = ')</script>'
+
+_decoder = json.JSONDecoder()
+
+def decode_object(text: str, key: str, start: int = 0) -> Optional[Dict]:
+    """解码text中start之后第一个 key: {...} 的对象值"""
+    position = text.find(key + ':', start)
+    if position < 0:
+        return None
+    position += len(key) + 1
+    while position < len(text) and text[position] in ' \t\r\n':
+        position += 1
+    try:
+        value, _ = _decoder.raw_decode(text, position)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+def flight_chunks(html: bytes, start: int = 0) -> Iterator[str]:
+    """从start开始依次解码RSC数据块（只取类型1）"""
+    push, end_marker = FLIGHT_PUSH.encode(), FLIGHT_END.encode()
+    position = html.find(push, start)
+    while position >= 0:
+        end = html.find(end_marker, position)
+        if end < 0:
+            return
+        value = json.loads(html[position + len(push):end])
+        if value[0] == 1 and len(value) > 1:
+            yield value[1]
+        position = html.find(push, end)
+
+def _from_flight(html: bytes) -> Optional[Dict]:
+    """
+    只解码包含merchantDetail的数据块，对象跨越多个数据块时继续拼接后面的块，
+    不用解码整个页面和全部RSC数据
+    """
+    key_position = html.find(b'merchantDetail')
+    chunk_start = html.rfind(FLIGHT_PUSH.encode(), 0, key_position)
+    if key_position < 0 or chunk_start < 0:
+        return None
+    
+    payload = ''
+    for chunk in flight_chunks(html, chunk_start):
+        payload += chunk
+        detail = decode_object(payload, MERCHANT_KEY)
+        if detail is not None:
+            return detail
+    return None
+
+def _from_next_data(html: str) -> Optional[Dict]:
+    match = NEXT_DATA_PATTERN.search(html)
+    return decode_object(match.group(1), MERCHANT_KEY) if match else None
+
+def _from_state(html: str) -> Optional[Dict]:
+    for match in STATE_PATTERN.finditer(html):
+        detail = decode_object(html, MERCHANT_KEY, match.end())
+        if detail is not None:
+            return detail
+    return None
+
+# (来源, 提取函数)，按顺序尝试；flight直接在原始字节上查找，其余需要解码后的文本
+SOURCES = [
+    ('flight', _from_flight, bytes),
+    ('__NEXT_DATA__', _from_next_data, str),
+    ('state', _from_state, str),
+]
+
+def extract_merchant_detail(content: Union[bytes, str]) -> Optional[Tuple[str, Dict]]:
+    """
+    返回 (来源, merchantDetail字典)，页面中没有可用的内嵌数据时返回None
+    merchantDetail至少包含currentOffer
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    # 没有商家数据的页面（错误页、验证页等）在这里直接返回
+    if b'merchantDetail' not in content:
+        return None
+    
+    text = None
+    for source, extract, input_type in SOURCES:
+        if input_type is str and text is None:
+            text = content.decode('utf-8', errors='replace')
+        try:
+            detail = extract(content if input_type is bytes else text)
+        except ValueError:  # 数据块无法解码（页面被截断等）
+            continue
+        if detail and isinstance(detail.get('currentOffer'), dict):
+            return source, detail
+    return None
@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+"""
+ShopBack 商家页面解析
+提取逻辑只依赖少量DOM操作 (find / select / select_all / text)，由不同的解析后端实现:
+  lxml        - lxml.html + XPath，速度快，需要安装lxml
+  stream      - lxml增量解析，只保留需要的子树，内存占用最低
+  html.parser - BeautifulSoup + 标准库html.parser，始终可用的回退方案
+页面带有Next.js内嵌数据时直接由数据构造结果（见page_data.py），不构建DOM；
+分类比例列表的页面结构见selector_profiles.py
+"""
+import logging
+import re
+from dataclasses import asdict
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+import page_data
+import rate_parser
+from models import CashbackRate, StoreInfo
+from selector_profiles import Field, LayoutProfile, Selector, layout_order
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # lxml为可选依赖
+    lxml = None
+    etree = None
+
+# 分类名称的最大长度，更长的截断并加"..."
+MAX_CATEGORY_LENGTH = 100
+
+class ShopBackPageParser:
+    """ShopBack商家页面解析器 (BeautifulSoup + html.parser)"""
+    
+    backend = 'html.parser'
+    
+    def __init__(self, logger: Optional[logging.Logger] = None, use_page_data: bool = True):
+        """use_page_data: 优先使用页面内嵌数据，为False时总是解析DOM"""
+        self.logger = logger or logging.getLogger(__name__)
+        self.use_page_data = use_page_data
+    
+    def load_document(self, content: bytes):
+        """解析HTML，返回文档根节点"""
+        soup = BeautifulSoup(content, self.backend)
+        
+        # 移除script和style标签，避免抓取到它们的内容
+        for element in soup(["style", "noscript"]):
+            element.decompose()
+        return soup
+    
+    def find(self, node, tag: Optional[str] = None, testid: Optional[str] = None,
+             classes: Tuple[str, ...] = (), pattern: Optional[re.Pattern] = None):
+        """
+        查找node下第一个匹配的元素
+        testid: data-testid属性值; classes: class中需要包含的子串; pattern: 元素文本需匹配的正则
+        """
+        selector = Selector(tag, testid, tuple(classes))
+        if pattern is not None:
+            return node.find(_soup_name(selector), string=pattern)
+        return self.select(node, selector)
+    
+    def text(self, node) -> str:
+        """元素的全部文本（去掉首尾空白）"""
+        return node.get_text().strip()
+    
+    def select(self, node, selector: Selector):
+        """node下第一个匹配选择器的元素"""
+        name = _soup_name(selector)
+        if not isinstance(name, str):
+            return node.find(name)
+        return next(iter(self.select_all(node, selector)), None)
+    
+    def select_all(self, node, selector: Selector) -> list:
+        """
+        node下所有匹配选择器的元素（文档顺序）
+        有标签名时先按名称查找（BeautifulSoup对名称有快速路径），再用编译后的匹配函数过滤
+        """
+        name = _soup_name(selector)
+        if selector.tag is None:
+            return node.find_all(name)
+        elements = node.find_all(selector.tag)
+        if isinstance(name, str):
+            return elements
+        return [element for element in elements if name(element)]
+    
+    def extract_numeric_rate(self, rate_text: str) -> float:
+        """从文本中提取数字比例（百分比或金额）"""
+        return rate_parser.numeric_rate(rate_text)
+    
+    def make_rate(self, category: Optional[str], rate: Optional[str]) -> Optional[CashbackRate]:
+        """
+        由分类名称和比例文本构造CashbackRate，DOM和内嵌数据两种来源共用，
+        结果的格式一致；不是百分比的行返回None
+        """
+        category = (category or '').strip()
+        rate = (rate or '').strip()
+        if not category or '%' not in rate:
+            return None
+        # 限制分类名称长度，避免过长的描述
+        if len(category) > MAX_CATEGORY_LENGTH:
+            category = category[:MAX_CATEGORY_LENGTH] + "..."
+        return CashbackRate(category=category, rate=rate, rate_numeric=self.extract_numeric_rate(rate))
+    
+    def extract_store_name(self, document, url: str) -> str:
+        """提取商家名称"""
+        # 尝试从页面标题提取
+        title_element = self.find(document, 'title') if document is not None else None
+        if title_element is not None:
+            title_text = self.text(title_element)
+            if '|' in title_text:
+                store_name = title_text.split('|')[0].strip()
+                # 清理商家名称
+                store_name = re.sub(r'\s*(Cashback|Discount|Codes|Vouchers|Deals)\s*', '', store_name, flags=re.IGNORECASE)
+                if store_name:
+                    return store_name
+        
+        # 从URL提取
+        url_parts = url.rstrip('/').split('/')
+        if url_parts:
+            store_slug = url_parts[-1]
+            store_name = ' '.join(word.capitalize() for word in store_slug.split('-'))
+            return store_name
+        
+        return "Unknown Store"
+    
+    def extract_main_cashback_info(self, document) -> Tuple[str, bool, Optional[str]]:
+        """
+        提取主要cashback信息
+        支持两种HTML结构:
+        1. data-testid="all-cashback-rates" (复杂结构)
+        2. data-testid="cashback-rates" (简单结构)
+        """
+        main_cashback = "0%"
+        is_upsized = False
+        previous_offer = None
+        
+        try:
+            # 方法1: 查找data-testid="current-offer"的元素 (新结构)
+            current_offer_element = self.find(document, testid='current-offer')
+            if current_offer_element is not None:
+                main_cashback = self.text(current_offer_element)
+                self.logger.info(f"从current-offer找到主要cashback: {main_cashback}")
+            else:
+                # 方法2: 查找包含"Up to"和"Cashback"的h5元素 (旧结构)
+                main_rate_element = self.find(document, 'h5', pattern=re.compile(r'Up to.*%.*Cashback', re.IGNORECASE))
+                if main_rate_element is None:
+                    # 备选：寻找包含百分号的h5元素
+                    main_rate_element = self.find(document, 'h5', pattern=re.compile(r'\d+\.?\d*%'))
+                
+                if main_rate_element is not None:
+                    main_cashback = self.text(main_rate_element)
+                    self.logger.info(f"从h5元素找到主要cashback: {main_cashback}")
+            
+            # 检查是否有upsized标签
+            # 寻找包含"Upsized"文本的p元素
+            upsized_element = self.find(document, 'p', pattern=re.compile(r'Upsized', re.IGNORECASE))
+            is_upsized = upsized_element is not None
+            if is_upsized:
+                self.logger.info("检测到Upsized标签")
+            
+            # 查找previous offer (有删除线的价格)
+            # 方法1: 查找data-testid="worse-offer"的元素 (新结构)
+            worse_offer_element = self.find(document, testid='worse-offer')
+            if worse_offer_element is not None:
+                previous_text = self.text(worse_offer_element)
+                if previous_text:  # 确保不是空文本
+                    previous_offer = previous_text
+                    self.logger.info(f"从worse-offer找到之前的优惠: {previous_offer}")
+            else:
+                # 方法2: 寻找有text-decor_line-through类的h5元素 (旧结构)
+                previous_element = self.find(document, 'h5', classes=('text-decor_line-through',))
+                if previous_element is not None:
+                    previous_offer = self.text(previous_element)
+                    self.logger.info(f"从line-through元素找到之前的优惠: {previous_offer}")
+        
+        except Exception as e:
+            self.logger.warning(f"提取主要cashback信息时出错: {e}")
+        
+        return main_cashback, is_upsized, previous_offer
+    
+    def field_text(self, row, field: Field) -> Optional[str]:
+        """rate行中字段的文本，找不到时返回None"""
+        node = row
+        for selector in field.path:
+            node = self.select(node, selector)
+            if node is None:
+                return None
+        
+        candidates = self.select_all(node, field.select)
+        if field.index is not None:
+            return self.text(candidates[field.index]) if len(candidates) > field.index else None
+        for candidate in candidates:
+            text = self.text(candidate)
+            if '%' in text and not any(keyword in text.lower() for keyword in field.exclude):
+                return text
+        return None
+    
+    def extract_layout_rates(self, document, layout: LayoutProfile) -> Optional[List[CashbackRate]]:
+        """按一种页面结构提取分类比例，页面上没有该结构的容器时返回None"""
+        node = document
+        for selector in layout.container:
+            node = self.select(node, selector)
+            if node is None:
+                return None
+        self.logger.info(f"找到{layout.container[0].testid}容器 ({layout.description})")
+        
+        rate_rows = self.select_all(node, layout.rows)
+        self.logger.info(f"在{layout.description}中找到 {len(rate_rows)} 个rate行")
+        
+        detailed_rates = []
+        for i, row in enumerate(rate_rows):
+            try:
+                cashback_rate = self.make_rate(self.field_text(row, layout.category),
+                                               self.field_text(row, layout.rate))
+                if cashback_rate is not None:
+                    detailed_rates.append(cashback_rate)
+                    self.logger.info(f"{layout.description}提取到rate {i+1}: "
+                                     f"{cashback_rate.category} -> {cashback_rate.rate}")
+            
+            except Exception as e:
+                self.logger.warning(f"处理{layout.description}rate行 {i+1} 时出错: {e}")
+                continue
+        
+        return detailed_rates
+    
+    def extract_rates_with_layout(self, document,
+                                  preferred_layout: Optional[str] = None) -> Tuple[List[CashbackRate], Optional[str]]:
+        """
+        依次尝试各页面结构（preferred_layout优先），返回 (分类比例, 匹配的结构名)
+        第一个提取到比例的结构即为结果
+        """
+        try:
+            for layout in layout_order(preferred_layout):
+                detailed_rates = self.extract_layout_rates(document, layout)
+                if detailed_rates:
+                    return detailed_rates, layout.name
+            
+            self.logger.warning("未找到任何cashback-rates容器")
+        
+        except Exception as e:
+            self.logger.error(f"提取详细rates时出错: {e}")
+        
+        return [], None
+    
+    def extract_detailed_rates(self, document) -> List[CashbackRate]:
+        """
+        提取详细的cashback比例
+        支持的页面结构见selector_profiles.LAYOUTS
+        """
+        return self.extract_rates_with_layout(document)[0]
+    
+    def store_info_from_merchant(self, detail: Dict, url: str) -> StoreInfo:
+        """由内嵌数据的merchantDetail构造StoreInfo"""
+        offer = detail['currentOffer']
+        main_cashback = offer['renderedOffer']['displayText']
+        offer_types = offer.get('offerTypes') or [offer.get('offerType')]
+        
+        # 与页面的worse-offer相同：升级优惠之前的比例
+        previous_offer = None
+        worse_offer = detail.get('worseComparisonOffer')
+        if worse_offer:
+            previous_offer = worse_offer['renderedOffer']['shortDisplayText']
+        
+        # 单一比例的商家页面上没有分类列表，Main行已包含该比例
+        detailed_rates = []
+        tiers = offer.get('cashbackTiers') or []
+        if offer.get('tierType') != 'SINGLE_TIER' or len(tiers) > 1:
+            rates = (self.make_rate(tier['label'], tier['displayText']) for tier in tiers)
+            detailed_rates = [rate for rate in rates if rate is not None]
+        
+        return StoreInfo(
+            name=detail.get('name') or self.extract_store_name(None, url),
+            main_cashback=main_cashback,
+            main_rate_numeric=self.extract_numeric_rate(main_cashback),
+            detailed_rates=detailed_rates,
+            is_upsized='UPSIZE' in offer_types,
+            previous_offer=previous_offer,
+            url=url,
+            last_updated=datetime.now().isoformat(),
+            scraping_success=True,
+            layout=page_data.LAYOUT
+        )
+    
+    def extract_page_data(self, content: bytes, url: str) -> Optional[StoreInfo]:
+        """从页面内嵌数据提取商家信息，没有内嵌数据或结构不符时返回None"""
+        found = page_data.extract_merchant_detail(content)
+        if found is None:
+            return None
+        
+        source, detail = found
+        try:
+            store_info = self.store_info_from_merchant(detail, url)
+        except (KeyError, TypeError, ValueError) as e:
+            self.logger.warning(f"内嵌数据结构不符，改用DOM解析: {e!r}")
+            return None
+        self.logger.info(f"从内嵌数据({source})提取: {store_info.name} - {store_info.main_cashback}, "
+                         f"{len(store_info.detailed_rates)} 个详细分类")
+        return store_info
+    
+    def parse(self, content: bytes, url: str, layout: Optional[str] = None) -> StoreInfo:
+        """
+        解析页面内容，提取商家信息（不访问网络和数据库）
+        layout: 该商家上次匹配的页面结构（StoreInfo.layout），先尝试该结构
+        """
+        if self.use_page_data:
+            store_info = self.extract_page_data(content, url)
+            if store_info is not None:
+                return store_info
+        
+        document = self.load_document(content)
+        
+        # 提取商家名称
+        store_name = self.extract_store_name(document, url)
+        
+        # 提取主要cashback信息
+        main_cashback, is_upsized, previous_offer = self.extract_main_cashback_info(document)
+        
+        # 提取详细的cashback层级信息
+        detailed_rates, matched_layout = self.extract_rates_with_layout(document, layout)
+        
+        return StoreInfo(
+            name=store_name,
+            main_cashback=main_cashback,
+            main_rate_numeric=self.extract_numeric_rate(main_cashback),
+            detailed_rates=detailed_rates,
+            is_upsized=is_upsized,
+            previous_offer=previous_offer,
+            url=url,
+            last_updated=datetime.now().isoformat(),
+            scraping_success=True,
+            layout=matched_layout
+        )
+    
+    def failed_store_info(self, url: str, error: Exception) -> StoreInfo:
+        """构造抓取失败时返回的StoreInfo"""
+        return StoreInfo(
+            name=self.extract_store_name(None, url),
+            main_cashback="0%",
+            main_rate_numeric=0.0,
+            detailed_rates=[],
+            is_upsized=False,
+            previous_offer=None,
+            url=url,
+            last_updated=datetime.now().isoformat(),
+            scraping_success=False,
+            error_message=str(error)
+        )
+
+@lru_cache(maxsize=None)
+def _soup_matcher(selector: Selector):
+    """把选择器编译成BeautifulSoup的匹配函数，每个元素只调用一次（class按整个属性值匹配子串）"""
+    tag, testid, classes = selector.tag, selector.testid, selector.classes
+    
+    def matches(element) -> bool:
+        if tag and element.name != tag:
+            return False
+        if testid and element.get('data-testid') != testid:
+            return False
+        if classes:
+            value = element.get('class')
+            if not value:
+                return False
+            value = ' '.join(value) if isinstance(value, list) else value
+            return all(name in value for name in classes)
+        return True
+    return matches
+
+def _soup_name(selector: Selector):
+    """只有标签名的选择器直接按名称查找，其余使用编译后的匹配函数"""
+    if not selector.testid and not selector.classes:
+        return selector.tag
+    return _soup_matcher(selector)
+
+@lru_cache(maxsize=64)
+def _compiled_xpath(tag: Optional[str], with_testid: bool, class_count: int):
+    """按查询形状缓存编译好的XPath，具体取值通过变量传入"""
+    conditions = ['@data-testid = $testid'] if with_testid else []
+    conditions += [f'contains(@class, $class{i})' for i in range(class_count)]
+    return etree.XPath(f".//{tag or '*'}" + ''.join(f'[{condition}]' for condition in conditions))
+
+def _element_string(element) -> Optional[str]:
+    """与BeautifulSoup的Tag.string相同：元素只有唯一的文本（可经过单个子元素）时返回该文本"""
+    while True:
+        children = list(element)
+        if not children:
+            return element.text
+        child = children[0]
+        if len(children) > 1 or element.text or child.tail or not isinstance(child.tag, str):
+            return None
+        element = child
+
+class LxmlPageParser(ShopBackPageParser):
+    """lxml.html + XPath实现，提取逻辑与html.parser版本相同"""
+    
+    backend = 'lxml'
+    
+    def load_document(self, content: bytes):
+        """解析HTML，返回文档根节点"""
+        document = lxml.html.document_fromstring(content)
+        
+        # 移除style和noscript标签，保留元素后面的文本
+        for element in document.xpath('//style | //noscript'):
+            element.drop_tree()
+        return document
+    
+    def _select(self, node, tag: Optional[str], testid: Optional[str], classes: Tuple[str, ...]) -> list:
+        variables = {f'class{i}': name for i, name in enumerate(classes)}
+        if testid:
+            variables['testid'] = testid
+        return _compiled_xpath(tag, bool(testid), len(classes))(node, **variables)
+    
+    def find(self, node, tag: Optional[str] = None, testid: Optional[str] = None,
+             classes: Tuple[str, ...] = (), pattern: Optional[re.Pattern] = None):
+        for element in self._select(node, tag, testid, classes):
+            if pattern is None:
+                return element
+            string = _element_string(element)
+            if string is not None and pattern.search(string):
+                return element
+        return None
+    
+    def select(self, node, selector: Selector):
+        elements = self.select_all(node, selector)
+        return elements[0] if elements else None
+    
+    def select_all(self, node, selector: Selector) -> list:
+        return self._select(node, selector.tag, selector.testid, selector.classes)
+    
+    def text(self, node) -> str:
+        return node.text_content().strip()
+    
+    def parse(self, content: bytes, url: str, layout: Optional[str] = None) -> StoreInfo:
+        try:
+            return super().parse(content, url, layout)
+        except etree.LxmlError as e:
+            # lxml无法解析（如空文档）时交给html.parser
+            self.logger.warning(f"lxml解析失败，改用html.parser: {e}")
+            return ShopBackPageParser(self.logger, use_page_data=False).parse(content, url, layout)
+
+class StreamingPageParser(LxmlPageParser):
+    """
+    增量解析：分块喂给lxml的HTMLPullParser，只保留提取需要的子树，
+    其余元素在结束标签处立即释放，不在内存中保留整棵DOM
+    """
+    
+    backend = 'stream'
+    
+    CHUNK_SIZE = 64 * 1024
+    
+    # 整个保留的data-testid容器
+    TESTIDS = frozenset({'current-offer', 'worse-offer', 'cashback-rates',
+                         'cashback-tier-block', 'all-cashback-rates'})
+    
+    # 在data-testid容器之外还需要查找的元素：满足条件时保留
+    CANDIDATE_PATTERNS = {
+        'p': [re.compile(r'Upsized', re.IGNORECASE)],
+        'h5': [re.compile(r'Up to.*%.*Cashback', re.IGNORECASE), re.compile(r'\d+\.?\d*%')],
+    }
+    CANDIDATE_CLASSES = {'h5': 'text-decor_line-through'}
+    
+    def _wanted(self, element) -> bool:
+        """开始标签处判断是否保留该元素的子树"""
+        return (element.get('data-testid') in self.TESTIDS
+                or element.tag == 'title'
+                or element.tag in self.CANDIDATE_PATTERNS)
+    
+    def _still_wanted(self, element) -> bool:
+        """结束标签处再次判断：p/h5只在文本或class符合条件时保留"""
+        if element.tag not in self.CANDIDATE_PATTERNS or element.get('data-testid') in self.TESTIDS:
+            return True
+        class_name = self.CANDIDATE_CLASSES.get(element.tag)
+        if class_name and class_name in (element.get('class') or ''):
+            return True
+        string = _element_string(element)
+        return string is not None and any(pattern.search(string)
+                                          for pattern in self.CANDIDATE_PATTERNS[element.tag])
+    
+    def load_document(self, content: bytes):
+        """解析HTML，返回只包含所需子树（保持文档顺序）的根节点"""
+        return self.load_stream(content[i:i + self.CHUNK_SIZE]
+                                for i in range(0, len(content), self.CHUNK_SIZE))
+    
+    def load_stream(self, chunks: Iterable[bytes]):
+        """从字节块流解析（例如 response.iter_content()）"""
+        parser = etree.HTMLPullParser(events=('start', 'end'))
+        parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+        document = lxml.html.Element('html')
+        state = {'depth': 0}
+        
+        for chunk in chunks:
+            parser.feed(chunk)
+            self._consume_events(parser, document, state)
+        parser.close()
+        self._consume_events(parser, document, state)
+        return document
+    
+    def _consume_events(self, parser, document, state: dict):
+        for event, element in parser.read_events():
+            if event == 'start':
+                if state['depth'] or self._wanted(element):
+                    state['depth'] += 1
+                continue
+            
+            parent = element.getparent()
+            if not state['depth']:
+                # 不需要的元素：子元素已处理完，直接从树中移除
+                if parent is not None:
+                    parent.remove(element)
+                continue
+            
+            state['depth'] -= 1
+            if state['depth']:
+                if element.tag in ('style', 'noscript'):
+                    element.drop_tree()
+                continue
+            
+            # 保留的子树结束：移到结果文档中（不带后面的文本）
+            if parent is not None:
+                parent.remove(element)
+            if self._still_wanted(element):
+                element.tail = None
+                document.append(element)
+
+# 解析后端，默认按顺序选择第一个可用的
+PARSERS = {
+    'lxml': LxmlPageParser,
+    'stream': StreamingPageParser,
+    'html.parser': ShopBackPageParser,
+}
+PARSER_BACKENDS = ('lxml', 'stream', 'html.parser')
+
+def available_backends() -> List[str]:
+    """当前环境可用的解析后端"""
+    return [backend for backend in PARSER_BACKENDS if backend == 'html.parser' or lxml is not None]
+
+def create_page_parser(backend: Optional[str] = None, logger: Optional[logging.Logger] = None,
+                       use_page_data: bool = True) -> ShopBackPageParser:
+    """创建页面解析器，指定的后端不可用时回退到第一个可用的后端"""
+    available = available_backends()
+    if backend and backend not in available:
+        (logger or logging.getLogger(__name__)).warning(f"HTML解析后端不可用: {backend}，使用 {available[0]}")
+        backend = None
+    return PARSERS[backend or available[0]](logger, use_page_data)
+
+# 解析进程中按后端缓存的解析器，每个进程只创建一次
+_process_parsers: Dict[str, ShopBackPageParser] = {}
+
+def parse_page_dict(backend: str, content: bytes, url: str, layout: Optional[str] = None) -> Dict:
+    """
+    在解析进程(ProcessPoolExecutor)中执行：参数为原始字节，返回asdict(StoreInfo)
+    参数和返回值都是可以pickle的普通对象
+    """
+    parser = _process_parsers.get(backend)
+    if parser is None:
+        parser = _process_parsers[backend] = create_page_parser(backend)
+    return asdict(parser.parse(content, url, layout))
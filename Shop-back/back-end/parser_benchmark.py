@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+HTML解析后端性能对比
+用仓库中保存的页面 (debug_*.html, agoda_*.html) 比较各解析后端解析DOM的单页耗时，
+并检查解析结果与html.parser一致（加速 = html.parser耗时 / 默认后端耗时），
+"内嵌数据"列为默认解析器的耗时（页面带Next.js数据时不解析DOM），
+最后在独立子进程中测量解析最大页面后文档占用的内存
+
+    python parser_benchmark.py [重复次数]
+"""
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from typing import Tuple
+from multiprocessing import get_context
+
+from page_parser import available_backends, create_page_parser
+
+FIXTURE_PATTERNS = ['debug_*.html', 'agoda_*.html']
+
+def comparable(store_info) -> dict:
+    """去掉每次解析都不同的时间字段"""
+    data = asdict(store_info)
+    data.pop('last_updated')
+    return data
+
+def time_parse(parser, content: bytes, url: str, repeat: int):
+    """返回 (平均每页毫秒数, 解析结果)，先解析一次预热"""
+    store_info = parser.parse(content, url)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        store_info = parser.parse(content, url)
+    return (time.perf_counter() - start) / repeat * 1000, store_info
+
+def current_rss_kb() -> int:
+    """当前进程的常驻内存(KB)，仅Linux"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+def count_elements(document) -> int:
+    """文档中保留的元素数"""
+    if hasattr(document, 'find_all'):
+        return len(document.find_all(True))
+    return sum(1 for element in document.iter() if isinstance(element.tag, str))
+
+def measure_document_memory(backend: str, path: str) -> Tuple[int, int]:
+    """（在子进程中运行）解析页面并持有解析出的文档，返回 (常驻内存增长KB, 元素数)"""
+    import gc
+    
+    parser = create_page_parser(backend, logging.getLogger('parser_benchmark'), use_page_data=False)
+    parser.logger.setLevel(logging.ERROR)
+    parser.parse(b'<html><title>warmup</title></html>', 'https://www.shopback.com.au/warmup')
+    with open(path, 'rb') as f:
+        content = f.read()
+    
+    gc.collect()
+    before = current_rss_kb()
+    document = parser.load_document(content)
+    used = current_rss_kb() - before
+    return used, count_elements(document)
+
+def document_memory(backend: str, path: str) -> Tuple[int, int]:
+    """每次使用新的子进程，避免前一次解析留下的内存影响结果"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(measure_document_memory, backend, path).result()
+
+def main():
+    """命令行入口"""
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    fixtures = sorted(path for pattern in FIXTURE_PATTERNS
+                      for path in glob.glob(os.path.join(base_dir, pattern)))
+    backends = available_backends()
+    
+    # 解析过程中的INFO日志会影响计时
+    logger = logging.getLogger('parser_benchmark')
+    logger.setLevel(logging.ERROR)
+    parsers = {backend: create_page_parser(backend, logger, use_page_data=False) for backend in backends}
+    data_parser = create_page_parser(None, logger)
+    
+    totals = {backend: 0.0 for backend in backends}
+    data_total = 0.0
+    print(f"{'页面':<32}{'大小':>8}" + ''.join(f"{backend:>14}" for backend in backends)
+          + f"{'加速':>8}{'内嵌数据':>10}  结果一致")
+    for path in fixtures:
+        with open(path, 'rb') as f:
+            content = f.read()
+        url = 'https://www.shopback.com.au/' + os.path.basename(path).split('.')[0].split('_', 1)[-1]
+        
+        timings, results = {}, {}
+        for backend, parser in parsers.items():
+            timings[backend], results[backend] = time_parse(parser, content, url, repeat)
+            totals[backend] += timings[backend]
+        
+        data_timing, _ = time_parse(data_parser, content, url, repeat)
+        data_total += data_timing
+        
+        same = all(comparable(result) == comparable(results['html.parser']) for result in results.values())
+        print(f"{os.path.basename(path):<32}{len(content) // 1024:>6}KB"
+              + ''.join(f"{timings[backend]:>12.1f}ms" for backend in backends)
+              + f"{timings['html.parser'] / timings[backends[0]]:>7.1f}x{data_timing:>12.1f}ms"
+              + f"  {'是' if same else '否'}")
+    
+    print(f"{'合计':<32}{'':>8}" + ''.join(f"{totals[backend]:>12.1f}ms" for backend in backends)
+          + f"{totals['html.parser'] / totals[backends[0]]:>7.1f}x{data_total:>12.1f}ms")
+    
+    largest = max(fixtures, key=os.path.getsize)
+    print(f"\n解析 {os.path.basename(largest)} 后文档占用的内存:")
+    for backend in backends:
+        used_kb, elements = document_memory(backend, largest)
+        print(f"  {backend:<12}{used_kb / 1024:>8.1f}MB{elements:>8} 个元素")
+
+if __name__ == "__main__":
+    main()
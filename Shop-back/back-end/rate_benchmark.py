@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+比例文本解析性能对比
+比较原来两个抓取器中的 extract_numeric_rate（逐个 re.search 原始模式字符串）
+与 rate_parser（组合正则 + LRU缓存），并列出结果不同的文本
+
+    python rate_benchmark.py [重复次数]
+"""
+import re
+import sys
+import time
+
+import rate_parser
+
+# 抓取一个页面时遇到的比例文本：主要比例、各分类比例、之前的优惠，大部分在各页面间重复
+SAMPLE_TEXTS = [
+    "Up to 4% Cashback", "Up to 5.5% Cashback", "Up to 7% Cashback", "10% Cashback",
+    "5.5%", "4%", "3%", "2.5%", "1%", "0.9%", "0.5%", "0.2%", "0%",
+    "$10 Cashback", "Up to $25 Cashback", "$5",
+    "Was 2.5%", "2% - 5%", "2-5% Cashback", "4 %", "Earn 2025-07-16", "",
+]
+
+def legacy_numeric_rate(rate_text: str) -> float:
+    """原 ShopBackSQLiteScraper.extract_numeric_rate"""
+    if not rate_text:
+        return 0.0
+    
+    patterns = [
+        r'Up to (\d+\.?\d*)%',
+        r'(\d+\.?\d*)%',
+        r'\$(\d+\.?\d*)',
+    ]
+    
+    for pattern in patterns:
+        match = re.search(pattern, rate_text)
+        if match:
+            return float(match.group(1))
+    
+    return 0.0
+
+def legacy_fixed_numeric_rate(rate_text: str) -> float:
+    """原 FixedShopBackScraper.extract_numeric_rate"""
+    if not rate_text:
+        return 0.0
+    
+    rate_text = rate_text.strip()
+    patterns = [
+        r'Up to (\d+\.?\d*)%',
+        r'(\d+\.?\d*)%\s*Cashback',
+        r'(\d+\.?\d*)%',
+        r'\$(\d+\.?\d*)',
+        r'(\d+\.?\d*)\s*%',
+    ]
+    
+    for pattern in patterns:
+        match = re.search(pattern, rate_text, re.IGNORECASE)
+        if match:
+            try:
+                return float(match.group(1))
+            except ValueError:
+                continue
+    
+    return 0.0
+
+def uncached_numeric_rate(rate_text: str) -> float:
+    """组合正则，不使用缓存"""
+    if not rate_text:
+        return 0.0
+    rate = rate_parser.parse_rate.__wrapped__(rate_text)
+    return rate.value if rate is not None else 0.0
+
+def time_calls(function, texts, repeat: int) -> float:
+    """返回平均每次调用的微秒数"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            function(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+def main():
+    """命令行入口"""
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    implementations = [
+        ('原实现 (sb_scrap)', legacy_numeric_rate),
+        ('原实现 (fixed)', legacy_fixed_numeric_rate),
+        ('组合正则', uncached_numeric_rate),
+        ('组合正则+缓存', rate_parser.numeric_rate),
+    ]
+    
+    baseline = None
+    print(f"{'实现':<20}{'每次调用':>12}{'加速':>8}")
+    for name, function in implementations:
+        micros = time_calls(function, SAMPLE_TEXTS, repeat)
+        baseline = baseline or micros
+        print(f"{name:<20}{micros:>10.2f}us{baseline / micros:>7.1f}x")
+    
+    print("\n与原实现结果不同的文本:")
+    for text in SAMPLE_TEXTS:
+        old, new = legacy_numeric_rate(text), rate_parser.numeric_rate(text)
+        if old != new:
+            print(f"  {text!r}: {old} -> {new} ({rate_parser.parse_rate(text)})")
+
+if __name__ == "__main__":
+    main()
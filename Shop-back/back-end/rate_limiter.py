@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+ShopBack 请求限速和重试
+挂载在抓取器的requests会话上（ThrottledAdapter），所有抓取线程和任务共用同一个限速器，
+每个host的总速率不超过它的上限；批量抓取任务用 limited_by() 在此之外加上任务自己的速率上限（RateCap）:
+  - 每个host一个令牌桶：桶中有令牌时请求立即发出，只在超过速率时等待
+  - 429/503返回Retry-After时暂停该host（所有线程），并把该host的速率减半，
+    之后每次成功请求逐步恢复到配置的速率
+  - 429/5xx和连接错误按指数退避（带随机抖动）重试
+  - 全局重试预算：每个请求存入一部分重试额度，预算用完后不再重试，
+    服务器持续出错时不会因为重试成倍增加请求量
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 需要重试的状态码
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# 服务器要求暂停的状态码（带Retry-After时整个host暂停）
+THROTTLE_STATUSES = frozenset({429, 503})
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """第attempt次重试(从0开始)的等待时间: [0, min(cap, base * 2^attempt)] 内随机（full jitter）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+@dataclass
+class HostState:
+    """单个host的令牌桶（GCRA形式：只保存下一个请求的理论到达时间）和统计"""
+    rate: float
+    theoretical_arrival: float = 0.0
+    requests: int = 0
+    throttled: int = 0
+    retries: int = 0
+    waited_seconds: float = 0.0
+
+class RetryBudget:
+    """全局重试预算：每个请求存入ratio次重试额度，最多累积capacity次"""
+    
+    def __init__(self, ratio: float = 0.2, capacity: float = 20.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.balance = capacity
+        self.exhausted = 0
+    
+    def deposit(self):
+        self.balance = min(self.capacity, self.balance + self.ratio)
+    
+    def withdraw(self) -> bool:
+        """预算足够时扣除一次重试并返回True"""
+        if self.balance >= 1.0:
+            self.balance -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+class HostRateLimiter:
+    """
+    按host的令牌桶限速器（线程安全）
+    requests_per_second: 每个host的最大速率，<=0 表示不限速
+    burst: 桶容量，空闲后可以不等待连续发出的请求数，默认为1秒的请求数
+    """
+    
+    def __init__(self, requests_per_second: float = 5.0, burst: Optional[int] = None,
+                 max_retries: int = 3, retry_budget: Optional[RetryBudget] = None,
+                 min_rate: float = 0.2):
+        self.lock = threading.Lock()
+        self.hosts: Dict[str, HostState] = {}
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget or RetryBudget()
+        self.min_rate = min_rate
+        self.max_rate = 0.0
+        self.set_rate(requests_per_second, burst)
+    
+    def set_rate(self, requests_per_second: float, burst: Optional[int] = None):
+        """修改最大速率：未被降速的host直接使用新速率，被降速的host不超过新速率"""
+        with self.lock:
+            previous_max = self.max_rate
+            self.max_rate = max(0.0, requests_per_second)
+            self.burst = max(1, burst if burst is not None else int(self.max_rate))
+            for state in self.hosts.values():
+                if state.rate >= previous_max or self.max_rate <= 0:
+                    state.rate = self.max_rate
+                else:
+                    state.rate = min(state.rate, self.max_rate)
+    
+    def _host(self, host: str) -> HostState:
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(rate=self.max_rate)
+        return state
+    
+    def reserve(self, host: str, retry: bool = False) -> float:
+        """预约该host的一个令牌，返回需要等待的秒数（不等待）；重试的请求不存入重试预算"""
+        with self.lock:
+            state = self._host(host)
+            state.requests += 1
+            if not retry:
+                self.retry_budget.deposit()
+            
+            now = time.monotonic()
+            if state.rate <= 0:
+                # 不限速时只遵守服务器要求的暂停
+                delay = max(0.0, state.theoretical_arrival - now)
+                state.waited_seconds += delay
+                return delay
+            
+            interval = 1.0 / state.rate
+            # 理论到达时间最多提前 (burst-1) 个间隔，即桶中最多有burst个令牌
+            slot = max(now, state.theoretical_arrival - (self.burst - 1) * interval)
+            state.theoretical_arrival = max(state.theoretical_arrival, now) + interval
+            delay = slot - now
+            state.waited_seconds += delay
+            return delay
+    
+    def acquire(self, host: str, retry: bool = False):
+        """取得该host的令牌，必要时阻塞等待"""
+        delay = self.reserve(host, retry)
+        if delay > 0:
+            time.sleep(delay)
+    
+    def throttle(self, host: str, pause: float):
+        """服务器要求暂停：pause秒内不再向该host发请求，令牌清空并且速率减半"""
+        with self.lock:
+            state = self._host(host)
+            state.throttled += 1
+            if state.rate > 0:
+                state.rate = max(min(self.min_rate, state.rate), state.rate / 2)
+            interval = 1.0 / state.rate if state.rate > 0 else 0.0
+            resume_at = time.monotonic() + pause
+            # 恢复后按新的间隔逐个发送，不会一次发出整桶请求
+            state.theoretical_arrival = max(state.theoretical_arrival,
+                                            resume_at + (self.burst - 1) * interval)
+    
+    def record_success(self, host: str):
+        """请求成功：被降低的速率每次增加最大速率的1/20，直到恢复"""
+        with self.lock:
+            state = self._host(host)
+            if 0 < state.rate < self.max_rate:
+                state.rate = min(self.max_rate, state.rate + self.max_rate / 20)
+    
+    def retry_delay(self, host: str, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        第attempt次重试前的等待秒数，超过重试次数或重试预算用完时返回None
+        有Retry-After时至少等待该时间
+        """
+        if attempt >= self.max_retries:
+            return None
+        with self.lock:
+            if not self.retry_budget.withdraw():
+                return None
+            self._host(host).retries += 1
+        delay = backoff_delay(attempt)
+        return max(delay, retry_after) if retry_after is not None else delay
+    
+    def stats(self) -> Dict:
+        """各host的当前速率、请求数、被限速次数、重试次数和累计等待时间"""
+        with self.lock:
+            return {
+                "max_rate": self.max_rate,
+                "burst": self.burst,
+                "retry_budget": round(self.retry_budget.balance, 1),
+                "retry_budget_exhausted": self.retry_budget.exhausted,
+                "hosts": {
+                    host: {
+                        "rate": round(state.rate, 2),
+                        "requests": state.requests,
+                        "throttled": state.throttled,
+                        "retries": state.retries,
+                        "waited_seconds": round(state.waited_seconds, 3),
+                    }
+                    for host, state in self.hosts.items()
+                },
+            }
+
+class RateCap:
+    """
+    单个抓取任务的每host速率上限（线程安全），在共用的HostRateLimiter之外额外限制，
+    同一任务的多个批次共用一个；不处理重试和暂停，这些由共用的限速器负责
+    """
+    
+    def __init__(self, requests_per_second: float):
+        self.lock = threading.Lock()
+        self.requests_per_second = requests_per_second
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.next_slot: Dict[str, float] = {}
+    
+    def acquire(self, host: str):
+        """等到该任务对host的下一个发送时间"""
+        if self.interval <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, 0.0))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# 当前线程发出的请求所属任务的速率上限
+_current = threading.local()
+
+@contextmanager
+def limited_by(cap: RateCap):
+    """在with块中，当前线程通过ThrottledAdapter发出的请求还要遵守cap的速率上限"""
+    previous = getattr(_current, 'cap', None)
+    _current.cap = cap
+    try:
+        yield cap
+    finally:
+        _current.cap = previous
+
+class ThrottledAdapter(HTTPAdapter):
+    """发送前按host取令牌（先按任务的速率上限，再按共用的限速器），429/5xx和连接错误按退避策略重试"""
+    
+    def __init__(self, limiter: HostRateLimiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+    
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        limiter = self.limiter
+        cap = getattr(_current, 'cap', None)
+        attempt = 0
+        while True:
+            if cap is not None:
+                cap.acquire(host)
+            limiter.acquire(host, retry=attempt > 0)
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                delay = limiter.retry_delay(host, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            
+            if response.status_code not in RETRY_STATUSES:
+                limiter.record_success(host)
+                return response
+            
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            delay = limiter.retry_delay(host, attempt, retry_after)
+            if response.status_code in THROTTLE_STATUSES:
+                # 所有任务对该host的请求一起暂停
+                limiter.throttle(host, delay if delay is not None else (retry_after or 0.0))
+            if delay is None:
+                return response
+            
+            response.close()
+            if response.status_code not in THROTTLE_STATUSES:
+                time.sleep(delay)
+            attempt += 1
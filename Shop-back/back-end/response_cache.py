@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+ShopBack API响应缓存
+只读接口的返回值按 (接口, 查询参数) 缓存在进程内存中，条目数有上限（LRU淘汰）并有过期时间。
+数据只在抓取结果提交或删除商家时变化：写入提交后调用 bump_generation()，
+之前缓存的条目全部失效（条目记录计算时的代数，代数不同即视为未命中）。
+其他进程（命令行工具）的写入不会增加代数，只能等待条目过期
+
+HTTP ETag也由代数生成：客户端带If-None-Match且代数未变时直接返回304，不执行查询
+"""
+import functools
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+class ResponseCache:
+    """按代数失效的TTL + LRU缓存（线程安全）"""
+    
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        # key -> (代数, 过期时间, 值)，按最近使用排序
+        self.entries: "OrderedDict[Hashable, Tuple[int, float, Any]]" = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def bump_generation(self):
+        """数据已变化：之前缓存的条目全部失效"""
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.entries.clear()
+    
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """返回 (是否命中, 值)，过期或代数不同的条目被删除"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                generation, expires_at, value = entry
+                if generation == self.generation and expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+    
+    def put(self, key: Hashable, value: Any, generation: int):
+        """
+        保存计算结果；generation为开始计算前读取的代数，
+        计算期间有写入提交时结果可能已过时，不再缓存
+        """
+        with self.lock:
+            if generation != self.generation or self.max_entries <= 0:
+                return
+            self.entries[key] = (generation, time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self) -> Dict:
+        """命中率、条目数和失效次数"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+# 同一进程内的API和抓取器共用一个缓存
+_cache = ResponseCache()
+
+# 进程标识：进程重启后代数从0开始，ETag中加入该标识避免与重启前的ETag相同
+BOOT_ID = secrets.token_hex(4)
+
+def get_response_cache() -> ResponseCache:
+    """获取进程内共享的响应缓存"""
+    return _cache
+
+def bump_generation():
+    """写入提交后调用，使缓存的响应失效"""
+    _cache.bump_generation()
+
+def cached_response(endpoint: Callable) -> Callable:
+    """
+    缓存async接口的返回值，键为接口名 + 查询参数
+    （functools.wraps保留原函数签名，FastAPI照常解析参数）
+    接口通过response参数设置的响应头（如分页游标）与返回值一起缓存
+    """
+    @functools.wraps(endpoint)
+    async def wrapper(**kwargs):
+        response = kwargs.get('response')
+        key = (endpoint.__name__,
+               tuple(sorted((name, value) for name, value in kwargs.items() if name != 'response')))
+        hit, cached = _cache.get(key)
+        if hit:
+            value, headers = cached
+            if response is not None:
+                response.headers.update(headers)
+            return value
+        generation = _cache.generation
+        value = await endpoint(**kwargs)
+        headers = dict(response.headers) if response is not None else {}
+        _cache.put(key, (value, headers), generation)
+        return value
+    return wrapper
+
+def generation_etag() -> str:
+    """
+    由数据代数生成的弱ETag，同时按缓存TTL分段，
+    其他进程的写入和与当前时间相关的数据（最近24小时等）最多在TTL后更新
+    """
+    epoch = int(time.time() // _cache.ttl_seconds) if _cache.ttl_seconds > 0 else 0
+    return f'W/"{BOOT_ID}-{_cache.generation}-{epoch}"'
+
+def body_etag(body: bytes) -> str:
+    """由响应内容生成的强ETag"""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match是否匹配（弱比较：忽略W/前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    target = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
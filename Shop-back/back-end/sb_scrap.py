@@ -4,50 +4,133 @@ ShopBack 专用抓取器 - SQLite版本
 针对ShopBack的现代网页结构进行优化，使用SQLite数据库存储
 """
 import sqlite3
+import threading
 import requests
-from bs4 import BeautifulSoup
 import json
 import time
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, AsyncIterator, Iterable
 import re
 from dataclasses import dataclass, asdict
 import os
+import hashlib
 from pathlib import Path
+from fetch_engine import ScrapePipeline
+from http_cache import HTTPCache, ConditionalGetAdapter
+from rate_limiter import HostRateLimiter, ThrottledAdapter
+import history_store
+import latest_snapshot
+import response_cache
+import schema_migrations
+import store_search
+from db_pool import get_pool, close_pool
+from models import CashbackRate, StoreInfo, store_info_from_dict
+from page_parser import create_page_parser
 
-@dataclass
-class CashbackRate:
-    """Cashback比例数据结构"""
-    category: str
-    rate: str
-    rate_numeric: float
+class ScraperAdapter(ConditionalGetAdapter, ThrottledAdapter):
+    """条件请求缓存 + 按host限速和重试（条件请求头只附加一次，重试时沿用）"""
 
-@dataclass
-class StoreInfo:
-    """商家信息数据结构"""
-    name: str
-    main_cashback: str
-    main_rate_numeric: float
-    detailed_rates: List[CashbackRate]
-    is_upsized: bool
-    previous_offer: Optional[str]
-    url: str
-    last_updated: str
-    scraping_success: bool
-    error_message: Optional[str] = None
+def store_info_fingerprint(store_info: StoreInfo) -> str:
+    """计算cashback数据的指纹，数据不变时指纹不变（不含抓取时间）"""
+    payload = [
+        store_info.main_cashback,
+        store_info.is_upsized,
+        store_info.previous_offer,
+        store_info.scraping_success,
+        store_info.error_message,
+        [(rate.category, rate.rate) for rate in store_info.detailed_rates],
+    ]
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# 按名称和URL查找商家
+STORE_ID_SQL = 'SELECT id FROM stores WHERE name = ? AND url = ?'
+
+HISTORY_INSERT_SQL = '''
+    INSERT INTO cashback_history 
+    (store_id, main_cashback, main_rate_numeric, category, category_rate, 
+    category_rate_numeric, is_upsized, previous_offer, scraping_success, error_message)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def history_rows(store_id: int, store_info: StoreInfo) -> List[Tuple]:
+    """一次抓取对应的cashback_history行：Main一行，每个分类一行"""
+    rows = [(store_id, store_info.main_cashback, store_info.main_rate_numeric,
+             'Main', store_info.main_cashback, store_info.main_rate_numeric,
+             store_info.is_upsized, store_info.previous_offer,
+             store_info.scraping_success, store_info.error_message)]
+    for rate in store_info.detailed_rates:
+        rows.append((store_id, store_info.main_cashback, store_info.main_rate_numeric,
+                     rate.category, rate.rate, rate.rate_numeric,
+                     store_info.is_upsized, store_info.previous_offer,
+                     store_info.scraping_success, store_info.error_message))
+    return rows
+
+def rate_stats_upsert_sql(row_count: int = 1) -> str:
+    """
+    rate_statistics的UPSERT语句，一条语句可写入多行
+    最高/最低比例及其日期在SQL中计算（DO UPDATE SET中的列引用均为更新前的值）
+    """
+    values = ', '.join(['(?, ?, ?, ?, ?, ?, ?)'] * row_count)
+    return f'''
+        INSERT INTO rate_statistics 
+        (store_id, category, current_rate, highest_rate, lowest_rate, highest_date, lowest_date)
+        VALUES {values}
+        ON CONFLICT(store_id, category) DO UPDATE SET
+            current_rate = excluded.current_rate,
+            highest_rate = MAX(highest_rate, excluded.current_rate),
+            lowest_rate = MIN(lowest_rate, excluded.current_rate),
+            highest_date = CASE WHEN excluded.current_rate > highest_rate
+                                THEN excluded.highest_date ELSE highest_date END,
+            lowest_date = CASE WHEN excluded.current_rate < lowest_rate
+                               THEN excluded.lowest_date ELSE lowest_date END,
+            updated_at = CURRENT_TIMESTAMP
+    '''
+
+def rate_statistics_rows(store_id: int, store_info: StoreInfo, current_time: str) -> List[Tuple]:
+    """一次抓取对应的rate_statistics参数行：Main一行，每个分类一行"""
+    rates = [('Main', store_info.main_rate_numeric)]
+    rates += [(rate.category, rate.rate_numeric) for rate in store_info.detailed_rates]
+    return [(store_id, category, rate, rate, rate, current_time, current_time)
+            for category, rate in rates]
 
 class ShopBackSQLiteScraper:
     """ShopBack专用抓取器 - SQLite版本"""
     
-    def __init__(self, db_path: str = "shopback_data.db"):
+    def __init__(self, db_path: str = "shopback_data.db", pool_maxsize: int = 32,
+                 history_mode: Optional[str] = None, parser_backend: Optional[str] = None,
+                 requests_per_second: float = 5.0):
+        """
+        pool_maxsize: 会话连接池大小，应不小于同时进行的请求数（所有同时运行的批量任务的并发数之和）
+        requests_per_second: 所有抓取（包括同时运行的多个批量任务）共用的每个host速率上限
+        """
         self.session = requests.Session()
-        self.setup_session()
         self.setup_logging()
+        # 页面解析器：默认优先使用lxml，未安装时使用html.parser
+        self.page_parser = create_page_parser(parser_backend, self.logger)
+        self.parser_backend = self.page_parser.backend
         self.db_path = db_path
         self.init_database()
+        # 历史存储模式：未指定时每次写入前读取数据库中保存的设置 (rows / intervals)，
+        # 运行中的服务在history_store.py migrate之后不需要重启即可写入区间表
+        self.history_mode_override = history_mode
+        self.http_cache = HTTPCache(self.pool)
+        # 每个商家页面上次匹配的页面结构 (url -> layout)，解析时先尝试该结构；
+        # 由页面缓存中保存的上次解析结果恢复，重启后无需重新摸索
+        self.page_layouts: Dict[str, str] = self.http_cache.load_layouts()
+        # 所有请求共用的按host限速器和重试预算；批量任务的速率是在此之外的上限（rate_limiter.RateCap）
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.setup_session(pool_maxsize)
     
-    def setup_session(self):
+    @property
+    def history_mode(self) -> str:
+        """当前的历史存储模式"""
+        if self.history_mode_override:
+            return self.history_mode_override
+        with self.db_lock:
+            return history_store.get_history_mode(self.conn)
+    
+    def setup_session(self, pool_maxsize: int = 32):
         """配置请求会话"""
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -57,6 +140,18 @@ class ShopBackSQLiteScraper:
             'Connection': 'keep-alive',
         }
         self.session.headers.update(headers)
+        self.mount_connection_pool(pool_maxsize)
+    
+    def mount_connection_pool(self, pool_maxsize: int):
+        """
+        挂载带条件请求缓存和限速的HTTP连接池，池大小不小于并发数才能复用keep-alive连接
+        只在创建会话时调用：会话由所有抓取线程共用，运行中重新挂载会替换其他线程正在使用的适配器
+        """
+        adapter = ScraperAdapter(self.http_cache, limiter=self.rate_limiter,
+                                 pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool_maxsize = pool_maxsize
         
     def setup_logging(self):
         """设置日志"""
@@ -73,8 +168,10 @@ class ShopBackSQLiteScraper:
     def init_database(self):
         """初始化SQLite数据库和表结构"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row  # 使结果可以像字典一样访问
+            # 使用连接池的写连接(WAL模式)，同一进程内的写操作由写锁串行化
+            self.pool = get_pool(self.db_path)
+            self.conn = self.pool.writer_conn
+            self.db_lock = self.pool.write_lock
             
             cursor = self.conn.cursor()
             
@@ -127,233 +224,52 @@ class ShopBackSQLiteScraper:
                 )
             ''')
             
+            # 创建数据指纹表，数据未变化时只更新last_seen_at
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS store_fingerprints (
+                    store_id INTEGER PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    first_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    seen_count INTEGER DEFAULT 1,
+                    FOREIGN KEY (store_id) REFERENCES stores (id)
+                )
+            ''')
+            
+            # 创建区间存储表 (intervals模式)
+            history_store.init_history_tables(cursor)
+            
+            # 创建最新数据快照表，由触发器维护
+            latest_snapshot.init_latest_tables(cursor)
+            latest_snapshot.ensure_store_latest(cursor, history_store.get_history_mode(self.conn))
+            
             # 创建索引提高查询性能
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_stores_name ON stores (name)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_stores_url ON stores (url)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_cashback_store_id ON cashback_history (store_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_cashback_scraped_at ON cashback_history (scraped_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_stats_store_category ON rate_statistics (store_id, category)')
             
             self.conn.commit()
-            self.logger.info(f"SQLite数据库初始化成功: {self.db_path}")
             
+            # 按版本执行索引等数据库迁移
+            schema_migrations.apply_migrations(self.conn)
+            self.logger.info(f"SQLite数据库初始化成功 (WAL): {self.db_path}")
+        
         except Exception as e:
             self.logger.error(f"数据库初始化失败: {e}")
             raise
     
-    def extract_numeric_rate(self, rate_text: str) -> float:
-        """从文本中提取数字比例"""
-        if not rate_text:
-            return 0.0
-            
-        # 匹配各种比例格式
-        patterns = [
-            r'Up to (\d+\.?\d*)%',  # Up to 4%
-            r'(\d+\.?\d*)%',        # 4%
-            r'\$(\d+\.?\d*)',       # $10
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, rate_text)
-            if match:
-                return float(match.group(1))
-        
-        return 0.0
-    
-    def extract_store_name(self, soup: BeautifulSoup, url: str) -> str:
-        """提取商家名称"""
-        # 尝试从页面标题提取
-        title_element = soup.find('title')
-        if title_element:
-            title_text = title_element.get_text().strip()
-            if '|' in title_text:
-                store_name = title_text.split('|')[0].strip()
-                # 清理商家名称
-                store_name = re.sub(r'\s*(Cashback|Discount|Codes|Vouchers|Deals)\s*', '', store_name, flags=re.IGNORECASE)
-                if store_name:
-                    return store_name
-        
-        # 从URL提取
-        url_parts = url.rstrip('/').split('/')
-        if url_parts:
-            store_slug = url_parts[-1]
-            store_name = ' '.join(word.capitalize() for word in store_slug.split('-'))
-            return store_name
-        
-        return "Unknown Store"
-    
-    def extract_main_cashback_info(self, soup: BeautifulSoup) -> Tuple[str, bool, Optional[str]]:
+    def save_to_database(self, store_info: StoreInfo, raise_errors: bool = False) -> bool:
         """
-        提取主要cashback信息
-        支持两种HTML结构:
-        1. data-testid="all-cashback-rates" (复杂结构)
-        2. data-testid="cashback-rates" (简单结构)
+        保存数据到SQLite数据库，返回数据是否有变化
+        raise_errors: 保存失败时抛出异常（默认记录日志并返回False）
         """
-        main_cashback = "0%"
-        is_upsized = False
-        previous_offer = None
-        
-        try:
-            # 方法1: 查找data-testid="current-offer"的元素 (新结构)
-            current_offer_element = soup.find(attrs={'data-testid': 'current-offer'})
-            if current_offer_element:
-                main_cashback = current_offer_element.get_text().strip()
-                self.logger.info(f"从current-offer找到主要cashback: {main_cashback}")
-            else:
-                # 方法2: 查找包含"Up to"和"Cashback"的h5元素 (旧结构)
-                main_rate_element = soup.find('h5', string=re.compile(r'Up to.*%.*Cashback', re.IGNORECASE))
-                if not main_rate_element:
-                    # 备选：寻找包含百分号的h5元素
-                    main_rate_element = soup.find('h5', string=re.compile(r'\d+\.?\d*%'))
-                
-                if main_rate_element:
-                    main_cashback = main_rate_element.get_text().strip()
-                    self.logger.info(f"从h5元素找到主要cashback: {main_cashback}")
-            
-            # 检查是否有upsized标签
-            # 寻找包含"Upsized"文本的p元素
-            upsized_element = soup.find('p', string=re.compile(r'Upsized', re.IGNORECASE))
-            is_upsized = upsized_element is not None
-            if is_upsized:
-                self.logger.info("检测到Upsized标签")
-            
-            # 查找previous offer (有删除线的价格)
-            # 方法1: 查找data-testid="worse-offer"的元素 (新结构)
-            worse_offer_element = soup.find(attrs={'data-testid': 'worse-offer'})
-            if worse_offer_element:
-                previous_text = worse_offer_element.get_text().strip()
-                if previous_text:  # 确保不是空文本
-                    previous_offer = previous_text
-                    self.logger.info(f"从worse-offer找到之前的优惠: {previous_offer}")
-            else:
-                # 方法2: 寻找有text-decor_line-through类的h5元素 (旧结构)
-                previous_element = soup.find('h5', class_=lambda x: x and 'text-decor_line-through' in x)
-                if previous_element:
-                    previous_offer = previous_element.get_text().strip()
-                    self.logger.info(f"从line-through元素找到之前的优惠: {previous_offer}")
-            
-        except Exception as e:
-            self.logger.warning(f"提取主要cashback信息时出错: {e}")
-        
-        return main_cashback, is_upsized, previous_offer
-    
-    def extract_detailed_rates(self, soup: BeautifulSoup) -> List[CashbackRate]:
-        """
-        提取详细的cashback比例
-        支持两种HTML结构:
-        1. data-testid="all-cashback-rates" (复杂结构)
-        2. data-testid="cashback-rates" (简单结构)
-        """
-        detailed_rates = []
-        
-        try:
-            # 方法1: 尝试新的简单结构 (data-testid="cashback-rates")
-            rates_container = soup.find('div', {'data-testid': 'cashback-rates'})
-            if rates_container:
-                self.logger.info("找到cashback-rates容器 (简单结构)")
-                
-                # 查找cashback-tier-block容器
-                tier_block = rates_container.find('div', {'data-testid': 'cashback-tier-block'})
-                if tier_block:
-                    # 查找所有的rate行 (flex_row类的div)
-                    rate_rows = tier_block.find_all('div', class_=lambda x: x and 'flex_row' in x and 'justify_space-between' in x)
-                    
-                    self.logger.info(f"在简单结构中找到 {len(rate_rows)} 个rate行")
-                    
-                    for i, row in enumerate(rate_rows):
-                        try:
-                            # 在每行中查找两个p元素：分类名称和比例
-                            p_elements = row.find_all('p')
-                            if len(p_elements) >= 2:
-                                category = p_elements[0].get_text().strip()
-                                rate = p_elements[1].get_text().strip()
-                                
-                                # 验证rate格式
-                                if '%' in rate and category:
-                                    # 限制分类名称长度
-                                    if len(category) > 100:
-                                        category = category[:100] + "..."
-                                    
-                                    rate_obj = CashbackRate(
-                                        category=category,
-                                        rate=rate,
-                                        rate_numeric=self.extract_numeric_rate(rate)
-                                    )
-                                    detailed_rates.append(rate_obj)
-                                    
-                                    self.logger.info(f"简单结构提取到rate {i+1}: {category} -> {rate}")
-                        
-                        except Exception as e:
-                            self.logger.warning(f"处理简单结构rate行 {i+1} 时出错: {e}")
-                            continue
-                
-                # 如果简单结构成功提取到数据，直接返回
-                if detailed_rates:
-                    return detailed_rates
-            
-            # 方法2: 尝试复杂结构 (data-testid="all-cashback-rates")
-            rates_container = soup.find('div', {'data-testid': 'all-cashback-rates'})
-            if rates_container:
-                self.logger.info("找到all-cashback-rates容器 (复杂结构)")
-                
-                # 查找所有rate行 (有bg_sbds-background-color-secondary类的div)
-                rate_rows = rates_container.find_all('div', class_=lambda x: x and 'bg_sbds-background-color-secondary' in x)
-                
-                self.logger.info(f"在复杂结构中找到 {len(rate_rows)} 个rate行")
-                
-                for i, row in enumerate(rate_rows):
-                    try:
-                        # 查找分类名称
-                        category_container = row.find('div', class_=lambda x: x and 'flex_1' in x)
-                        if not category_container:
-                            continue
-                        
-                        category_element = category_container.find('p')
-                        if not category_element:
-                            continue
-                        
-                        category = category_element.get_text().strip()
-                        
-                        # 查找当前cashback率 (寻找font_bold的p元素)
-                        rate_elements = row.find_all('p', class_=lambda x: x and 'font_bold' in x)
-                        
-                        current_rate = None
-                        for rate_elem in rate_elements:
-                            rate_text = rate_elem.get_text().strip()
-                            # 检查是否包含百分号 (当前率)
-                            if '%' in rate_text and not any(keyword in rate_text.lower() for keyword in ['upsized', 'ends']):
-                                current_rate = rate_text
-                                break
-                        
-                        if category and current_rate:
-                            # 限制分类名称长度，避免过长的描述
-                            if len(category) > 100:
-                                category = category[:100] + "..."
-                            
-                            rate_obj = CashbackRate(
-                                category=category,
-                                rate=current_rate,
-                                rate_numeric=self.extract_numeric_rate(current_rate)
-                            )
-                            detailed_rates.append(rate_obj)
-                            
-                            self.logger.info(f"复杂结构提取到rate {i+1}: {category} -> {current_rate}")
-                        
-                    except Exception as e:
-                        self.logger.warning(f"处理复杂结构rate行 {i+1} 时出错: {e}")
-                        continue
-            
-            # 如果两种方法都没有找到容器
-            if not detailed_rates:
-                self.logger.warning("未找到任何cashback-rates容器")
-        
-        except Exception as e:
-            self.logger.error(f"提取详细rates时出错: {e}")
-        
-        return detailed_rates
+        with self.db_lock:
+            changed = self._save_to_database(store_info, raise_errors)
+        # 数据未变化时也更新了stores.updated_at，API缓存同样需要失效
+        response_cache.bump_generation()
+        return changed
     
-    def save_to_database(self, store_info: StoreInfo):
-        """保存数据到SQLite数据库"""
+    def _save_to_database(self, store_info: StoreInfo, raise_errors: bool = False) -> bool:
         try:
             cursor = self.conn.cursor()
             
@@ -369,37 +285,29 @@ class ShopBackSQLiteScraper:
             ''', (store_info.name, store_info.url))
             
             # 获取store_id
-            cursor.execute('''
-                SELECT id FROM stores WHERE name = ? AND url = ?
-            ''', (store_info.name, store_info.url))
+            cursor.execute(STORE_ID_SQL, (store_info.name, store_info.url))
             
             store_id = cursor.fetchone()[0]
             self.logger.info(f"商家ID: {store_id}")
             
-            # 插入主要cashback历史
-            self.logger.info("插入主要cashback记录...")
+            # 数据与上次相同时只更新last_seen_at，不再重复插入历史记录
+            fingerprint = store_info_fingerprint(store_info)
             cursor.execute('''
-                INSERT INTO cashback_history 
-                (store_id, main_cashback, main_rate_numeric, category, category_rate, 
-                category_rate_numeric, is_upsized, previous_offer, scraping_success, error_message)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (store_id, store_info.main_cashback, store_info.main_rate_numeric,
-                'Main', store_info.main_cashback, store_info.main_rate_numeric,
-                store_info.is_upsized, store_info.previous_offer, 
-                store_info.scraping_success, store_info.error_message))
-            
-            # 插入详细分类历史
-            for rate in store_info.detailed_rates:
-                self.logger.info(f"插入分类记录: {rate.category} -> {rate.rate}")
-                cursor.execute('''
-                    INSERT INTO cashback_history 
-                    (store_id, main_cashback, main_rate_numeric, category, category_rate, 
-                    category_rate_numeric, is_upsized, previous_offer, scraping_success, error_message)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (store_id, store_info.main_cashback, store_info.main_rate_numeric,
-                    rate.category, rate.rate, rate.rate_numeric,
-                    store_info.is_upsized, store_info.previous_offer,
-                    store_info.scraping_success, store_info.error_message))
+                SELECT fingerprint FROM store_fingerprints WHERE store_id = ?
+            ''', (store_id,))
+            previous = cursor.fetchone()
+            if previous and previous[0] == fingerprint:
+                self.touch_store(cursor, store_id)
+                self.conn.commit()
+                self.logger.info(f"数据未变化，仅更新last_seen_at: {store_info.name}")
+                return False
+            
+            if self.history_mode == history_store.INTERVALS_MODE:
+                # 区间模式：只在比例变化时开启新区间
+                opened = history_store.record_intervals(cursor, store_id, store_info)
+                self.logger.info(f"更新区间记录: 新开启 {opened} 个区间")
+            else:
+                self.insert_history_rows(cursor, store_id, store_info)
             
             # 更新统计信息
             self.logger.info("更新统计信息...")
@@ -410,9 +318,20 @@ class ShopBackSQLiteScraper:
                 UPDATE stores SET updated_at = CURRENT_TIMESTAMP WHERE id = ?
             ''', (store_id,))
             
+            # 记录新的数据指纹
+            cursor.execute('''
+                INSERT INTO store_fingerprints (store_id, fingerprint) VALUES (?, ?)
+                ON CONFLICT(store_id) DO UPDATE SET
+                    fingerprint = excluded.fingerprint,
+                    first_seen_at = CURRENT_TIMESTAMP,
+                    last_seen_at = CURRENT_TIMESTAMP,
+                    seen_count = 1
+            ''', (store_id, fingerprint))
+            
             self.conn.commit()
             self.logger.info(f"成功保存到数据库: {store_info.name}")
-            
+            return True
+        
         except Exception as e:
             self.conn.rollback()
             self.logger.error(f"数据库保存失败: {e}")
@@ -422,184 +341,232 @@ class ShopBackSQLiteScraper:
             with open(error_filename, 'w', encoding='utf-8') as f:
                 json.dump(asdict(store_info), f, ensure_ascii=False, indent=2, default=str)
             self.logger.error(f"完整错误数据已保存到: {error_filename}")
+            if raise_errors:
+                raise
+            return False
     
-    def update_rate_statistics(self, store_id: int, store_info: StoreInfo):
-        """更新比例统计信息"""
-        cursor = self.conn.cursor()
-        
-        # 更新主要比例统计
-        self.update_category_stats(cursor, store_id, 'Main', store_info.main_rate_numeric)
-        
-        # 更新详细分类统计
+    def insert_history_rows(self, cursor, store_id: int, store_info: StoreInfo):
+        """rows模式：为Main和每个分类各插入一行cashback_history"""
         for rate in store_info.detailed_rates:
-            self.update_category_stats(cursor, store_id, rate.category, rate.rate_numeric)
+            self.logger.info(f"插入分类记录: {rate.category} -> {rate.rate}")
+        cursor.executemany(HISTORY_INSERT_SQL, history_rows(store_id, store_info))
     
-    def update_category_stats(self, cursor, store_id: int, category: str, current_rate: float):
-        """更新单个分类的统计信息"""
-        # 获取当前统计
+    def touch_store(self, cursor, store_id: int):
+        """数据未变化时只记录本次观测"""
         cursor.execute('''
-            SELECT highest_rate, lowest_rate, highest_date, lowest_date
-            FROM rate_statistics 
-            WHERE store_id = ? AND category = ?
-        ''', (store_id, category))
-        
-        result = cursor.fetchone()
-        current_time = datetime.now().isoformat()
+            UPDATE store_fingerprints
+            SET last_seen_at = CURRENT_TIMESTAMP, seen_count = seen_count + 1
+            WHERE store_id = ?
+        ''', (store_id,))
+        cursor.execute('''
+            UPDATE stores SET updated_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (store_id,))
+    
+    def mark_store_unchanged(self, store_info: StoreInfo) -> bool:
+        """页面返回304时记录本次观测，返回商家是否存在（只有更新了商家时API缓存才失效）"""
+        with self.db_lock:
+            cursor = self.conn.cursor()
+            cursor.execute(STORE_ID_SQL, (store_info.name, store_info.url))
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            self.touch_store(cursor, row[0])
+            self.conn.commit()
+        response_cache.bump_generation()
+        return True
+    
+    def has_cached_store(self, url: str) -> bool:
+        """该URL有缓存的解析结果，并且对应的商家仍在数据库中"""
+        cached = self.http_cache.load_result(url)
+        if cached is None:
+            return False
+        # 每个304都会检查，使用只读连接，不等待批量写入
+        with self.pool.reader() as conn:
+            row = conn.execute('''
+                SELECT 1 FROM stores WHERE name = ? AND url = ?
+            ''', (cached.get('name'), cached.get('url'))).fetchone()
+        return row is not None
+    
+    def update_rate_statistics(self, store_id: int, store_info: StoreInfo):
+        """用一条UPSERT语句更新该商家所有分类（含Main）的统计信息"""
+        rows = rate_statistics_rows(store_id, store_info, datetime.now().isoformat())
+        self.conn.execute(rate_stats_upsert_sql(len(rows)), [value for row in rows for value in row])
+    
+    def fetch_page(self, url: str) -> Optional[bytes]:
+        """下载商家页面，返回原始字节；页面未变化(304)时返回None"""
+        response = self.session.get(url, timeout=30)
+        response.raise_for_status()
+        if response.status_code == 304:
+            if self.has_cached_store(url):
+                return None
+            # 缓存的解析结果没有对应的商家（例如商家已被删除）：丢弃缓存，完整下载后重新保存
+            self.logger.info(f"页面未变化(304)但商家不存在，重新下载: {url}")
+            self.http_cache.invalidate(url)
+            response = self.session.get(url, timeout=30)
+            response.raise_for_status()
+            if response.status_code == 304:
+                raise ValueError("服务器在没有条件请求头时返回304")
+        self.logger.debug(f"Content-Type: {response.headers.get('Content-Type')}")
+        return response.content
+    
+    def parse_store_page(self, content: bytes, url: str) -> StoreInfo:
+        """解析页面内容，提取商家信息（不访问网络和数据库）"""
+        return self.page_parser.parse(content, url, self.page_layouts.get(url))
+    
+    def failed_store_info(self, url: str, error: Exception) -> StoreInfo:
+        """构造抓取失败时返回的StoreInfo"""
+        return self.page_parser.failed_store_info(url, error)
+    
+    def load_not_modified(self, url: str, writer=None) -> StoreInfo:
+        """
+        页面未变化(304)：沿用缓存的解析结果，跳过解析和写入，只记录一次观测
+        writer: 可选的BatchWriter，提供时观测随下一批数据一起提交
+        """
+        cached = self.http_cache.load_result(url)
+        if cached is None:
+            raise ValueError("服务器返回304但没有缓存的解析结果")
         
-        if result:
-            highest_rate, lowest_rate, highest_date, lowest_date = result
-            new_highest = max(highest_rate, current_rate)
-            new_lowest = min(lowest_rate, current_rate)
-            
-            # 更新日期
-            new_highest_date = current_time if new_highest > highest_rate else highest_date
-            new_lowest_date = current_time if new_lowest < lowest_rate else lowest_date
-            
-            cursor.execute('''
-                UPDATE rate_statistics 
-                SET current_rate = ?, highest_rate = ?, lowest_rate = ?,
-                    highest_date = ?, lowest_date = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE store_id = ? AND category = ?
-            ''', (current_rate, new_highest, new_lowest, new_highest_date, 
-                new_lowest_date, store_id, category))
+        store_info = store_info_from_dict(cached)
+        store_info.last_updated = datetime.now().isoformat()
+        store_info.not_modified = True
+        self.http_cache.record_unchanged(url)
+        if writer is not None:
+            writer.touch(store_info)
         else:
-            # 首次记录
-            cursor.execute('''
-                INSERT INTO rate_statistics 
-                (store_id, category, current_rate, highest_rate, lowest_rate,
-                highest_date, lowest_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (store_id, category, current_rate, current_rate, current_rate,
-                current_time, current_time))
+            self.mark_store_unchanged(store_info)
+        self.logger.info(f"页面未变化(304): {store_info.name}")
+        return store_info
+    
+    def store_result(self, store_info: StoreInfo, writer=None):
+        """
+        保存解析结果到数据库（或BatchWriter），提交后缓存供下次304时使用
+        使用BatchWriter时数据提交后由它缓存；保存失败时抛出异常，不缓存
+        """
+        if store_info.layout:
+            self.page_layouts[store_info.url] = store_info.layout
+        if writer is not None:
+            writer.add(store_info)
+            return
+        self.save_to_database(store_info, raise_errors=True)
+        self.cache_result(store_info)
     
-    def scrape_store_page(self, url: str) -> StoreInfo:
-        """抓取单个商家页面的详细信息"""
+    def cache_result(self, store_info: StoreInfo):
+        """已提交的解析结果存入页面缓存，页面返回304时复用"""
+        self.http_cache.save_result(store_info.url, asdict(store_info))
+    
+    def scrape_store_page(self, url: str, writer=None) -> StoreInfo:
+        """
+        抓取单个商家页面的详细信息
+        writer: 可选的BatchWriter，提供时由它批量写入数据库
+        """
         start_time = time.time()
         
         try:
             self.logger.info(f"正在抓取: {url}")
             
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            print("头段",response.headers.get('Content-Type'))
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # 移除script和style标签，避免抓取到它们的内容
-            for element in soup(["style", "noscript"]):
-                element.decompose()
+            content = self.fetch_page(url)
+            if content is None:
+                return self.load_not_modified(url, writer)
             
-            # 提取商家名称
-            store_name = self.extract_store_name(soup, url)
-            
-            # 提取主要cashback信息
-            main_cashback, is_upsized, previous_offer = self.extract_main_cashback_info(soup)
-            
-            # 提取详细的cashback层级信息
-            detailed_rates = self.extract_detailed_rates(soup)
+            store_info = self.parse_store_page(content, url)
             
             scrape_duration = time.time() - start_time
+            self.logger.info(f"成功抓取 {store_info.name}: {store_info.main_cashback}, {len(store_info.detailed_rates)} 个详细分类 (耗时: {scrape_duration:.2f}秒)")
             
-            store_info = StoreInfo(
-                name=store_name,
-                main_cashback=main_cashback,
-                main_rate_numeric=self.extract_numeric_rate(main_cashback),
-                detailed_rates=detailed_rates,
-                is_upsized=is_upsized,
-                previous_offer=previous_offer,
-                url=url,
-                last_updated=datetime.now().isoformat(),
-                scraping_success=True
-            )
-            
-            self.logger.info(f"成功抓取 {store_name}: {main_cashback}, {len(detailed_rates)} 个详细分类 (耗时: {scrape_duration:.2f}秒)")
-            
-            # 保存到数据库
-            self.save_to_database(store_info)
-            
+            self.store_result(store_info, writer)
             return store_info
             
         except Exception as e:
             error_msg = f"抓取失败 {url}: {str(e)}"
             self.logger.error(error_msg)
             
-            return StoreInfo(
-                name=self.extract_store_name(BeautifulSoup(), url),
-                main_cashback="0%",
-                main_rate_numeric=0.0,
-                detailed_rates=[],
-                is_upsized=False,
-                previous_offer=None,
-                url=url,
-                last_updated=datetime.now().isoformat(),
-                scraping_success=False,
-                error_message=str(e)
-            )
+            return self.failed_store_info(url, e)
+    
+    async def scrape_many(self, urls: Iterable[str], concurrency: int = 16,
+                          requests_per_second: float = 5.0, batch_writes: bool = True,
+                          parse_processes: Optional[int] = None) -> AsyncIterator[StoreInfo]:
+        """
+        并发抓取多个商家页面，按完成顺序逐个返回StoreInfo
+        concurrency: 同时进行的请求数上限
+        requests_per_second: 每个host每秒最多发起的请求数
+        batch_writes: 使用BatchWriter合并写入，避免每个商家一次提交
+        parse_processes: 解析进程数，默认为CPU核数；0表示在线程中解析
+        """
+        pipeline = ScrapePipeline(self, concurrency=concurrency,
+                                  requests_per_second=requests_per_second,
+                                  parse_processes=parse_processes, batch_writes=batch_writes)
+        async for store_info in pipeline.run(urls):
+            yield store_info
     
     def get_store_history(self, store_name: str = None, store_url: str = None, limit: int = 50):
         """查询商家的历史数据"""
-        cursor = self.conn.cursor()
-        
-        if store_name:
-            cursor.execute('''
-                SELECT s.name, s.url, ch.main_cashback, ch.category, ch.category_rate, 
-                       ch.is_upsized, ch.scraped_at
-                FROM cashback_history ch
-                JOIN stores s ON ch.store_id = s.id
-                WHERE s.name LIKE ?
-                ORDER BY ch.scraped_at DESC
-                LIMIT ?
-            ''', (f'%{store_name}%', limit))
-        elif store_url:
-            cursor.execute('''
-                SELECT s.name, s.url, ch.main_cashback, ch.category, ch.category_rate, 
-                       ch.is_upsized, ch.scraped_at
-                FROM cashback_history ch
-                JOIN stores s ON ch.store_id = s.id
-                WHERE s.url = ?
-                ORDER BY ch.scraped_at DESC
-                LIMIT ?
-            ''', (store_url, limit))
-        else:
-            cursor.execute('''
-                SELECT s.name, s.url, ch.main_cashback, ch.category, ch.category_rate, 
-                       ch.is_upsized, ch.scraped_at
-                FROM cashback_history ch
-                JOIN stores s ON ch.store_id = s.id
-                ORDER BY ch.scraped_at DESC
-                LIMIT ?
-            ''', (limit,))
-        
-        return cursor.fetchall()
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            table = history_store.history_table(self.history_mode)
+            
+            if store_name:
+                name_condition, name_params = store_search.name_filter(conn, store_name)
+                cursor.execute(f'''
+                    SELECT s.name, s.url, ch.main_cashback, ch.category, ch.category_rate, 
+                           ch.is_upsized, ch.scraped_at
+                    FROM {table} ch
+                    JOIN stores s ON ch.store_id = s.id
+                    WHERE {name_condition}
+                    ORDER BY ch.scraped_at DESC
+                    LIMIT ?
+                ''', (*name_params, limit))
+            elif store_url:
+                cursor.execute(f'''
+                    SELECT s.name, s.url, ch.main_cashback, ch.category, ch.category_rate, 
+                           ch.is_upsized, ch.scraped_at
+                    FROM {table} ch
+                    JOIN stores s ON ch.store_id = s.id
+                    WHERE s.url = ?
+                    ORDER BY ch.scraped_at DESC
+                    LIMIT ?
+                ''', (store_url, limit))
+            else:
+                cursor.execute(f'''
+                    SELECT s.name, s.url, ch.main_cashback, ch.category, ch.category_rate, 
+                           ch.is_upsized, ch.scraped_at
+                    FROM {table} ch
+                    JOIN stores s ON ch.store_id = s.id
+                    ORDER BY ch.scraped_at DESC
+                    LIMIT ?
+                ''', (limit,))
+            
+            return cursor.fetchall()
     
     def get_rate_statistics(self, store_name: str = None):
         """查询比例统计信息"""
-        cursor = self.conn.cursor()
-        
-        if store_name:
-            cursor.execute('''
-                SELECT s.name, rs.category, rs.current_rate, rs.highest_rate, rs.lowest_rate,
-                       rs.highest_date, rs.lowest_date
-                FROM rate_statistics rs
-                JOIN stores s ON rs.store_id = s.id
-                WHERE s.name LIKE ?
-                ORDER BY s.name, rs.category
-            ''', (f'%{store_name}%',))
-        else:
-            cursor.execute('''
-                SELECT s.name, rs.category, rs.current_rate, rs.highest_rate, rs.lowest_rate,
-                       rs.highest_date, rs.lowest_date
-                FROM rate_statistics rs
-                JOIN stores s ON rs.store_id = s.id
-                ORDER BY s.name, rs.category
-            ''')
-        
-        return cursor.fetchall()
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            
+            if store_name:
+                name_condition, name_params = store_search.name_filter(conn, store_name)
+                cursor.execute(f'''
+                    SELECT s.name, rs.category, rs.current_rate, rs.highest_rate, rs.lowest_rate,
+                           rs.highest_date, rs.lowest_date
+                    FROM rate_statistics rs
+                    JOIN stores s ON rs.store_id = s.id
+                    WHERE {name_condition}
+                    ORDER BY s.name, rs.category
+                ''', name_params)
+            else:
+                cursor.execute('''
+                    SELECT s.name, rs.category, rs.current_rate, rs.highest_rate, rs.lowest_rate,
+                           rs.highest_date, rs.lowest_date
+                    FROM rate_statistics rs
+                    JOIN stores s ON rs.store_id = s.id
+                    ORDER BY s.name, rs.category
+                ''')
+            
+            return cursor.fetchall()
     
     def close_connection(self):
         """关闭数据库连接"""
-        if hasattr(self, 'conn'):
-            self.conn.close()
+        if hasattr(self, 'pool'):
+            close_pool(self.db_path)
             self.logger.info("数据库连接已关闭")
 
 # 使用示例和测试函数
@@ -628,9 +595,6 @@ def test_scraper():
         
         for rate in result.detailed_rates:
             print(f"  - {rate.category}: {rate.rate}")
-        
-        # 短暂延迟
-        time.sleep(2)
     
     print(f"\n总共抓取了 {len(results)} 个商家")
     
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+ShopBack 数据库版本迁移
+数据库版本记录在 PRAGMA user_version 中，启动时按顺序执行尚未应用的迁移，
+迁移后运行ANALYZE更新查询规划器的统计信息
+
+检查API查询是否全部走索引（有全表扫描时退出码为1）:
+    python schema_migrations.py check shopback_data.db
+"""
+import logging
+import re
+import sqlite3
+import sys
+from typing import Callable, List, Tuple
+
+import dashboard_counters
+import history_store
+import job_queue
+import store_search
+
+logger = logging.getLogger(__name__)
+
+def migration_001_endpoint_indexes(cursor):
+    """按fapi.py的查询模式建立复合/覆盖索引，删除被其覆盖的单列索引"""
+    # 趋势查询: WHERE store_id = ? AND category = ? AND scraped_at >= ?，覆盖category_rate_numeric
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_cashback_store_category_time
+        ON cashback_history (store_id, category, scraped_at, category_rate_numeric)
+    ''')
+    # 每个商家最后一次抓取的Main行: WHERE category = 'Main' GROUP BY store_id MAX(id)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_cashback_category_store_id
+        ON cashback_history (category, store_id, id)
+    ''')
+    # /api/history?is_upsized=: 按is_upsized筛选后按scraped_at倒序
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_cashback_upsized_time
+        ON cashback_history (is_upsized, scraped_at)
+    ''')
+    # /api/stores: ORDER BY updated_at DESC
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stores_updated_at ON stores (updated_at)')
+    # /api/upsized-stores: WHERE category = 'Main' AND is_upsized = 1 ORDER BY比例
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_latest_category_upsized_rate
+        ON store_latest (category, is_upsized, category_rate_numeric)
+    ''')
+    # 每个商家当前打开的区间（抓取写入和快照重建时查询）
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_intervals_open
+        ON cashback_intervals (store_id, category) WHERE valid_to IS NULL
+    ''')
+    
+    # 已被上面的复合索引或UNIQUE约束的自动索引覆盖
+    cursor.execute('DROP INDEX IF EXISTS idx_cashback_store_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_stats_store_category')
+
+def migration_002_store_search(cursor):
+    """商家名称/URL slug的FTS5 trigram索引，以及短输入前缀查询用的NOCASE索引"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stores_name_nocase ON stores (name COLLATE NOCASE)')
+    try:
+        store_search.init_search_index(cursor)
+    except sqlite3.OperationalError as e:
+        # SQLite未编译FTS5或版本低于3.34(无trigram)时退回LIKE查询
+        logger.warning(f"无法创建全文索引，商家搜索将使用LIKE: {e}")
+
+def migration_003_scrape_queue(cursor):
+    """持久化抓取任务队列：提交表、URL任务表（租约、按URL去重）"""
+    job_queue.init_queue_tables(cursor)
+
+def migration_004_dashboard_counters(cursor):
+    """仪表盘计数器表和小时桶，由触发器在写入时维护，并由现有数据计算初始值"""
+    dashboard_counters.init_counter_tables(cursor)
+    dashboard_counters.rebuild_counters(cursor)
+
+def migration_005_stores_created_at(cursor):
+    """商家列表按 (created_at, id) 排序和游标分页"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stores_created_at ON stores (created_at)')
+
+def migration_006_observation_buckets(cursor):
+    """数据未变化的抓取也计入最近24小时的抓取数"""
+    dashboard_counters.init_observation_trigger(cursor)
+
+# (版本号, 说明, 迁移函数)，版本号必须连续递增
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, '按API查询模式建立复合/覆盖索引', migration_001_endpoint_indexes),
+    (2, '商家名称全文索引', migration_002_store_search),
+    (3, '持久化抓取任务队列', migration_003_scrape_queue),
+    (4, '仪表盘计数器', migration_004_dashboard_counters),
+    (5, '商家列表按创建时间分页', migration_005_stores_created_at),
+    (6, '未变化的抓取计入抓取数', migration_006_observation_buckets),
+]
+
+def get_schema_version(conn) -> int:
+    """读取数据库当前版本"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def apply_migrations(conn) -> int:
+    """
+    执行尚未应用的迁移，每个迁移在单独的事务中完成并更新user_version
+    有迁移被执行时运行ANALYZE，返回执行的迁移数
+    """
+    current = get_schema_version(conn)
+    applied = 0
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            migrate(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"数据库迁移 v{version}: {description}")
+        applied += 1
+    
+    if applied:
+        conn.execute('ANALYZE')
+        conn.commit()
+    return applied
+
+# 检查查询计划时的示例参数
+SAMPLE_TIME = '2024-01-01 00:00:00'
+SAMPLE_FTS = '"amazon"'
+
+def endpoint_query_templates() -> List[Tuple[str, str, tuple]]:
+    """
+    API和抓取器执行的查询: (名称, SQL, 示例参数)，{history}依次替换为两种存储模式下的历史表
+    SQL取自执行查询的模块中的常量，查询改动后检查自动跟上
+    """
+    # 与抓取器相互导入，在函数内导入
+    import api_queries as q
+    import batch_writer
+    import sb_scrap
+    
+    fts_name = f"s.id IN (SELECT rowid FROM {store_search.FTS_TABLE} WHERE {store_search.FTS_TABLE} MATCH ?)"
+    return [
+        ('dashboard', dashboard_counters.DASHBOARD_SQL.format(column='history_records'), ()),
+        ('stores', q.STORES_SQL.format(where=''), (50, 0)),
+        ('stores.cursor', q.STORES_SQL.format(where=q.where_clause([q.STORES_AFTER_CONDITION])),
+         (SAMPLE_TIME, 1, 50, 0)),
+        ('stores.search', store_search.FTS_SEARCH_SQL,
+         (SAMPLE_FTS, store_search.NAME_WEIGHT, store_search.SLUG_WEIGHT, 10)),
+        ('stores.search_prefix', store_search.NAME_LIKE_SQL, ('am%', 10)),
+        ('stores.history', q.STORE_LATEST_SQL.format(
+            where=q.where_clause(['sl.store_id = ?', 'sl.category = ?'])), (1, 'Main', 50)),
+        ('history', q.HISTORY_SQL.format(history='{history}', where=''), (100, 0)),
+        ('history.cursor', q.HISTORY_SQL.format(
+            history='{history}', where=q.where_clause([q.HISTORY_AFTER_CONDITION])),
+         (SAMPLE_TIME, 1, 100, 0)),
+        ('history.is_upsized', q.HISTORY_SQL.format(
+            history='{history}', where=q.where_clause(['ch.is_upsized = ?'])), (1, 100, 0)),
+        ('history.store_name', q.HISTORY_SQL.format(
+            history='{history}', where=q.where_clause([fts_name])), (SAMPLE_FTS, 100, 0)),
+        ('history.export', q.HISTORY_EXPORT_SQL.format(
+            history='{history}', where=q.where_clause(['ch.scraped_at >= ?', 'ch.scraped_at < ?'])),
+         (SAMPLE_TIME, '2024-02-01 00:00:00', 1000)),
+        ('history.export.after', q.HISTORY_EXPORT_SQL.format(
+            history='{history}', where=q.where_clause([q.HISTORY_EXPORT_AFTER_CONDITION])),
+         (SAMPLE_TIME, 1, 1000)),
+        ('statistics', q.STATISTICS_SQL.format(where=''), ()),
+        ('top_cashback', q.TOP_CASHBACK_SQL, (10,)),
+        ('top_cashback.category', q.TOP_CASHBACK_CATEGORY_SQL, ('Travel', 10)),
+        ('upsized_stores', q.UPSIZED_STORES_SQL, ()),
+        ('trends', q.TRENDS_SQL, ('2024-01-01', 1, 'Main', 1, 'Main')),
+        ('trends.intervals', history_store.INTERVAL_TRENDS_SQL, ('2024-01-01', 1, 'Main', 1, 'Main')),
+        ('store_lookup', sb_scrap.STORE_ID_SQL, ('a', 'b')),
+        ('store_lookup.url', batch_writer.STORES_BY_URL_SQL.format(placeholders='?, ?'), ('a', 'b')),
+        ('store_touch.fingerprint', batch_writer.TOUCH_FINGERPRINT_SQL, ('a', 'b')),
+        ('store_touch.store', batch_writer.TOUCH_STORE_SQL, ('a', 'b')),
+        ('open_intervals', history_store.OPEN_INTERVALS_SQL, (1,)),
+        ('delete_store.lookup', q.STORE_BY_ID_SQL, (1,)),
+        *((f'delete_store.{i}', sql, (1,)) for i, sql in enumerate(q.DELETE_STORE_SQL)),
+        ('delete_store.page_cache', q.DELETE_PAGE_CACHE_SQL, ('a',)),
+        ('scrape_queue.lease', job_queue.LEASE_JOBS_SQL, (1, 100)),
+        ('scrape_queue.progress', job_queue.JOB_COUNTS_SQL.format(placeholders='?'), (1,)),
+        ('scrape_queue.active_runs', job_queue.UNFINISHED_RUNS_SQL, ()),
+    ]
+
+# 没有使用索引的扫描: "SCAN ch"，而 "SCAN ch USING COVERING INDEX ..." 可以接受，
+# 窗口函数等生成的中间结果 "SCAN (subquery-N)" 也不是表
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (\w+)$')
+# WITH子句定义的公用表表达式（如按天展开的days），扫描它们不是全表扫描
+CTE_PATTERN = re.compile(r'\b(\w+)(?:\([^)]*\))? AS \(', re.IGNORECASE)
+
+def endpoint_queries() -> List[Tuple[str, str, tuple]]:
+    """展开{history}后的全部查询"""
+    queries = []
+    for name, sql, params in endpoint_query_templates():
+        if '{history}' in sql:
+            for mode in (history_store.ROWS_MODE, history_store.INTERVALS_MODE):
+                table = history_store.history_table(mode)
+                queries.append((f'{name}[{mode}]', sql.format(history=table), params))
+        else:
+            queries.append((name, sql, params))
+    return queries
+
+def check_query_plans(conn) -> List[Tuple[str, str]]:
+    """返回出现全表扫描的查询: [(名称, 查询计划中的扫描步骤)]"""
+    failures = []
+    for name, sql, params in endpoint_queries():
+        try:
+            plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        except sqlite3.OperationalError as e:
+            # 例如没有FTS索引，对应的查询会退回全表扫描
+            failures.append((name, str(e)))
+            continue
+        for row in plan:
+            detail = row[3]
+            match = FULL_SCAN_PATTERN.match(detail)
+            if match and match.group(1) not in CTE_PATTERN.findall(sql):
+                failures.append((name, detail))
+    return failures
+
+def main():
+    """命令行入口"""
+    args = sys.argv[1:]
+    if not args or args[0] != 'check':
+        print(__doc__)
+        return
+    
+    db_path = args[1] if len(args) > 1 else 'shopback_data.db'
+    conn = sqlite3.connect(db_path)
+    try:
+        failures = check_query_plans(conn)
+    finally:
+        conn.close()
+    
+    if failures:
+        for name, detail in failures:
+            print(f"全表扫描: {name}: {detail}")
+        sys.exit(1)
+    print(f"全部 {len(endpoint_queries())} 个查询均使用索引")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+ShopBack 抓取执行器
+任务保存在SQLite任务队列中（job_queue.py），固定数量的工作线程按批租用URL任务，
+网络请求、解析和SQLite写入都在工作线程中完成，不占用FastAPI的事件循环；
+批量任务的解析交给抓取流水线的进程池。进程重启后从未完成的任务继续
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db_pool import get_pool
+from fetch_engine import ScrapePipeline, create_parse_executor, default_parse_processes
+from job_queue import (ACTIVE_RUN_STATES, JOB_LEASED, JOB_PENDING, RUN_CANCELLED,
+                       ScrapeJobQueue, ScrapeRun)
+from rate_limiter import RateCap
+
+logger = logging.getLogger(__name__)
+
+# 批次连续出错时工作线程最长的等待秒数
+MAX_FAILURE_BACKOFF = 300.0
+
+class ScrapeQueueFull(Exception):
+    """未完成的提交数已达上限"""
+
+@dataclass
+class LeasedBatch:
+    """工作线程正在处理的一批任务"""
+    run_id: int
+    kind: str
+    worker: str
+    total: int
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    completed: int = 0
+    failed: int = 0
+    stages: Dict = field(default_factory=dict)  # 批量任务各阶段的吞吐量
+
+class ScrapeExecutor:
+    """专用抓取执行器"""
+    
+    def __init__(self, scraper_factory: Callable, db_path: str, max_workers: int = 2,
+                 max_queue: int = 100, parse_processes: Optional[int] = None,
+                 lease_size: int = 100, lease_seconds: float = 120, poll_seconds: float = 5.0):
+        """
+        max_queue: 未完成的提交数上限
+        parse_processes: 批量任务的解析进程数，None为CPU核数，0表示在线程中解析
+        lease_size: 每次租用的URL数，lease_seconds: 租约时长（处理过程中续租）
+        """
+        self.scraper_factory = scraper_factory
+        self.queue = ScrapeJobQueue(get_pool(db_path))
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.parse_processes = default_parse_processes(parse_processes)
+        # 所有工作线程和批次共用一个解析池，执行器存在期间只启动一次子进程
+        self.parse_pool = None
+        self.parse_pool_lock = threading.Lock()
+        self.lease_size = lease_size
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.wakeup = threading.Event()
+        self.in_flight: Dict[str, LeasedBatch] = {}
+        # 每个提交的速率上限 (run_id -> RateCap)，同一提交同时处理的多个批次共用，合计不超过提交的速率
+        self.rate_caps: Dict[int, RateCap] = {}
+        self.lock = threading.Lock()
+        self.batches_completed = 0
+        self.urls_completed = 0
+        self.urls_failed = 0
+        self.workers: List[threading.Thread] = []
+    
+    def start(self):
+        """启动工作线程，继续处理上次进程退出时未完成的提交"""
+        if self.workers:
+            return
+        # 抓取器初始化时执行数据库迁移（含任务队列表）
+        self.scraper_factory()
+        unfinished = self.queue.unfinished_runs()
+        if unfinished:
+            remaining = sum(run.jobs.get(JOB_PENDING, 0) + run.jobs.get(JOB_LEASED, 0) for run in unfinished)
+            logger.info(f"继续未完成的抓取任务: {len(unfinished)} 个提交, {remaining} 个URL")
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker, name=f"scrape-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"抓取执行器已启动: {self.max_workers} 个工作线程, 未完成提交上限 {self.max_queue}")
+    
+    def shutdown(self):
+        """关闭共用的解析池"""
+        with self.parse_pool_lock:
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown(wait=False, cancel_futures=True)
+                self.parse_pool = None
+    
+    def _get_parse_pool(self):
+        """共用的解析池，第一次使用时创建"""
+        with self.parse_pool_lock:
+            if self.parse_pool is None:
+                self.parse_pool = create_parse_executor(self.parse_processes)
+            return self.parse_pool
+    
+    def _discard_parse_pool(self, pool):
+        """解析池损坏时丢弃，下一批重新创建"""
+        with self.parse_pool_lock:
+            if self.parse_pool is pool:
+                self.parse_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning("解析进程池已损坏，下一批任务将重新创建")
+    
+    def submit_single(self, url: str) -> ScrapeRun:
+        """提交单个商家的抓取任务"""
+        return self._submit('single', [url])
+    
+    def submit_batch(self, urls: List[str], concurrency: int, requests_per_second: float,
+                     kind: str = 'batch') -> ScrapeRun:
+        """提交批量抓取任务，已在队列中的URL不会重复加入"""
+        return self._submit(kind, urls, concurrency, requests_per_second)
+    
+    def _submit(self, kind: str, urls: List[str], concurrency: int = 1,
+                requests_per_second: float = 1.0) -> ScrapeRun:
+        if self.queue.counts()["active_runs"] >= self.max_queue:
+            raise ScrapeQueueFull(f"未完成的抓取任务已达上限 ({self.max_queue})")
+        run = self.queue.create_run(kind, urls, concurrency, requests_per_second)
+        self.wakeup.set()
+        logger.info(f"抓取任务已入队: #{run.id} {kind}, {run.total} 个URL"
+                    + (f" (跳过 {run.duplicates} 个已在队列中的URL)" if run.duplicates else ""))
+        return run
+    
+    def cancel(self, run_id: int) -> bool:
+        """取消提交，返回是否有未完成的提交被取消"""
+        cancelled = self.queue.cancel(run_id)
+        if cancelled:
+            logger.info(f"抓取任务已取消: #{run_id}")
+        return cancelled
+    
+    def get_run(self, run_id: int) -> Optional[ScrapeRun]:
+        """提交的进度"""
+        return self.queue.get_run(run_id)
+    
+    def is_pending(self, run_id: int) -> bool:
+        """提交还在排队或正在执行"""
+        return self.queue.run_state(run_id) in ACTIVE_RUN_STATES
+    
+    def status(self) -> Dict:
+        """队列深度和进行中的任务"""
+        counts = self.queue.counts()
+        with self.lock:
+            in_flight = [asdict(batch) for batch in self.in_flight.values()]
+            return {
+                "workers": self.max_workers,
+                "queue_depth": counts["pending_jobs"],
+                "leased": counts["leased_jobs"],
+                "active_runs": counts["active_runs"],
+                "queue_capacity": self.max_queue,
+                "in_flight": in_flight,
+                "batches_completed": self.batches_completed,
+                "urls_completed": self.urls_completed,
+                "urls_failed": self.urls_failed,
+            }
+    
+    def _worker(self):
+        """工作线程主循环：租用一批任务并处理，没有任务时等待新的提交"""
+        name = threading.current_thread().name
+        owner = f"{socket.gethostname()}:{os.getpid()}:{name}"
+        # 连续出错的批次数：出错后按指数退避等待，避免对同样会失败的任务反复重试
+        failures = 0
+        while True:
+            try:
+                leased = self.queue.lease(owner, self.lease_size, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"租用抓取任务失败: {e}")
+                leased = None
+            if leased is None:
+                self.wakeup.wait(self.poll_seconds)
+                self.wakeup.clear()
+                continue
+            
+            run, jobs = leased
+            batch = LeasedBatch(run_id=run.id, kind=run.kind, worker=name, total=len(jobs))
+            with self.lock:
+                self.in_flight[name] = batch
+            try:
+                if run.kind == 'single':
+                    job_id, url = jobs[0]
+                    result = self.scraper_factory().scrape_store_page(url)
+                    self._record(batch, result)
+                    self.queue.complete(run.id, [(job_id, result.scraping_success, result.error_message)])
+                else:
+                    asyncio.run(self._run_batch(owner, run, batch, jobs))
+            except Exception as e:
+                failures += 1
+                logger.error(f"抓取任务 #{run.id} 执行失败: {e}")
+                # 未记录结果的任务交还队列，由下一次租用重试（达到最大租用次数的标记为失败）
+                try:
+                    self.queue.release(run.id, [job_id for job_id, _ in jobs], str(e))
+                except Exception as release_error:
+                    logger.error(f"交还抓取任务失败，等待租约过期: {release_error}")
+            else:
+                failures = 0
+            finally:
+                with self.lock:
+                    self.in_flight.pop(name, None)
+                    self.batches_completed += 1
+                    if not any(other.run_id == run.id for other in self.in_flight.values()):
+                        self.rate_caps.pop(run.id, None)
+            if failures:
+                delay = min(MAX_FAILURE_BACKOFF, self.poll_seconds * 2 ** (failures - 1))
+                logger.info(f"{name} 等待 {delay:.1f} 秒后继续租用任务")
+                time.sleep(delay)
+    
+    async def _run_batch(self, owner: str, run: ScrapeRun, batch: LeasedBatch,
+                         jobs: List[Tuple[int, str]]):
+        """在工作线程自己的事件循环中执行批量抓取，结果分批写回任务队列"""
+        job_ids = {url: job_id for job_id, url in jobs}
+        parse_pool = self._get_parse_pool()
+        with self.lock:
+            rate_cap = self.rate_caps.setdefault(run.id, RateCap(run.requests_per_second))
+        pipeline = ScrapePipeline(self.scraper_factory(), concurrency=run.concurrency,
+                                  requests_per_second=run.requests_per_second,
+                                  parse_processes=self.parse_processes, parse_executor=parse_pool,
+                                  rate_cap=rate_cap)
+        finished = []
+        # 结果要等批量写入提交后才返回，续租按时间进行，不依赖结果到达的节奏
+        cancelled = asyncio.Event()
+        renewer = asyncio.create_task(self._keep_leases(owner, run.id, job_ids, finished, cancelled))
+        try:
+            async for result in pipeline.run(list(job_ids)):
+                self._record(batch, result, pipeline.stats())
+                job_id = job_ids.pop(result.url, None)
+                if job_id is not None:
+                    finished.append((job_id, result.scraping_success, result.error_message))
+                if len(finished) >= 20 or not job_ids:
+                    self.queue.complete(run.id, list(finished))
+                    finished.clear()
+                if cancelled.is_set() and job_ids:
+                    logger.info(f"抓取任务 #{run.id} 已取消，停止抓取剩余 {len(job_ids)} 个URL")
+                    break
+        finally:
+            renewer.cancel()
+        if finished:
+            self.queue.complete(run.id, finished)
+        if pipeline.parse_pool_broken:
+            self._discard_parse_pool(parse_pool)
+    
+    async def _keep_leases(self, owner: str, run_id: int, job_ids: Dict[str, int],
+                           finished: List, cancelled: asyncio.Event):
+        """
+        每 lease_seconds/3 秒为尚未记录结果的任务续租（包括已有结果、等待写回队列的任务），
+        发现提交已取消时设置cancelled并停止续租
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            remaining = list(job_ids.values()) + [job_id for job_id, _, _ in finished]
+            if not remaining:
+                return
+            try:
+                running = await loop.run_in_executor(None, self._renew, owner, run_id, remaining)
+            except Exception as e:
+                logger.error(f"抓取任务 #{run_id} 续租失败: {e}")
+                continue
+            if not running:
+                cancelled.set()
+                return
+    
+    def _renew(self, owner: str, run_id: int, remaining: List[int]) -> bool:
+        """为剩余任务续租，提交已取消时返回False"""
+        if self.queue.run_state(run_id) == RUN_CANCELLED:
+            return False
+        self.queue.renew(owner, remaining, self.lease_seconds)
+        return True
+    
+    def _record(self, batch: LeasedBatch, result, stages: Optional[Dict] = None):
+        """记录单个URL的抓取结果"""
+        with self.lock:
+            if stages is not None:
+                batch.stages = stages
+            if result.scraping_success:
+                batch.completed += 1
+                self.urls_completed += 1
+            else:
+                batch.failed += 1
+                self.urls_failed += 1
+        done = batch.completed + batch.failed
+        if result.scraping_success:
+            logger.info(f"抓取进度 #{batch.run_id} {done}/{batch.total}: {result.name} - {result.main_cashback}")
+        else:
+            logger.error(f"抓取失败 #{batch.run_id}: {result.url} - {result.error_message}")
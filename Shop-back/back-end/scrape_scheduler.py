@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+ShopBack 按变化频率调度的定时抓取
+每个商家的抓取间隔由它在历史表中观测到的比例变化频率决定：
+  间隔 = 平均变化间隔 / POLLS_PER_CHANGE，限制在 [最短间隔, 最长间隔] 内
+  当前upsized的商家（优惠很快结束）间隔不超过upsized_interval_hours
+变化频率用 (变化次数 + 1) / (观测天数 + 1) 估计，新商家按每天变化一次（即原来的6小时）处理。
+间隔从最近一次抓取（成功或失败，取自任务队列）开始计算；连续失败n次的商家间隔乘以2^n（不超过最长间隔），
+持续失败的商家不会一直排在最前面占用每次调度的名额。
+每次调度只提交已到期的商家，按逾期程度（已过时间 / 间隔）排序，
+每次提交的数量不超过原来"所有商家每6小时一次"的平均请求量
+
+查看当前的抓取计划:
+    python scrape_scheduler.py shopback_data.db
+"""
+import math
+import sqlite3
+import sys
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import history_store
+
+# 每次比例变化之间平均抓取的次数
+POLLS_PER_CHANGE = 4
+
+# 每个URL窗口内最近一次结束的抓取任务，以及最近一次成功之后的失败次数
+STORE_ATTEMPTS_SQL = '''
+    SELECT j.url, MAX(j.finished_at) AS last_attempt,
+           SUM(j.state = 'failed' AND j.finished_at > COALESCE(d.last_done, '')) AS failures
+    FROM scrape_jobs j
+    LEFT JOIN (
+        SELECT url, MAX(finished_at) AS last_done FROM scrape_jobs
+        WHERE state = 'done' AND finished_at >= datetime('now', ?)
+        GROUP BY url
+    ) d ON d.url = j.url
+    WHERE j.state IN ('done', 'failed') AND j.finished_at >= datetime('now', ?)
+    GROUP BY j.url
+'''
+
+@dataclass
+class StorePlan:
+    """单个商家的抓取计划"""
+    store_id: int
+    name: str
+    url: str
+    last_scraped: Optional[str]
+    changes: int  # 观测窗口内的比例变化次数
+    observed_days: float
+    is_upsized: bool
+    interval_hours: float
+    last_attempt: Optional[str]  # 任务队列中最近一次抓取结束的时间
+    failures: int  # 最近一次成功之后连续失败的次数
+    next_scrape_at: str
+    priority: float  # 已过时间 / 间隔，>=1 表示已到期
+    
+    @property
+    def due(self) -> bool:
+        return self.priority >= 1.0
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """解析SQLite CURRENT_TIMESTAMP格式的UTC时间"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+class ScrapeScheduler:
+    """按比例变化频率和upsized状态计算每个商家的下次抓取时间"""
+    
+    def __init__(self, tick_minutes: float = 10, min_interval_hours: float = 1,
+                 max_interval_hours: float = 24, upsized_interval_hours: float = 2,
+                 baseline_interval_hours: float = 6, window_days: int = 30):
+        """
+        tick_minutes: 调度检查间隔
+        baseline_interval_hours: 原来的固定抓取间隔，用于计算每次调度的请求预算
+        window_days: 统计比例变化的时间窗口
+        """
+        self.tick_minutes = tick_minutes
+        self.min_interval_hours = min_interval_hours
+        self.max_interval_hours = max_interval_hours
+        self.upsized_interval_hours = upsized_interval_hours
+        self.baseline_interval_hours = baseline_interval_hours
+        self.window_days = window_days
+    
+    def interval_hours(self, changes: int, observed_days: float, is_upsized: bool,
+                       failures: int = 0) -> float:
+        """由观测到的变化次数计算抓取间隔（小时），连续失败时按2^failures退避"""
+        changes_per_day = (changes + 1) / (observed_days + 1)
+        interval = 24 / changes_per_day / POLLS_PER_CHANGE
+        if is_upsized:
+            interval = min(interval, self.upsized_interval_hours)
+        interval = max(self.min_interval_hours, interval) * 2 ** failures
+        return min(self.max_interval_hours, interval)
+    
+    def tick_budget(self, store_count: int) -> int:
+        """每次调度最多提交的商家数：与所有商家每baseline_interval_hours抓取一次的平均请求量相同"""
+        return max(1, math.ceil(store_count * self.tick_minutes / 60 / self.baseline_interval_hours))
+    
+    def store_activity(self, conn) -> List[sqlite3.Row]:
+        """每个商家的观测时间、最近抓取时间、窗口内的比例变化次数和当前upsized状态"""
+        history = history_store.history_table(history_store.get_history_mode(conn))
+        # 同一分类相邻两条记录的比例不同即为一次变化，同一时刻多个分类的变化算一次
+        return conn.execute(f'''
+            WITH changes AS (
+                SELECT store_id, COUNT(DISTINCT scraped_at) AS changes
+                FROM (
+                    SELECT store_id, scraped_at, category_rate_numeric,
+                           LAG(category_rate_numeric) OVER (
+                               PARTITION BY store_id, category ORDER BY scraped_at
+                           ) AS previous_rate
+                    FROM {history}
+                    WHERE scraped_at >= datetime('now', ?) AND scraping_success = 1
+                )
+                WHERE previous_rate IS NOT NULL AND previous_rate != category_rate_numeric
+                GROUP BY store_id
+            )
+            SELECT s.id, s.name, s.url, s.created_at, s.updated_at,
+                   COALESCE(c.changes, 0) AS changes,
+                   COALESCE(l.is_upsized, 0) AS is_upsized
+            FROM stores s
+            LEFT JOIN changes c ON c.store_id = s.id
+            LEFT JOIN store_latest l ON l.store_id = s.id AND l.category = 'Main'
+        ''', (f'-{self.window_days} days',)).fetchall()
+    
+    def store_attempts(self, conn) -> Dict[str, sqlite3.Row]:
+        """任务队列中每个URL最近的抓取结果 (url -> 行)，数据库还没有任务队列时为空"""
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scrape_jobs'").fetchone():
+            return {}
+        window = f'-{self.window_days} days'
+        return {row['url']: row for row in conn.execute(STORE_ATTEMPTS_SQL, (window, window))}
+    
+    def plan(self, conn, now: Optional[datetime] = None) -> List[StorePlan]:
+        """所有商家的抓取计划，按优先级从高到低排序"""
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        attempts = self.store_attempts(conn)
+        plans = []
+        for row in self.store_activity(conn):
+            attempt = attempts.get(row['url'])
+            last_attempt = attempt['last_attempt'] if attempt else None
+            failures = attempt['failures'] if attempt else 0
+            created_at = parse_timestamp(row['created_at']) or now
+            # 失败的抓取不更新商家，间隔从商家更新和最近一次抓取中较晚的一个开始计算
+            last_scraped = max(filter(None, (parse_timestamp(row['updated_at']),
+                                             parse_timestamp(last_attempt))), default=None)
+            observed_days = min(self.window_days, max(0.0, (now - created_at).total_seconds() / 86400))
+            interval = self.interval_hours(row['changes'], observed_days, bool(row['is_upsized']), failures)
+            
+            if last_scraped is None:
+                next_scrape_at, priority = now, math.inf
+            else:
+                next_scrape_at = last_scraped + timedelta(hours=interval)
+                priority = (now - last_scraped).total_seconds() / 3600 / interval
+            
+            plans.append(StorePlan(
+                store_id=row['id'],
+                name=row['name'],
+                url=row['url'],
+                last_scraped=row['updated_at'],
+                changes=row['changes'],
+                observed_days=round(observed_days, 1),
+                is_upsized=bool(row['is_upsized']),
+                interval_hours=round(interval, 2),
+                last_attempt=last_attempt,
+                failures=failures,
+                next_scrape_at=next_scrape_at.strftime('%Y-%m-%d %H:%M:%S'),
+                priority=priority,
+            ))
+        plans.sort(key=lambda plan: plan.priority, reverse=True)
+        return plans
+    
+    def due_stores(self, conn, now: Optional[datetime] = None) -> List[StorePlan]:
+        """本次调度需要抓取的商家：已到期的按优先级取前tick_budget个"""
+        plans = self.plan(conn, now)
+        budget = self.tick_budget(len(plans))
+        return [plan for plan in plans if plan.due][:budget]
+
+def plan_summary(plan: StorePlan) -> Dict:
+    """API返回的计划（无穷大的优先级无法序列化为JSON）"""
+    data = asdict(plan)
+    data['priority'] = None if math.isinf(plan.priority) else round(plan.priority, 2)
+    data['due'] = plan.due
+    return data
+
+def main():
+    """命令行入口：输出每个商家的抓取间隔和下次抓取时间"""
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    
+    conn = sqlite3.connect(sys.argv[1])
+    conn.row_factory = sqlite3.Row
+    scheduler = ScrapeScheduler()
+    plans = scheduler.plan(conn)
+    print(f"{'商家':<30}{'变化':>6}{'失败':>6}{'间隔(小时)':>12}  {'下次抓取(UTC)':<20}upsized")
+    for plan in plans:
+        print(f"{plan.name[:28]:<30}{plan.changes:>6}{plan.failures:>6}{plan.interval_hours:>12}  "
+              f"{plan.next_scrape_at:<20}{'是' if plan.is_upsized else ''}")
+    due = scheduler.due_stores(conn)
+    print(f"\n共 {len(plans)} 个商家，本次调度将抓取 {len(due)} 个 (每次上限 {scheduler.tick_budget(len(plans))})")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+ShopBack 页面结构选择器配置
+分类比例列表有两种页面结构，每种结构用声明式的选择器描述，
+由各解析后端编译成匹配函数/XPath（只编译一次）。
+抓取器记住每个商家上次匹配的结构，下次先尝试该结构
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+@dataclass(frozen=True)
+class Selector:
+    """元素选择器：标签名、data-testid、class中需要包含的子串"""
+    tag: Optional[str] = None
+    testid: Optional[str] = None
+    classes: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class Field:
+    """
+    rate行中的字段：依次查找path中的元素，再取其中匹配select的元素
+    index为None时取第一个包含'%'且不含exclude关键词的元素
+    """
+    select: Selector
+    path: Tuple[Selector, ...] = ()
+    index: Optional[int] = 0
+    exclude: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class LayoutProfile:
+    """一种页面结构：容器路径、rate行、分类名称和比例字段"""
+    name: str
+    description: str
+    container: Tuple[Selector, ...]
+    rows: Selector
+    category: Field
+    rate: Field
+
+LAYOUTS: List[LayoutProfile] = [
+    # data-testid="cashback-rates" > cashback-tier-block > 每行两个p：分类名称和比例
+    LayoutProfile(
+        name='simple',
+        description='简单结构',
+        container=(Selector('div', testid='cashback-rates'),
+                   Selector('div', testid='cashback-tier-block')),
+        rows=Selector('div', classes=('flex_row', 'justify_space-between')),
+        category=Field(Selector('p'), index=0),
+        rate=Field(Selector('p'), index=1),
+    ),
+    # data-testid="all-cashback-rates"，分类名称在flex_1中，当前比例是font_bold的p
+    LayoutProfile(
+        name='complex',
+        description='复杂结构',
+        container=(Selector('div', testid='all-cashback-rates'),),
+        rows=Selector('div', classes=('bg_sbds-background-color-secondary',)),
+        category=Field(Selector('p'), path=(Selector('div', classes=('flex_1',)),)),
+        rate=Field(Selector('p', classes=('font_bold',)), index=None, exclude=('upsized', 'ends')),
+    ),
+]
+
+LAYOUTS_BY_NAME: Dict[str, LayoutProfile] = {layout.name: layout for layout in LAYOUTS}
+
+def layout_order(preferred: Optional[str] = None) -> List[LayoutProfile]:
+    """按尝试顺序返回页面结构，preferred（上次匹配的结构）排在最前"""
+    if preferred not in LAYOUTS_BY_NAME:
+        return LAYOUTS
+    return [LAYOUTS_BY_NAME[preferred]] + [layout for layout in LAYOUTS if layout.name != preferred]
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+ShopBack 商家名称搜索
+stores_fts 是商家名称和URL slug上的FTS5 trigram索引，由stores表上的触发器同步，
+子串匹配不再需要对stores做 LIKE '%x%' 全表扫描。
+名称前缀走 idx_stores_name_nocase 索引，trigram至少需要3个字符
+"""
+import difflib
+from typing import Dict, List, Tuple
+
+FTS_TABLE = 'stores_fts'
+
+# trigram分词器能匹配的最短查询
+MIN_FTS_QUERY = 3
+
+# 名称的权重高于URL slug
+NAME_WEIGHT = 10.0
+SLUG_WEIGHT = 1.0
+
+# 模糊匹配：最多取多少个候选重新排序，以及最低相似度
+FUZZY_CANDIDATES = 50
+FUZZY_MIN_RATIO = 0.6
+
+# URL中host之后的部分，'-'替换为空格: https://www.shopback.com.au/amazon-australia -> amazon australia
+SLUG_SQL = "replace(substr({url}, instr(substr({url}, 9), '/') + 9), '-', ' ')"
+
+# 名称LIKE匹配（前缀模式走 idx_stores_name_nocase 索引）
+NAME_LIKE_SQL = r'''
+    SELECT id, name, url FROM stores
+    WHERE name LIKE ? ESCAPE '\'
+    ORDER BY name COLLATE NOCASE
+    LIMIT ?
+'''
+
+# 全文索引匹配，按bm25排序（名称和slug的权重为参数）
+FTS_SEARCH_SQL = f'''
+    SELECT s.id, s.name, s.url, {FTS_TABLE}.slug
+    FROM {FTS_TABLE}
+    JOIN stores s ON s.id = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH ?
+    ORDER BY bm25({FTS_TABLE}, ?, ?), s.name
+    LIMIT ?
+'''
+
+def init_search_index(cursor):
+    """创建FTS5 trigram索引、同步触发器，并由stores现有数据填充"""
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+        USING fts5(name, slug, tokenize = 'trigram')
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stores_fts_insert
+        AFTER INSERT ON stores
+        BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, name, slug)
+            VALUES (NEW.id, NEW.name, {SLUG_SQL.format(url='NEW.url')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stores_fts_update
+        AFTER UPDATE OF name, url ON stores
+        BEGIN
+            UPDATE {FTS_TABLE} SET name = NEW.name, slug = {SLUG_SQL.format(url='NEW.url')}
+            WHERE rowid = NEW.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stores_fts_delete
+        AFTER DELETE ON stores
+        BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id;
+        END
+    ''')
+    cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    cursor.execute(f'''
+        INSERT INTO {FTS_TABLE} (rowid, name, slug)
+        SELECT id, name, {SLUG_SQL.format(url='url')} FROM stores
+    ''')
+
+def has_search_index(conn) -> bool:
+    """数据库中是否有FTS索引（SQLite未编译FTS5时迁移会跳过建表）"""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone()
+    return row is not None
+
+def fts_phrase(term: str, column: str = None) -> str:
+    """把用户输入转成FTS5短语查询，避免其中的运算符和引号被解析"""
+    phrase = '"' + term.replace('"', '""') + '"'
+    return f'{column} : {phrase}' if column else phrase
+
+def like_prefix(term: str) -> str:
+    """名称前缀的LIKE模式，转义用户输入中的通配符"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%'
+
+def name_filter(conn, term: str, store_id_column: str = 's.id',
+                name_column: str = 's.name') -> Tuple[str, list]:
+    """
+    "商家名称包含term"的WHERE条件及参数，与原来的 name LIKE '%term%' 结果一致
+    有FTS索引且输入足够长时使用索引，否则退回LIKE
+    """
+    if len(term) >= MIN_FTS_QUERY and has_search_index(conn):
+        return (f"{store_id_column} IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)",
+                [fts_phrase(term, 'name')])
+    return f"{name_column} LIKE ?", [f"%{term}%"]
+
+def _row_to_result(row, match: str) -> Dict:
+    return {'id': row[0], 'name': row[1], 'url': row[2], 'match': match}
+
+def _search_prefix(conn, term: str, limit: int) -> List[Dict]:
+    """名称前缀匹配，走 idx_stores_name_nocase 索引"""
+    rows = conn.execute(NAME_LIKE_SQL, (like_prefix(term), limit)).fetchall()
+    return [_row_to_result(row, 'prefix') for row in rows]
+
+def _search_substring(conn, term: str, limit: int, exclude: set) -> List[Dict]:
+    """名称/slug子串匹配，按bm25排序；没有FTS索引时退回LIKE"""
+    if not has_search_index(conn):
+        rows = conn.execute(NAME_LIKE_SQL, ('%' + like_prefix(term), limit + len(exclude))).fetchall()
+    else:
+        rows = conn.execute(FTS_SEARCH_SQL, (fts_phrase(term), NAME_WEIGHT, SLUG_WEIGHT,
+                                             limit + len(exclude))).fetchall()
+    results = [_row_to_result(row, 'substring') for row in rows if row[0] not in exclude]
+    return results[:limit]
+
+def _search_fuzzy(conn, term: str, limit: int, exclude: set) -> List[Dict]:
+    """容错匹配：取与输入共享trigram最多的候选，再按名称相似度重新排序"""
+    lowered = term.lower()
+    trigrams = {lowered[i:i + 3] for i in range(len(lowered) - 2)}
+    query = ' OR '.join(fts_phrase(trigram) for trigram in sorted(trigrams))
+    rows = conn.execute(FTS_SEARCH_SQL, (query, NAME_WEIGHT, SLUG_WEIGHT, FUZZY_CANDIDATES)).fetchall()
+    
+    scored = []
+    for row in rows:
+        if row[0] in exclude:
+            continue
+        ratio = max(difflib.SequenceMatcher(None, lowered, text.lower()).ratio()
+                    for text in (row[1], row[3]) if text)
+        if ratio >= FUZZY_MIN_RATIO:
+            scored.append((ratio, row))
+    scored.sort(key=lambda item: -item[0])
+    return [_row_to_result(row, 'fuzzy') for _, row in scored[:limit]]
+
+def search_stores(conn, term: str, limit: int = 10, fuzzy: bool = True) -> List[Dict]:
+    """
+    搜索商家：名称前缀 > 名称/slug子串(bm25) > 拼写容错，前一级结果不足limit时才查询下一级
+    返回 [{'id', 'name', 'url', 'match'}]
+    """
+    term = term.strip()
+    if not term:
+        return []
+    
+    results = _search_prefix(conn, term, limit)
+    if len(term) < MIN_FTS_QUERY or len(results) >= limit:
+        return results
+    
+    found = {result['id'] for result in results}
+    results += _search_substring(conn, term, limit - len(results), found)
+    if fuzzy and len(results) < limit and has_search_index(conn):
+        found = {result['id'] for result in results}
+        results += _search_fuzzy(conn, term, limit - len(results), found)
+    return results
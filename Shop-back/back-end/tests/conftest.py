@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+测试共用的fixture
+后端模块位于上一级目录（不是包），测试运行前加入导入路径:
+    cd Shop-back/back-end && python -m pytest -q
+"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class OkHandler(BaseHTTPRequestHandler):
+    """所有GET请求返回200"""
+    
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def http_server():
+    """本地HTTP服务器，返回其基础URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def pool(tmp_path):
+    """临时数据库上的连接池"""
+    from db_pool import SQLitePool
+    instance = SQLitePool(str(tmp_path / 'pool.db'), max_readers=2)
+    yield instance
+    instance.close()
+
+@pytest.fixture
+def scraper(tmp_path, monkeypatch):
+    """临时数据库上的抓取器（日志文件也写在临时目录）"""
+    monkeypatch.chdir(tmp_path)
+    from sb_scrap import ShopBackSQLiteScraper
+    instance = ShopBackSQLiteScraper(str(tmp_path / 'shopback_data.db'))
+    yield instance
+    instance.close_connection()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+db_pool测试：只读连接数有上限并按时限等待，写锁在归还写连接时释放（包括API的删除接口）
+"""
+import sqlite3
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from db_pool import PoolTimeout
+from models import StoreInfo
+
+def lock_is_free(lock) -> bool:
+    """在另一个线程中尝试获取锁（RLock在持有它的线程中总能重入）"""
+    result = []
+    
+    def try_acquire():
+        acquired = lock.acquire(timeout=1)
+        if acquired:
+            lock.release()
+        result.append(acquired)
+    
+    thread = threading.Thread(target=try_acquire)
+    thread.start()
+    thread.join()
+    return result[0]
+
+def test_reader_wait_is_bounded(pool):
+    first = pool.acquire_reader()
+    second = pool.acquire_reader()
+    with pytest.raises(PoolTimeout):
+        pool.acquire_reader(timeout=0.05)
+    
+    first.close()
+    third = pool.acquire_reader(timeout=0.05)
+    third.close()
+    second.close()
+
+def test_reader_is_returned_and_reused(pool):
+    conn = pool.acquire_reader()
+    raw = conn._conn
+    conn.close()
+    conn.close()  # 重复close不会多次归还
+    assert pool.idle_readers.qsize() == 1
+    with pool.reader() as again:
+        assert again._conn is raw
+
+def test_readers_are_read_only(pool):
+    with pool.writer() as conn:
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+        conn.commit()
+    with pool.reader() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('INSERT INTO items DEFAULT VALUES')
+
+def test_writer_lock_held_until_close(pool):
+    with pool.writer() as conn:
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+        conn.commit()
+    
+    conn = pool.acquire_writer()
+    conn.execute('INSERT INTO items DEFAULT VALUES')
+    assert not lock_is_free(pool.write_lock)
+    conn.close()
+    assert lock_is_free(pool.write_lock)
+    # 未提交的事务在归还时回滚
+    with pool.reader() as reader:
+        assert reader.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 0
+
+def test_api_delete_releases_writer(scraper, monkeypatch):
+    import fapi
+    monkeypatch.setattr(fapi, 'db_path', scraper.db_path)
+    for name in ('Agoda', 'Amazon'):
+        scraper.save_to_database(StoreInfo(
+            name=name, main_cashback='5%', main_rate_numeric=5.0, detailed_rates=[],
+            is_upsized=False, previous_offer=None, url=f'https://www.shopback.com.au/{name.lower()}',
+            last_updated='', scraping_success=True))
+    
+    client = TestClient(fapi.app)
+    assert client.delete('/api/stores/1').status_code == 200
+    assert lock_is_free(scraper.pool.write_lock)
+    assert client.delete('/api/stores/1').status_code == 404
+    assert lock_is_free(scraper.pool.write_lock)
+    assert client.delete('/api/stores/2').status_code == 200
+    assert lock_is_free(scraper.pool.write_lock)
+    
+    with scraper.pool.reader() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM stores').fetchone()[0] == 0
+        assert conn.execute('SELECT COUNT(*) FROM cashback_history').fetchone()[0] == 0
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+rows模式下数据未变化的抓取只更新指纹，不写历史行：趋势、商家最新数据和最近抓取数仍按观测统计
+"""
+import api_queries
+import dashboard_counters
+from models import CashbackRate, StoreInfo
+
+def store_info(main_rate: float) -> StoreInfo:
+    return StoreInfo(name='Agoda', main_cashback=f'Up to {main_rate:g}% Cashback',
+                     main_rate_numeric=main_rate,
+                     detailed_rates=[CashbackRate('Hotels', '5%', 5.0),
+                                     CashbackRate('Flights', '1%', 1.0)],
+                     is_upsized=False, previous_offer=None,
+                     url='https://www.shopback.com.au/agoda', last_updated='',
+                     scraping_success=True)
+
+def backdate(conn, days: int):
+    """把已有的记录移到days天前"""
+    for table, column in (('cashback_history', 'scraped_at'), ('store_latest', 'scraped_at'),
+                          ('store_fingerprints', 'last_seen_at')):
+        conn.execute(f"UPDATE {table} SET {column} = datetime('now', '-{days} days')")
+    conn.execute('DELETE FROM scrape_buckets')
+    conn.commit()
+
+def test_unchanged_scrape_writes_no_rows(scraper):
+    assert scraper.save_to_database(store_info(5.5))
+    assert not scraper.save_to_database(store_info(5.5))
+    assert scraper.conn.execute('SELECT COUNT(*) FROM cashback_history').fetchone()[0] == 3
+
+def test_trends_carry_last_value_forward(scraper):
+    scraper.save_to_database(store_info(5.5))
+    backdate(scraper.conn, 3)
+    scraper.save_to_database(store_info(5.5))
+    scraper.save_to_database(store_info(9.0))
+    
+    rows = scraper.conn.execute(api_queries.TRENDS_SQL,
+                                ('2000-01-01', 1, 'Main', 1, 'Main')).fetchall()
+    assert [tuple(row)[1:] for row in rows] == [
+        (5.5, 5.5, 5.5, 1), (5.5, 5.5, 5.5, 1), (5.5, 5.5, 5.5, 1), (7.25, 9.0, 5.5, 2)]
+    
+    # 起始日期之前的记录在起始日期仍然有效
+    start = scraper.conn.execute("SELECT DATE('now', '-1 day')").fetchone()[0]
+    rows = scraper.conn.execute(api_queries.TRENDS_SQL, (start, 1, 'Main', 1, 'Main')).fetchall()
+    assert [(row[0], row[4]) for row in rows][0] == (start, 1)
+
+def test_latest_snapshot_reports_last_observation(scraper):
+    scraper.save_to_database(store_info(5.5))
+    backdate(scraper.conn, 3)
+    scraper.save_to_database(store_info(5.5))
+    
+    now = scraper.conn.execute("SELECT datetime('now')").fetchone()[0]
+    sql = api_queries.STORE_LATEST_SQL.format(where=api_queries.where_clause(['sl.store_id = ?']))
+    rows = scraper.conn.execute(sql, (1, 50)).fetchall()
+    assert len(rows) == 3
+    assert all(row['scraped_at'] >= now[:16] for row in rows)
+
+def test_recent_scrapes_count_unchanged_observations(scraper):
+    scraper.save_to_database(store_info(5.5))
+    backdate(scraper.conn, 3)
+    scraper.save_to_database(store_info(5.5))
+    scraper.save_to_database(store_info(5.5))
+    
+    dashboard = dashboard_counters.read_dashboard(scraper.conn, 'rows')
+    assert dashboard['total_records'] == 3
+    assert dashboard['recent_scrapes'] == 6
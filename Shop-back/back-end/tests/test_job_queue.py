@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+job_queue测试：按URL去重、租用/续租/租约过期、交还和完成、重试次数上限
+"""
+import pytest
+
+from job_queue import (JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_LEASED, JOB_PENDING,
+                       RUN_CANCELLED, RUN_COMPLETED, RUN_RUNNING, ScrapeJobQueue, init_queue_tables)
+
+URLS = [f'https://www.shopback.com.au/store-{i}' for i in range(3)]
+
+@pytest.fixture
+def queue(pool):
+    with pool.writer() as conn:
+        init_queue_tables(conn.cursor())
+        conn.commit()
+    return ScrapeJobQueue(pool, max_attempts=2)
+
+def expire_leases(pool):
+    """让所有租约过期"""
+    with pool.writer() as conn:
+        conn.execute("UPDATE scrape_jobs SET lease_expires_at = datetime('now', '-1 seconds')")
+        conn.commit()
+
+def test_create_run_dedups_urls(queue):
+    run = queue.create_run('batch', URLS + URLS[:1])
+    assert (run.total, run.duplicates) == (3, 1)
+    
+    # 其他提交中未完成的URL不重复加入
+    second = queue.create_run('batch', URLS[:2])
+    assert (second.total, second.duplicates, second.state) == (0, 2, RUN_COMPLETED)
+
+def test_lease_in_order_and_exclusive(queue):
+    queue.create_run('batch', URLS)
+    run, jobs = queue.lease('worker-1', 2, 60)
+    assert [url for _, url in jobs] == URLS[:2]
+    assert run.state == RUN_RUNNING
+    assert run.jobs == {JOB_LEASED: 2, JOB_PENDING: 1}
+    
+    _, rest = queue.lease('worker-2', 10, 60)
+    assert [url for _, url in rest] == URLS[2:]
+    assert queue.lease('worker-3', 10, 60) is None
+
+def test_renew_keeps_lease_for_owner_only(pool, queue):
+    queue.create_run('batch', URLS[:2])
+    _, jobs = queue.lease('worker-1', 10, 60)
+    expire_leases(pool)
+    
+    queue.renew('worker-2', [job_id for job_id, _ in jobs], 60)
+    queue.renew('worker-1', [jobs[0][0]], 60)
+    
+    # 只有过期未续租的任务可以被其他worker租用
+    _, taken = queue.lease('worker-2', 10, 60)
+    assert taken == [jobs[1]]
+
+def test_expired_lease_fails_after_max_attempts(pool, queue):
+    run = queue.create_run('batch', URLS[:1])
+    for owner in ('worker-1', 'worker-2'):
+        _, jobs = queue.lease(owner, 10, 60)
+        assert len(jobs) == 1
+        expire_leases(pool)
+    
+    assert queue.lease('worker-3', 10, 60) is None
+    run = queue.get_run(run.id)
+    assert run.state == RUN_COMPLETED
+    assert run.jobs == {JOB_FAILED: 1}
+    assert queue.job_errors(run.id)[0]['attempts'] == 2
+
+def test_release_retries_until_max_attempts(queue):
+    run = queue.create_run('batch', URLS[:1])
+    _, jobs = queue.lease('worker-1', 10, 60)
+    queue.release(run.id, [job_id for job_id, _ in jobs], error='timeout')
+    assert queue.get_run(run.id).jobs == {JOB_PENDING: 1}
+    
+    _, jobs = queue.lease('worker-1', 10, 60)
+    queue.release(run.id, [job_id for job_id, _ in jobs], error='timeout')
+    run = queue.get_run(run.id)
+    assert (run.state, run.jobs) == (RUN_COMPLETED, {JOB_FAILED: 1})
+    assert queue.job_errors(run.id)[0]['error_message'] == 'timeout'
+
+def test_complete_finishes_run(queue):
+    run = queue.create_run('batch', URLS)
+    _, jobs = queue.lease('worker-1', 10, 60)
+    queue.complete(run.id, [(jobs[0][0], True, None), (jobs[1][0], False, 'parse error')])
+    assert queue.get_run(run.id).state == RUN_RUNNING
+    
+    queue.complete(run.id, [(jobs[2][0], True, None)])
+    run = queue.get_run(run.id)
+    assert run.state == RUN_COMPLETED
+    assert run.jobs == {JOB_DONE: 2, JOB_FAILED: 1}
+    assert run.summary()['progress'] == 1.0
+    
+    # 完成后同一URL可以再次提交
+    assert queue.create_run('batch', URLS[:1]).total == 1
+
+def test_cancel_keeps_cancelled_jobs(queue):
+    run = queue.create_run('batch', URLS)
+    _, jobs = queue.lease('worker-1', 1, 60)
+    assert queue.cancel(run.id)
+    queue.complete(run.id, [(jobs[0][0], True, None)])
+    
+    run = queue.get_run(run.id)
+    assert (run.state, run.jobs) == (RUN_CANCELLED, {JOB_CANCELLED: 3})
+    assert queue.counts() == {"active_runs": 0, "pending_jobs": 0, "leased_jobs": 0}
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+page_cursor测试：游标往返、无效或其他列表的游标、按页翻完历史记录不重复不遗漏
+"""
+import base64
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from models import StoreInfo
+from page_cursor import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, next_cursor
+
+def test_round_trip():
+    cursor = encode_cursor('history', '2024-05-01 10:00:00', 42)
+    assert '=' not in cursor and '+' not in cursor and '/' not in cursor
+    assert decode_cursor('history', cursor) == ('2024-05-01 10:00:00', 42)
+
+def test_cursor_of_other_list_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor('stores', encode_cursor('history', '2024-05-01 10:00:00', 42))
+
+@pytest.mark.parametrize('payload', [
+    'not-base64!',
+    base64.urlsafe_b64encode(b'{"kind": "history"}').decode(),
+    base64.urlsafe_b64encode(json.dumps(['history', '2024-05-01', '42']).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(['history', 20240501, 42]).encode()).decode(),
+])
+def test_invalid_cursor_raises_value_error(payload):
+    with pytest.raises(ValueError):
+        decode_cursor('history', payload)
+
+def test_next_cursor_only_for_full_page():
+    rows = [{'id': 3, 'scraped_at': '2024-05-02'}, {'id': 2, 'scraped_at': '2024-05-01'}]
+    assert next_cursor('history', rows, 3, 'scraped_at') is None
+    assert next_cursor('history', [], 0, 'scraped_at') is None
+    assert decode_cursor('history', next_cursor('history', rows, 2, 'scraped_at')) == ('2024-05-01', 2)
+
+def test_history_pages_through_api(scraper, monkeypatch):
+    import fapi
+    monkeypatch.setattr(fapi, 'db_path', scraper.db_path)
+    fapi.bump_generation()
+    for i in range(5):
+        scraper.save_to_database(StoreInfo(
+            name=f'Store {i}', main_cashback=f'{i}%', main_rate_numeric=float(i), detailed_rates=[],
+            is_upsized=False, previous_offer=None, url=f'https://www.shopback.com.au/store-{i}',
+            last_updated='', scraping_success=True))
+    
+    client = TestClient(fapi.app)
+    pages, cursor = [], None
+    while True:
+        params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+        response = client.get('/api/history', params=params)
+        assert response.status_code == 200
+        pages.append([row['id'] for row in response.json()])
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+    
+    assert pages == [[5, 4], [3, 2], [1]]
+    assert client.get('/api/history', params={'cursor': 'bogus'}).status_code == 400
+    assert client.get('/api/history', params={
+        'cursor': encode_cursor('stores', '2024-05-01', 1)}).status_code == 400
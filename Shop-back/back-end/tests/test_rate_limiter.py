@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+rate_limiter测试：所有任务共用按host限速器，任务自己的速率上限叠加在其上
+"""
+import threading
+import time
+
+import requests
+
+from rate_limiter import HostRateLimiter, RateCap, ThrottledAdapter, limited_by
+
+def make_session(limiter: HostRateLimiter) -> requests.Session:
+    session = requests.Session()
+    adapter = ThrottledAdapter(limiter, pool_maxsize=8)
+    session.mount('http://', adapter)
+    return session
+
+def run_concurrently(session, url: str, caps, requests_each: int) -> float:
+    """每个cap一个线程（相当于一条流水线的fetch线程）同时发请求，返回总耗时"""
+    def fetch(cap):
+        with limited_by(cap):
+            for _ in range(requests_each):
+                session.get(url, timeout=5).raise_for_status()
+    
+    threads = [threading.Thread(target=fetch, args=(cap,)) for cap in caps]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - started
+
+def test_concurrent_pipelines_share_host_rate(http_server):
+    """两个任务各自的上限都是10/秒，同一host合计仍不超过共用限速器的10/秒"""
+    limiter = HostRateLimiter(10, burst=10)
+    session = make_session(limiter)
+    elapsed = run_concurrently(session, http_server, [RateCap(10), RateCap(10)], 15)
+    # 30个请求：桶中的10个立即发出，其余20个按0.1秒间隔，约2秒；各用各的限速器时约1.4秒
+    assert elapsed >= 1.8
+    host = http_server.split('//')[1]
+    assert limiter.stats()['hosts'][host]['requests'] == 30
+
+def test_batches_of_one_run_share_its_cap(http_server):
+    """同一提交的两个批次共用一个RateCap，合计不超过提交的速率"""
+    session = make_session(HostRateLimiter(0))
+    cap = RateCap(20)
+    elapsed = run_concurrently(session, http_server, [cap, cap], 10)
+    # 20个请求按0.05秒间隔，约0.95秒；各自一个上限时约0.45秒
+    assert elapsed >= 0.9
+
+def test_throttle_pauses_every_job_on_the_host(http_server):
+    """一个任务收到Retry-After后，其他任务对同一host的请求也要等待"""
+    limiter = HostRateLimiter(0)
+    session = make_session(limiter)
+    host = http_server.split('//')[1]
+    limiter.throttle(host, 0.5)
+    elapsed = run_concurrently(session, http_server, [RateCap(0)], 1)
+    assert elapsed >= 0.45
+
+def test_retry_budget_is_shared():
+    """重试预算属于共用的限速器，用完后任何任务都不再重试"""
+    limiter = HostRateLimiter(0, retry_budget=None)
+    limiter.retry_budget.balance = 1.0
+    assert limiter.retry_delay('a', 0) is not None
+    assert limiter.retry_delay('b', 0) is None
+    assert limiter.stats()['retry_budget_exhausted'] == 1
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+scrape_scheduler测试：抓取间隔的上下限、upsized和失败退避，到期商家的排序和每次调度的数量上限
+"""
+import sqlite3
+
+import pytest
+
+from scrape_scheduler import ScrapeScheduler
+
+@pytest.mark.parametrize('changes, observed_days, is_upsized, failures, expected', [
+    (0, 0, False, 0, 6),      # 新商家按每天变化一次
+    (30, 30, False, 0, 6),
+    (0, 30, False, 0, 24),    # 不变化的商家不超过最长间隔
+    (300, 30, False, 0, 1),   # 频繁变化的商家不低于最短间隔
+    (0, 30, True, 0, 2),      # upsized的商家
+    (0, 0, False, 1, 12),     # 连续失败按2^n退避
+    (0, 0, False, 3, 24),
+    (300, 30, False, 2, 4),
+])
+def test_interval_hours(changes, observed_days, is_upsized, failures, expected):
+    scheduler = ScrapeScheduler()
+    assert scheduler.interval_hours(changes, observed_days, is_upsized, failures) == pytest.approx(expected)
+
+def test_tick_budget():
+    scheduler = ScrapeScheduler(tick_minutes=10, baseline_interval_hours=6)
+    assert scheduler.tick_budget(0) == 1
+    assert scheduler.tick_budget(36) == 1
+    assert scheduler.tick_budget(100) == 3
+
+def add_store(conn, name: str, updated_hours_ago: float, created_days_ago: float = 40) -> str:
+    """没有比例变化的商家：观测满30天时间隔24小时，新商家间隔6小时"""
+    url = f'https://www.shopback.com.au/{name}'
+    conn.execute(f'''
+        INSERT INTO stores (name, url, created_at, updated_at)
+        VALUES (?, ?, datetime('now', '-{created_days_ago} days'), datetime('now', '-{updated_hours_ago} hours'))
+    ''', (name, url))
+    conn.commit()
+    return url
+
+def test_due_stores_ordered_by_overdue_within_budget(scraper):
+    conn = scraper.conn
+    add_store(conn, 'recent', 10)
+    add_store(conn, 'overdue', 30)
+    add_store(conn, 'very-overdue', 48)
+    
+    # 预算足够时返回全部到期的商家，逾期越久越靠前
+    generous = ScrapeScheduler(tick_minutes=360, baseline_interval_hours=6)
+    assert [plan.name for plan in generous.due_stores(conn)] == ['very-overdue', 'overdue']
+    plan = generous.plan(conn)[0]
+    assert (plan.interval_hours, plan.priority) == (24, pytest.approx(2, rel=0.01))
+    
+    # 默认预算：3个商家每次调度只提交1个
+    assert [plan.name for plan in ScrapeScheduler().due_stores(conn)] == ['very-overdue']
+
+def test_failed_attempts_back_off(scraper):
+    conn = scraper.conn
+    url = add_store(conn, 'failing', 30, created_days_ago=0)
+    conn.execute('''
+        INSERT INTO scrape_runs (kind, state) VALUES ('scheduled', 'completed')
+    ''')
+    conn.execute('''
+        INSERT INTO scrape_jobs (run_id, url, state, attempts, finished_at)
+        VALUES (1, ?, 'failed', 3, datetime('now', '-8 hours'))
+    ''', (url,))
+    conn.commit()
+    
+    # 间隔从最近一次失败开始计算并加倍：8小时前失败，6小时的间隔退避到12小时
+    scheduler = ScrapeScheduler()
+    plan = scheduler.plan(conn)[0]
+    assert (plan.failures, plan.interval_hours) == (1, 12)
+    assert plan.priority == pytest.approx(8 / 12, rel=0.01)
+    assert scheduler.due_stores(conn) == []
+
+def test_store_attempts_without_queue_tables():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    assert ScrapeScheduler().store_attempts(conn) == {}